@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# Copyright 2022, Blue Brain Project, EPFL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmark the conditional entropy against the masked array implementation."""
+import argparse
+import sys
+import timeit
+
+import numpy as np
+from numpy import ma
+
+from atlannot.evaluation import conditional_entropy, entropy
+
+
+def parse_args():
+    """Parse arguments."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shape", type=int, nargs=3, default=(50, 160, 228))
+    parser.add_argument("--n-labels", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=3)
+    return parser.parse_args()
+
+
+def conditional_entropy_masked(nissl, atlas):
+    """Compute the conditional entropy with one masked volume per label.
+
+    This is the original implementation of ``conditional_entropy``.
+    """
+    value_range = nissl.min(), nissl.max()
+    weighted_entropies = []
+    n_voxels = 0
+    for label, count in zip(*np.unique(atlas, return_counts=True)):
+        if label == 0:
+            continue
+        n_voxels += count
+        nissl_region = ma.masked_where(atlas != label, nissl)
+        entropy_score = entropy(nissl_region, value_range=value_range)
+        weighted_entropies.append(entropy_score * count)
+
+    return np.sum(weighted_entropies) / n_voxels
+
+
+def main():
+    """Run the benchmark."""
+    args = parse_args()
+    rng = np.random.default_rng(0)
+    atlas = rng.integers(0, args.n_labels, size=args.shape, dtype=np.uint32)
+    nissl = rng.random(args.shape, dtype=np.float32)
+    print(f"Volume shape {tuple(args.shape)}, {args.n_labels} labels")
+
+    result_masked = conditional_entropy_masked(nissl, atlas)
+    result = conditional_entropy(nissl, atlas)
+    print(f"Results: {result_masked!r} (masked) / {result!r} (joint histogram)")
+    if not np.isclose(result, result_masked):
+        print("ERROR: the results differ")
+        return 1
+
+    timer_masked = timeit.Timer(lambda: conditional_entropy_masked(nissl, atlas))
+    timer = timeit.Timer(lambda: conditional_entropy(nissl, atlas))
+    time_masked = min(timer_masked.repeat(args.repeat, number=1))
+    time = min(timer.repeat(args.repeat, number=1))
+    print(f"Masked arrays:   {time_masked:8.3f} s")
+    print(f"Joint histogram: {time:8.3f} s")
+    print(f"Speedup:         {time_masked / time:8.1f}x")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
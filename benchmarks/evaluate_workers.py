@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# Copyright 2022, Blue Brain Project, EPFL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmark the atlas evaluation for different numbers of worker processes."""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+from atlannot.evaluation import evaluate
+from atlannot.region_meta import RegionMeta
+
+
+def parse_args():
+    """Parse arguments."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shape", type=int, nargs=3, default=(64, 160, 228))
+    parser.add_argument("--n-groups", type=int, default=8)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count())
+    return parser.parse_args()
+
+
+def make_data(shape, n_groups):
+    """Create a synthetic region hierarchy, atlases and Nissl volume.
+
+    The hierarchy has `n_groups` regions below the root, each of them with
+    ten leaf regions. Each leaf region occupies a block in the atlas, and the
+    reference is a shifted copy of the atlas.
+    """
+    leaf_ids = []
+    children = []
+    for group in range(n_groups):
+        group_id = 100 * (group + 1)
+        leaves = [group_id + i for i in range(1, 11)]
+        leaf_ids.extend(leaves)
+        children.append(
+            make_region(group_id, 1, [make_region(i, group_id) for i in leaves])
+        )
+    rm = RegionMeta.from_dict(make_region(1, None, children))
+
+    rng = np.random.default_rng(0)
+    block_labels = rng.choice(leaf_ids, size=(shape[0] // 8 + 1, shape[1] // 8 + 1))
+    atlas = np.repeat(np.repeat(block_labels, 8, axis=0), 8, axis=1)
+    atlas = np.broadcast_to(atlas[: shape[0], : shape[1], np.newaxis], shape)
+    atlas = np.ascontiguousarray(atlas, dtype=np.uint32)
+    reference = np.roll(atlas, 3, axis=1)
+    nissl = rng.random(shape, dtype=np.float32)
+    groups = {f"Group {i}": [100 * (i + 1)] for i in range(n_groups)}
+
+    return atlas, nissl, reference, rm, groups
+
+
+def make_region(id_, parent_id, children=()):
+    """Create the structure graph entry of a region."""
+    return {
+        "id": id_,
+        "atlas_id": -1,
+        "ontology_id": 1,
+        "acronym": f"R{id_}",
+        "name": f"Region {id_}",
+        "color_hex_triplet": "FFFFFF",
+        "graph_order": 0,
+        "st_level": 0,
+        "hemisphere_id": 3,
+        "parent_structure_id": parent_id,
+        "children": list(children),
+    }
+
+
+def main():
+    """Run the benchmark."""
+    args = parse_args()
+    atlas, nissl, reference, rm, groups = make_data(args.shape, args.n_groups)
+    print(f"Volume shape {tuple(args.shape)}, {len(groups)} region groups")
+
+    serial_time = None
+    serial_results = None
+    for workers in range(1, args.max_workers + 1):
+        start = time.perf_counter()
+        results = evaluate(
+            atlas,
+            nissl,
+            reference,
+            rm,
+            groups,
+            workers=workers,
+        )
+        elapsed = time.perf_counter() - start
+        if serial_time is None:
+            serial_time = elapsed
+            serial_results = results
+        else:
+            np.testing.assert_equal(results, serial_results)
+        speedup = serial_time / elapsed
+        print(f"{workers:3d} workers: {elapsed:8.3f} s, speedup {speedup:5.2f}x")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# Copyright 2022, Blue Brain Project, EPFL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmark the while-loop correction of the merging.
+
+The original loop collapses one unmatched region at a time, while
+`collapse_unmatched` collapses all of them at once until a fixed point is
+reached. The hierarchy is synthetic and every region has four children.
+The second atlas contains all leaf regions, and the first one only a
+random fraction of them. The unmatched leaves are collapsed into their
+parents.
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from atlannot.merge.common import collapse_unmatched, descendants, replace
+from atlannot.region_meta import RegionMeta
+
+
+def parse_args():
+    """Parse arguments."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n-regions", type=int, default=1300)
+    parser.add_argument("--fraction", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def make_region_meta(n_regions):
+    """Create a synthetic hierarchy where every region has four children."""
+    rm = RegionMeta()
+    rm.root_id = 1
+    rm.parent_id[1] = rm.background_id
+    rm.children_ids[rm.background_id].append(1)
+    rm.children_ids[1] = []
+    for id_ in range(2, n_regions + 1):
+        parent_id = id_ // 4 + 1
+        rm.parent_id[id_] = parent_id  # type: ignore
+        rm.children_ids[parent_id].append(id_)
+        rm.children_ids[id_] = []
+
+    return rm
+
+
+def while_loop(ids_1, ids_2, allowed_1, allowed_2, rm):
+    """Run the original while-loop correction."""
+    ids_to_correct = set(ids_1) - set(ids_2)
+    while len(ids_to_correct) > 0:
+        id_ = ids_to_correct.pop()
+        while id_ not in allowed_2:
+            id_ = rm.parent(id_)
+        for child in descendants(id_, allowed_1, rm):
+            replace(ids_1, child, id_)
+        for child in descendants(id_, allowed_2, rm):
+            replace(ids_2, child, id_)
+        ids_to_correct = set(ids_1) - set(ids_2)
+
+
+def main():
+    """Run the benchmark."""
+    args = parse_args()
+    rng = np.random.default_rng(args.seed)
+    rm = make_region_meta(args.n_regions)
+    region_ids = np.arange(1, args.n_regions + 1)
+    is_leaf = np.array([rm.is_leaf(id_) for id_ in region_ids])
+    leaves = region_ids[is_leaf]
+    size = int(args.fraction * len(leaves))
+    ids_v2 = np.union1d(region_ids[~is_leaf], rng.choice(leaves, size, replace=False))
+    ids_v3 = leaves.copy()
+    allowed_v2 = rm.ancestors(ids_v2)
+    allowed_v3 = rm.ancestors(ids_v3)
+    print(f"{len(ids_v2)} CCFv2 and {len(ids_v3)} CCFv3 region IDs")
+
+    expected_v3, expected_v2 = ids_v3.copy(), ids_v2.copy()
+    start = time.perf_counter()
+    while_loop(expected_v3, expected_v2, allowed_v3, allowed_v2, rm)
+    time_loop = time.perf_counter() - start
+
+    result_v3, result_v2 = ids_v3.copy(), ids_v2.copy()
+    start = time.perf_counter()
+    collapse_unmatched(result_v3, result_v2, allowed_v3, allowed_v2, rm)
+    time_fixed_point = time.perf_counter() - start
+
+    if not (
+        np.array_equal(result_v2, expected_v2)
+        and np.array_equal(result_v3, expected_v3)
+    ):
+        print("ERROR: the results differ")
+        return 1
+
+    print(f"While loop:  {time_loop:8.3f} s")
+    print(f"Fixed point: {time_fixed_point:8.3f} s")
+    print(f"Speedup:     {time_loop / time_fixed_point:8.1f}x")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# Copyright 2022, Blue Brain Project, EPFL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmark the parsing and the export of a large synthetic region hierarchy.
+
+The hierarchy is a balanced tree where every region has `--n-children`
+children, plus a chain of `--chain-depth` regions below the first leaf.
+The chain is deeper than the default recursion limit, which the original
+recursive implementation couldn't handle.
+"""
+import argparse
+import io
+import sys
+import time
+from contextlib import redirect_stdout
+
+from atlannot.region_meta import RegionMeta
+
+
+def parse_args():
+    """Parse arguments."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n-regions", type=int, default=100_000)
+    parser.add_argument("--n-children", type=int, default=8)
+    parser.add_argument("--chain-depth", type=int, default=5_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    return parser.parse_args()
+
+
+def make_structure_graph(n_regions, n_children, chain_depth):
+    """Create a synthetic structure graph."""
+    regions: list[dict] = []
+    for id_ in range(1, n_regions + 1):
+        if id_ == 1:
+            parent_id = None
+        elif id_ <= n_regions - chain_depth:
+            parent_id = (id_ - 2) // n_children + 1
+        else:
+            parent_id = id_ - 1
+        regions.append(
+            {
+                "id": id_,
+                "atlas_id": id_,
+                "ontology_id": 1,
+                "acronym": f"R{id_}",
+                "name": f"Region number {id_}",
+                "color_hex_triplet": "FFFFFF",
+                "graph_order": id_ - 1,
+                "st_level": None,
+                "hemisphere_id": 3,
+                "parent_structure_id": parent_id,
+                "children": [],
+            }
+        )
+    for region in regions[1:]:
+        regions[region["parent_structure_id"] - 1]["children"].append(region)
+
+    return regions[0]
+
+
+def best_time(func, repeat):
+    """Find the best run time of a function call and return its result."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    """Run the benchmark."""
+    args = parse_args()
+    structure_graph = make_structure_graph(
+        args.n_regions, args.n_children, args.chain_depth
+    )
+
+    time_parse, rm = best_time(
+        lambda: RegionMeta.from_dict(structure_graph), args.repeat
+    )
+    print(f"{rm.size} regions, depth {rm.depth}")
+    time_iter, _ = best_time(lambda: list(rm.iter_regions()), args.repeat)
+    time_export, exported = best_time(rm.to_dict, args.repeat)
+    with redirect_stdout(io.StringIO()):
+        time_print, _ = best_time(rm.print_regions, args.repeat)
+
+    # The recursive comparison of nested dictionaries would fail, so compare
+    # the regions one by one
+    stack = [(exported, structure_graph)]
+    while stack:
+        region, expected = stack.pop()
+        if {**region, "children": len(region["children"])} != {
+            **expected,
+            "children": len(expected["children"]),
+        }:
+            print(f"ERROR: region {expected['id']} differs after the export")
+            return 1
+        stack.extend(zip(region["children"], expected["children"]))
+
+    print(f"from_dict:     {time_parse:8.3f} s")
+    print(f"iter_regions:  {time_iter:8.3f} s")
+    print(f"to_dict:       {time_export:8.3f} s")
+    print(f"print_regions: {time_print:8.3f} s")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# Copyright 2022, Blue Brain Project, EPFL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmark the process startup with and without region metadata snapshots.
+
+Every run starts a fresh Python process that loads the structure graph with
+``RegionMeta.load_json``, once parsing the JSON file and once loading the
+cached snapshot. Use the real brain region hierarchy with
+
+    python benchmarks/region_meta_startup.py --structure-graph 1.json
+
+Without a structure graph a synthetic one is generated.
+"""
+import argparse
+import json
+import pathlib
+import subprocess
+import sys
+import tempfile
+import time
+
+SCRIPT = """
+import sys
+import time
+start = time.perf_counter()
+from atlannot.region_meta import RegionMeta
+json_path, use_cache, cache_dir = sys.argv[1:]
+rm = RegionMeta.load_json(json_path, use_cache=use_cache == "1", cache_dir=cache_dir)
+print(time.perf_counter() - start)
+"""
+
+
+def parse_args():
+    """Parse arguments."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--structure-graph", help="path to the brain regions JSON")
+    parser.add_argument("--n-regions", type=int, default=1300)
+    parser.add_argument("--repeat", type=int, default=10)
+    return parser.parse_args()
+
+
+def make_structure_graph(n_regions):
+    """Create a synthetic structure graph where every region has four children."""
+    regions: list[dict] = []
+    for id_ in range(1, n_regions + 1):
+        regions.append(
+            {
+                "id": id_,
+                "atlas_id": id_,
+                "ontology_id": 1,
+                "acronym": f"R{id_}",
+                "name": f"Region number {id_}",
+                "color_hex_triplet": "FFFFFF",
+                "graph_order": id_ - 1,
+                "st_level": None,
+                "hemisphere_id": 3,
+                "parent_structure_id": id_ // 4 + 1 if id_ > 1 else None,
+                "children": [],
+            }
+        )
+    for region in regions[1:]:
+        regions[region["parent_structure_id"] - 1]["children"].append(region)
+
+    return regions[0]
+
+
+def run(json_path, use_cache, cache_dir, repeat):
+    """Run fresh processes and measure their startup times.
+
+    Returns the best total process time and the best time spent in the
+    import and the loading of the region metadata.
+    """
+    command = [sys.executable, "-c", SCRIPT, str(json_path), str(int(use_cache))]
+    command.append(str(cache_dir))
+    process_times = []
+    load_times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = subprocess.run(command, check=True, capture_output=True, text=True)
+        process_times.append(time.perf_counter() - start)
+        load_times.append(float(output.stdout))
+
+    return min(process_times), min(load_times)
+
+
+def main():
+    """Run the benchmark."""
+    args = parse_args()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.structure_graph:
+            json_path = pathlib.Path(args.structure_graph)
+        else:
+            json_path = pathlib.Path(tmp_dir) / "structure_graph.json"
+            with json_path.open("w") as fh:
+                json.dump(make_structure_graph(args.n_regions), fh)
+        cache_dir = pathlib.Path(tmp_dir) / "cache"
+        print(f"Structure graph {json_path}, {json_path.stat().st_size} bytes")
+
+        # Warm up and create the snapshot
+        run(json_path, True, cache_dir, repeat=1)
+        for use_cache in [False, True]:
+            label = "Snapshot:" if use_cache else "JSON:"
+            process_time, load_time = run(json_path, use_cache, cache_dir, args.repeat)
+            print(
+                f"{label:10s} process {process_time:7.3f} s, "
+                f"import and load {load_time:7.3f} s"
+            )
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# Copyright 2022, Blue Brain Project, EPFL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmark the bulk region name queries against `in_region_like`.
+
+The region name patterns are those used by the atlas merging. Run it on
+the real brain region hierarchy with
+
+    python benchmarks/region_name_queries.py --structure-graph 1.json
+
+Without a structure graph a synthetic hierarchy is used.
+"""
+import argparse
+import sys
+import time
+
+from atlannot.region_meta import RegionMeta
+
+PATTERNS = [
+    "Medial amygdalar nucleus",
+    "Subiculum",
+    "Bed nuclei of the stria terminalis",
+    "Paraventricular hypothalamic nucleus",
+    "Visual areas",
+    "ayer 1",
+    "ayer 2/3",
+    "ayer 4",
+    "ayer 5",
+    "ayer 6a",
+    "ayer 6b",
+    "fiber tracts",
+    "ventricular systems",
+    "Interpeduncular nucleus",
+    "Frontal pole, cerebral cortex",
+]
+
+
+def parse_args():
+    """Parse arguments."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--structure-graph", help="path to the brain regions JSON")
+    parser.add_argument("--n-regions", type=int, default=1300)
+    parser.add_argument("--repeat", type=int, default=3)
+    return parser.parse_args()
+
+
+def make_region_meta(n_regions):
+    """Create a synthetic hierarchy with names containing the patterns.
+
+    Every region has up to four children, and the names cycle through the
+    patterns so that all of them match some subtrees.
+    """
+    rm = RegionMeta()
+    rm.root_id = 1
+    rm.parent_id[1] = rm.background_id
+    rm.children_ids[rm.background_id].append(1)
+    rm.children_ids[1] = []
+    rm.name_[1] = "root"
+    for id_ in range(2, n_regions + 1):
+        parent_id = id_ // 4 + 1
+        rm.parent_id[id_] = parent_id  # type: ignore
+        rm.children_ids[parent_id].append(id_)
+        rm.children_ids[id_] = []
+        rm.name_[id_] = f"{PATTERNS[id_ % len(PATTERNS)]} region {id_}"
+
+    return rm
+
+
+def query_loop(rm, region_ids):
+    """Run all queries with one `in_region_like` call per region."""
+    return {
+        pattern: {id_ for id_ in region_ids if rm.in_region_like(pattern, id_)}
+        for pattern in PATTERNS
+    }
+
+
+def query_bulk(rm, region_ids):
+    """Run all queries with the bulk queries of the frozen hierarchy."""
+    tree = rm.freeze()
+    return {
+        pattern: {id_ for id_ in region_ids if id_ in tree.regions_like(pattern)}
+        for pattern in PATTERNS
+    }
+
+
+def best_time(func, *args, repeat):
+    """Find the best run time of a function call."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    """Run the benchmark."""
+    args = parse_args()
+    if args.structure_graph:
+        rm = RegionMeta.load_json(args.structure_graph)
+    else:
+        rm = make_region_meta(args.n_regions)
+    region_ids = [id_ for id_ in rm.parent_id if id_ != rm.background_id]
+    print(f"{len(region_ids)} regions, {len(PATTERNS)} patterns")
+
+    if query_loop(rm, region_ids) != query_bulk(rm, region_ids):
+        print("ERROR: the results differ")
+        return 1
+
+    time_loop = best_time(query_loop, rm, region_ids, repeat=args.repeat)
+    time_bulk = best_time(query_bulk, rm, region_ids, repeat=args.repeat)
+    print(f"in_region_like: {time_loop:8.4f} s")
+    print(f"regions_like:   {time_bulk:8.4f} s")
+    print(f"Speedup:        {time_loop / time_bulk:8.1f}x")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
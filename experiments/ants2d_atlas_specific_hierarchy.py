@@ -20,7 +20,7 @@ import numpy as np
 import utils
 
 from atlannot.ants import register, stack_2d_transforms, transform
-from atlannot.atlas.align import unfurl_regions
+from atlannot.atlas.projection import LabelProjection
 from atlannot.region_meta import RegionMeta
 from atlannot.utils import load_volume
 
@@ -142,11 +142,10 @@ def preprocess_atlases(*atlases, region_meta=None, hierarchy_level=10):
     new_atlases : Iterable of np.ndarray
         Preprocessed atlases
     """
-    atlases_pre = []
-    for atlas in atlases:
-        atlas_pre = unfurl_regions(atlas, region_meta)
-        atlases_pre.append(atlas_pre[hierarchy_level])
-    return [atlas.astype(np.float32) for atlas in atlases_pre]
+    # The hierarchy level counts the levels removed from the deepest one
+    level = max(region_meta.level.values()) - hierarchy_level
+    projection = LabelProjection.to_level(region_meta, level)
+    return [projection(atlas).astype(np.float32) for atlas in atlases]
 
 
 if __name__ == "__main__":
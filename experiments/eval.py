@@ -24,7 +24,7 @@ import utils
 from skimage.metrics import structural_similarity as ssim
 from warpme.metrics import iou_score
 
-from atlannot.atlas.align import get_misalignment
+from atlannot.evaluation import SliceCache, image_similarity
 from atlannot.utils import atlas_symmetry_score, load_volume, stain_symmetry_score
 
 
@@ -40,6 +40,15 @@ def parse_args():
         otherwise all experiments will be processed.
         """,
     )
+    parser.add_argument(
+        "--cache-dir",
+        type=pathlib.Path,
+        default=pathlib.Path.home() / ".cache" / "atlannot" / "slices",
+        help="""\
+        Directory of the slice cache. The label pair counts of the atlas
+        slices are stored there and reused when evaluating again.
+        """,
+    )
     return parser.parse_args()
 
 
@@ -69,8 +78,10 @@ def main():
     volumes = load_volumes()
 
     print("Evaluation")
+    cache = SliceCache(args.cache_dir)
     for experiment_path in sorted(experiments):
-        evaluate(experiment_path, volumes)
+        evaluate(experiment_path, volumes, cache)
+    print(f"Slice cache: {cache.hits} hits, {cache.misses} misses")
 
 
 def load_volumes():
@@ -90,7 +101,7 @@ def load_volumes():
     return volumes
 
 
-def evaluate(directory, volumes):
+def evaluate(directory, volumes, cache):
     """Evaluate the results.
 
     Parameters
@@ -99,6 +110,8 @@ def evaluate(directory, volumes):
         Diretory of the experiment to evaluate.
     volumes : dict
         Dictionary containing reference volumes.
+    cache : atlannot.evaluation.SliceCache
+        The cache of the per-slice label pair counts.
     """
     metrics_path = directory / "metrics.csv"
     if metrics_path.exists():
@@ -107,14 +120,14 @@ def evaluate(directory, volumes):
         warped = load_volume(directory / "warped_nissl.npy")
         warped_atl = load_volume(directory / "warped_atlas.npy")
         metrics_df = compute_metrics(
-            volumes["avg"], warped, volumes["atl v3"], warped_atl
+            volumes["avg"], warped, volumes["atl v3"], warped_atl, cache
         )
         metrics_df.to_csv(metrics_path)
 
     print_scores(directory.name, metrics_df)
 
 
-def compute_metrics(fixed, warped, fixed_atl, warped_atl):
+def compute_metrics(fixed, warped, fixed_atl, warped_atl, cache):
     """Compute different evaluation metrics.
 
     Parameters
@@ -127,6 +140,8 @@ def compute_metrics(fixed, warped, fixed_atl, warped_atl):
         Fixed atlas.
     warped_atl: np.ndarray
         Registered atlas.
+    cache : atlannot.evaluation.SliceCache
+        The cache of the per-slice label pair counts of the atlases.
 
     Returns
     -------
@@ -134,15 +149,16 @@ def compute_metrics(fixed, warped, fixed_atl, warped_atl):
         DataFrame containing the resulting metrics.
     """
     ssim_score = ssim_many(fixed, warped)
-    misalignment = [
-        get_misalignment(fixed_atl_slice, warped_atl_slice)
-        for fixed_atl_slice, warped_atl_slice in zip(fixed_atl, warped_atl)
-    ]
+    # The fraction of pixels with different labels in every slice
+    confusion = cache.confusion_matrix(fixed_atl, warped_atl)
+    n_pixels = confusion.slice_counts_1.sum(axis=1)
+    misalignment = (n_pixels - confusion.slice_intersection.sum(axis=1)) / n_pixels
     stain_sym = [stain_symmetry_score(img) for img in warped]
     atlas_sym = [atlas_symmetry_score(img) for img in warped_atl]
     iou_average, iou_per_sample = iou_score(
         fixed_atl, warped_atl, k=None, excluded_labels=[0]
     )
+    similarity = image_similarity(fixed, warped, per_slice=True)
 
     all_metrics = pd.DataFrame(
         {
@@ -151,6 +167,7 @@ def compute_metrics(fixed, warped, fixed_atl, warped_atl):
             "SYMS": stain_sym,
             "SYMA": atlas_sym,
             "IOU": iou_per_sample,
+            "NMI": similarity["normalized_mutual_information"],
         }
     )
 
@@ -82,6 +82,7 @@ setup(
     ],
     package_dir={"": "src"},
     packages=find_packages("src"),
+    package_data={"atlannot.merge": ["rules/*.json"]},
     python_requires=">=3.7",
     install_requires=install_requires,
     extras_require=extras_require,
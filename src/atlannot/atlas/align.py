@@ -16,6 +16,9 @@ import warnings
 
 import numpy as np
 
+from atlannot.atlas.projection import LabelProjection
+from atlannot.evaluation import ConfusionMatrix
+
 
 def unfurl_regions(atlas, meta, progress_bar=None):
     """Separate regions by hierarchy level.
@@ -34,6 +37,10 @@ def unfurl_regions(atlas, meta, progress_bar=None):
         - The slice with regions at levels 2 and 1 removed (leaving
           just the background)
 
+    Every level is obtained by applying the projection of
+    `atlannot.atlas.projection.LabelProjection.to_level` to the atlas.
+    Use `UnfurledAtlas` to compute only some levels or slices.
+
     Parameters
     ----------
     atlas : np.ndarray
@@ -53,29 +60,208 @@ def unfurl_regions(atlas, meta, progress_bar=None):
         `(n_levels, n_slices, height, width)` where `n_levels` is
         the maximal region hierarchy level across all slices.
     """
-    max_level = max(meta.level.values())
-    unfurled = [atlas.copy()]
-
-    to_remove = range(max_level, 0, -1)
+    projections = _level_projections(meta)
     if progress_bar is not None:
-        to_remove = progress_bar(to_remove)
+        projections = progress_bar(projections)
 
-    for remove_level in to_remove:
-        atlas = atlas.copy()
-        # Map regions at `remove_level` to the IDs of their parents
-        for region_id in meta.ids_at_level(remove_level):
-            parent_id = meta.parent_id[region_id]
-            atlas[atlas == region_id] = parent_id
-        unfurled.append(atlas)
-
-    unfurled_atlas = np.stack(unfurled)
+    unfurled_atlas = np.empty((max(meta.level.values()) + 1, *atlas.shape), atlas.dtype)
+    for unfurled, (_, projection) in zip(unfurled_atlas, projections):
+        projection(atlas, out=unfurled)
 
     return unfurled_atlas
 
 
-def get_misalignment(data_1, data_2, fg_only=False):
+class UnfurledAtlas:
+    """Lazy version of the output of `unfurl_regions`.
+
+    For every hierarchy level a `atlannot.atlas.projection.LabelProjection`
+    maps the labels to their ancestors at that level. Any level, slice, or
+    region of the unfurled atlas is only computed when it's accessed, so
+    that the full stack of all levels is never constructed.
+
+    Indexing works like for the output of `unfurl_regions`, for example
+    ``unfurled[0]`` is the original atlas, ``unfurled[-1]`` the background
+    only, and ``unfurled[2, 10]`` is the slice 10 of the third level.
+
+    Parameters
+    ----------
+    atlas : np.ndarray
+        An annotation atlas volume with shape `(n_slices, height, width)`.
+    meta : atlannot.region_meta.RegionMeta
+        The region metadata. Holds the information about the region
+        hierarchy in the atlas.
+
+    Attributes
+    ----------
+    atlas : np.ndarray
+        The annotation atlas.
+    levels : list of int
+        The hierarchy level of every entry of the unfurled atlas.
+    projections : list of atlannot.atlas.projection.LabelProjection
+        The projection of the labels onto every level.
+    """
+
+    def __init__(self, atlas, meta):
+        self.atlas = atlas
+        self.levels = []
+        self.projections = []
+        for level, projection in _level_projections(meta):
+            self.levels.append(level)
+            self.projections.append(projection)
+
+    @property
+    def shape(self):
+        """Shape of the unfurled atlas, see `unfurl_regions`."""
+        return (len(self.levels), *self.atlas.shape)
+
+    def __len__(self):
+        """Get the number of levels."""
+        return len(self.levels)
+
+    def __getitem__(self, key):
+        """Compute a part of the unfurled atlas.
+
+        Parameters
+        ----------
+        key
+            Any numpy index into an array of shape `shape`. The first entry
+            selects the levels.
+
+        Returns
+        -------
+        np.ndarray
+            The selected part of the unfurled atlas.
+        """
+        if not isinstance(key, tuple):
+            key = (key,)
+        level_key, *atlas_key = key
+        atlas = self.atlas[tuple(atlas_key)]
+        level_idx = np.arange(len(self.levels))[level_key]
+        if level_idx.ndim == 0:
+            return self.projections[level_idx](atlas)
+
+        unfurled_atlas = np.empty((*level_idx.shape, *atlas.shape), atlas.dtype)
+        for idx in np.ndindex(level_idx.shape):
+            self.projections[level_idx[idx]](atlas, out=unfurled_atlas[idx])
+        return unfurled_atlas
+
+    def __array__(self, dtype=None):
+        """Compute the full unfurled atlas."""
+        unfurled_atlas = self[:]
+        if dtype is not None:
+            unfurled_atlas = unfurled_atlas.astype(dtype)
+        return unfurled_atlas
+
+    def at_level(self, level):
+        """Get the atlas at a given hierarchy level.
+
+        Parameters
+        ----------
+        level : int
+            A hierarchy level. All regions deeper than this level are
+            replaced by their ancestors at this level.
+
+        Returns
+        -------
+        np.ndarray
+            The atlas at the given hierarchy level.
+        """
+        return self[self.levels.index(level)]
+
+
+def level_misalignments(atlas_1, atlas_2, meta, slab_size=32):
+    """Compute the misalignment between two atlases at every hierarchy level.
+
+    The results are the same as those of `get_misalignment` applied to
+    every level of the outputs of `unfurl_regions` for both atlases, but
+    the unfurled atlases are never constructed. Instead, the co-occurring
+    label pairs of the two atlases are counted once, slab by slab, with
+    `atlannot.evaluation.ConfusionMatrix`, and at every level the labels of
+    the pairs are mapped to their ancestors at that level with the same
+    projection as in `unfurl_regions`.
+
+    Parameters
+    ----------
+    atlas_1 : np.ndarray
+        The first annotation atlas. Can have any shape.
+    atlas_2 : np.ndarray
+        The second annotation atlas. Shape should match that of `atlas_1`.
+    meta : atlannot.region_meta.RegionMeta
+        The region metadata. Holds the information about the region
+        hierarchy in the atlas.
+    slab_size : int, optional
+        The number of slices along the first axis that are processed at once.
+        This bounds the size of the temporary arrays.
+
+    Returns
+    -------
+    misalignments : dict
+        Mapping of the hierarchy levels, from the deepest level down to the
+        background level 0, to tuples with the misalignment of all voxels
+        and the misalignment of the foreground voxels, see
+        `get_misalignment`. At a given level all regions below that level
+        are merged into their ancestors at that level.
+
+    Raises
+    ------
+    ValueError
+        If the shapes of the atlases don't match.
+    """
+    confusion = ConfusionMatrix.from_volumes(atlas_1, atlas_2, slab_size=slab_size)
+    labels = confusion.labels
+    pairs = confusion.pairs
+    counts = confusion.pair_counts
+    n_voxels = counts.sum()
+
+    misalignments = {}
+    for level, projection in _level_projections(meta):
+        lut = projection(labels)
+        labels_1 = lut[pairs[:, 0]]
+        labels_2 = lut[pairs[:, 1]]
+        unequal = labels_1 != labels_2
+        foreground = (labels_1 != 0) | (labels_2 != 0)
+        misalignment = counts[unequal].sum() / (n_voxels or 1)
+        fg_misalignment = counts[unequal & foreground].sum() / (
+            counts[foreground].sum() or 1
+        )
+        misalignments[level] = (misalignment, fg_misalignment)
+
+    return misalignments
+
+
+def _level_projections(meta):
+    """Create the projections of the labels onto every hierarchy level.
+
+    Labels at or above a given level, as well as labels that are not part
+    of the region hierarchy, are kept as they are. This is the mapping
+    applied by `unfurl_regions` at each level.
+
+    Parameters
+    ----------
+    meta : atlannot.region_meta.RegionMeta
+        The region metadata.
+
+    Yields
+    ------
+    level : int
+        A hierarchy level, starting from the deepest one down to the
+        background level 0.
+    projection : atlannot.atlas.projection.LabelProjection
+        The projection of the labels onto their ancestors at the given level.
+    """
+    tree = meta.freeze()
+    for level in range(max(meta.level.values()), -1, -1):
+        yield level, LabelProjection.to_level(tree, level)
+
+
+def get_misalignment(
+    data_1, data_2, fg_only=False, return_profiles=False, slab_size=32
+):
     """Compute misalignment between annotation data.
 
+    The data are processed in slabs along the first axis, so that only
+    slab-sized temporary arrays are allocated.
+
     Parameters
     ----------
     data_1 : np.ndarray
@@ -86,11 +272,22 @@ def get_misalignment(data_1, data_2, fg_only=False):
         If true then only the foreground is considered for the evaluation.
         Foreground pixels are complimentary to background. Background is
         where both data arrays are zero.
+    return_profiles : bool, optional
+        If true then the misalignment profiles along all axes are computed
+        in the same pass and returned as well.
+    slab_size : int, optional
+        The number of slices along the first axis that are processed at once.
 
     Returns
     -------
     misalignment : float
         The misalignment between the annotation data.
+    profiles : dict
+        Only returned if `return_profiles` is true. Maps every axis to an
+        array with the misalignment at every position along that axis. For
+        example, ``profiles[0]`` contains the misalignment of every slice.
+        Like for the total misalignment, positions without any pixels
+        considered have a misalignment of zero.
 
     Raises
     ------
@@ -99,17 +296,56 @@ def get_misalignment(data_1, data_2, fg_only=False):
     """
     if data_1.shape != data_2.shape:
         raise ValueError("Data have to be of the same shape")
-    unequal = data_1 != data_2
+    data_1 = np.atleast_1d(data_1)
+    data_2 = np.atleast_1d(data_2)
+    n_dims = data_1.ndim
+
+    # Pixels with different labels are always in the foreground, so only the
+    # number of considered pixels depends on fg_only.
+    n_unequal = [np.zeros(size, dtype=np.int64) for size in data_1.shape]
+    n_pixels = [np.zeros(size, dtype=np.int64) for size in data_1.shape]
+    comparisons: list[tuple[np.ufunc, list[np.ndarray]]] = [(np.not_equal, n_unequal)]
     if fg_only:
-        mask = (data_1 != 0) | (data_2 != 0)
-        unequal = unequal[mask]
-
-    misalignment = np.sum(unequal) / (unequal.size or 1)
+        comparisons.append((np.logical_or, n_pixels))
+    else:
+        for axis, size in enumerate(data_1.shape):
+            n_pixels[axis][:] = data_1.size // max(size, 1)
+
+    buffer = np.empty((min(slab_size, len(data_1)), *data_1.shape[1:]), dtype=bool)
+    for start in range(0, len(data_1), slab_size):
+        slab_1 = data_1[start : start + slab_size]
+        slab_2 = data_2[start : start + slab_size]
+        mask = buffer[: len(slab_1)]
+        for compare, counts in comparisons:
+            compare(slab_1, slab_2, out=mask)
+            if return_profiles:
+                for axis in range(n_dims):
+                    other_axes = tuple(i for i in range(n_dims) if i != axis)
+                    axis_counts = np.count_nonzero(mask, axis=other_axes)
+                    if axis == 0:
+                        counts[0][start : start + len(mask)] += axis_counts
+                    else:
+                        counts[axis] += axis_counts
+            else:
+                # Without profiles only the total count is needed
+                counts[0][start] += np.count_nonzero(mask)
+
+    misalignment = n_unequal[0].sum() / (n_pixels[0].sum() or 1)
+    if not return_profiles:
+        return misalignment
+
+    profiles = {}
+    for axis in range(n_dims):
+        profile = np.zeros(data_1.shape[axis])
+        np.divide(
+            n_unequal[axis], n_pixels[axis], out=profile, where=n_pixels[axis] > 0
+        )
+        profiles[axis] = profile
 
-    return misalignment
+    return misalignment, profiles
 
 
-def specific_label_iou(data_1, data_2, specific_label):
+def specific_label_iou(data_1, data_2, specific_label, index_1=None, index_2=None):
     """Compute intersection over union for a given label.
 
     Parameters
@@ -120,6 +356,12 @@ def specific_label_iou(data_1, data_2, specific_label):
         The second annotation data. Shape should match that of `data_1`.
     specific_label : int
         Label for which it is wanted to compute the IOU.
+    index_1 : atlannot.atlas.region_index.RegionIndex, optional
+        The region index of `data_1`. If both `index_1` and `index_2` are
+        provided then only the voxels of the given label are visited
+        instead of the whole data.
+    index_2 : atlannot.atlas.region_index.RegionIndex, optional
+        The region index of `data_2`.
 
     Returns
     -------
@@ -134,24 +376,93 @@ def specific_label_iou(data_1, data_2, specific_label):
     if data_1.shape != data_2.shape:
         raise ValueError("Data have to be of the same shape")
 
-    data_1 = data_1 == specific_label
-    data_2 = data_2 == specific_label
-
-    intersection = np.logical_and(data_1, data_2)
-    union = np.logical_or(data_1, data_2)
+    if index_1 is not None and index_2 is not None:
+        intersection = index_1.intersection(specific_label, index_2)
+        union = (
+            index_1.count(specific_label) + index_2.count(specific_label) - intersection
+        )
+    else:
+        data_1 = data_1 == specific_label
+        data_2 = data_2 == specific_label
+        intersection = np.logical_and(data_1, data_2).sum()
+        union = np.logical_or(data_1, data_2).sum()
 
-    if union.sum() == 0:
+    if union == 0:
         iou = np.nan
         warnings.warn(
             f"It seems the specific label "
             f"{specific_label} does not exist on the input images."
         )
     else:
-        iou = intersection.sum() / union.sum()
+        iou = intersection / union
 
     return iou
 
 
+def specific_labels_iou(data_1, data_2, labels, slab_size=32):
+    """Compute intersection over union for several labels at once.
+
+    This gives the same results as calling `specific_label_iou` for every
+    label, but the data are only scanned once. The label pairs of the
+    corresponding pixels are counted slab by slab with
+    `atlannot.evaluation.ConfusionMatrix`, and the IOUs of all labels are
+    derived from these counts.
+
+    Parameters
+    ----------
+    data_1 : np.ndarray
+        The first annotation data. Can have any shape.
+    data_2 : np.ndarray
+        The second annotation data. Shape should match that of `data_1`.
+    labels : iterable of int
+        Labels for which it is wanted to compute the IOU.
+    slab_size : int, optional
+        The number of slices along the first axis that are processed at once.
+
+    Returns
+    -------
+    ious : dict
+        Mapping of the labels to their IOU. If a label exists in neither
+        of the data then its IOU is NaN, and a single warning listing all
+        such labels is issued.
+
+    Raises
+    ------
+    ValueError
+        If the shapes of the data don't match.
+    """
+    confusion = ConfusionMatrix.from_volumes(data_1, data_2, slab_size=slab_size)
+    all_labels = confusion.labels
+    pairs = confusion.pairs
+    counts = confusion.pair_counts
+    n_labels = len(all_labels)
+    counts_1 = np.bincount(pairs[:, 0], weights=counts, minlength=n_labels)
+    counts_2 = np.bincount(pairs[:, 1], weights=counts, minlength=n_labels)
+    same = pairs[:, 0] == pairs[:, 1]
+    intersections = np.bincount(
+        pairs[same, 0], weights=counts[same], minlength=n_labels
+    )
+    unions = counts_1 + counts_2 - intersections
+
+    ious = {}
+    missing = []
+    for label in labels:
+        idx = np.searchsorted(all_labels, label)
+        if idx < n_labels and all_labels[idx] == label:
+            ious[label] = intersections[idx] / unions[idx]
+        else:
+            ious[label] = np.nan
+            missing.append(label)
+    if missing:
+        warnings.warn(
+            f"It seems the specific labels {missing} do not exist on the "
+            "input images.",
+            stacklevel=2,
+        )
+
+    return ious
+
+
 def warp(atlas, df_per_slice):
     """Warp the atlas with displacement fields.
 
@@ -0,0 +1,262 @@
+# Copyright 2022, Blue Brain Project, EPFL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Projection of annotation volumes onto coarser levels of the region hierarchy."""
+from __future__ import annotations
+
+from collections.abc import Collection
+
+import numpy as np
+
+from atlannot.region_meta import RegionMeta
+from atlannot.region_tree import RegionTree
+
+
+class LabelProjection:
+    """Lookup table replacing labels of annotation volumes by other labels.
+
+    Region IDs can be too large to index a lookup table directly, so the
+    labels are compacted first: the voxel values are located in the sorted
+    array `labels` with a binary search, and the compact labels then index
+    the array `targets`. A projection is built once and can be applied to
+    any number of volumes.
+
+    Parameters
+    ----------
+    labels
+        The sorted unique labels that are replaced.
+    targets
+        The replacement of every label in `labels`.
+    default
+        The replacement of the values that are not in `labels`. If None,
+        these values are kept as they are.
+
+    Attributes
+    ----------
+    labels : np.ndarray
+        The sorted unique labels that are replaced.
+    targets : np.ndarray
+        The replacement of every label in `labels`.
+    default : int or None
+        The replacement of the values that are not in `labels`.
+    """
+
+    def __init__(
+        self, labels: np.ndarray, targets: np.ndarray, default: int | None = None
+    ) -> None:
+        self.labels = np.asarray(labels)
+        self.targets = np.asarray(targets)
+        self.default = default
+        if self.labels.shape != self.targets.shape or self.labels.ndim != 1:
+            raise ValueError("The labels and targets must be 1D of the same length")
+        if np.any(self.labels[1:] <= self.labels[:-1]):
+            raise ValueError("The labels must be sorted and unique")
+
+    @classmethod
+    def to_level(
+        cls,
+        region_meta: RegionMeta | RegionTree,
+        level: int,
+    ) -> LabelProjection:
+        """Create a projection onto a given hierarchy level.
+
+        All regions deeper than the level are replaced by their ancestors
+        at that level. This is the mapping used by `unfurl_regions`.
+
+        Parameters
+        ----------
+        region_meta
+            The region metadata or a frozen region hierarchy.
+        level
+            The hierarchy level.
+
+        Returns
+        -------
+        LabelProjection
+            The projection. Unknown labels are kept as they are.
+        """
+        tree = _as_tree(region_meta)
+        return cls(tree.ids, tree.ancestors_at_level(tree.ids, level))
+
+    @classmethod
+    def to_ancestors(
+        cls,
+        region_meta: RegionMeta | RegionTree,
+        allowed_ids: Collection[int],
+        fill_value: int | None = None,
+    ) -> LabelProjection:
+        """Create a projection onto the nearest ancestors among given regions.
+
+        Parameters
+        ----------
+        region_meta
+            The region metadata or a frozen region hierarchy.
+        allowed_ids
+            The region IDs that the labels can be replaced with. Every region
+            is considered to be its own ancestor.
+        fill_value
+            The replacement of labels that have no ancestor in `allowed_ids`
+            and of unknown labels. By default it's the background ID.
+
+        Returns
+        -------
+        LabelProjection
+            The projection.
+        """
+        tree = _as_tree(region_meta)
+        if fill_value is None:
+            fill_value = tree.background_id
+        targets = tree.nearest_ancestors(tree.ids, allowed_ids, fill_value)
+        return cls(tree.ids, targets, default=fill_value)
+
+    def __call__(
+        self,
+        volume: np.ndarray,
+        *,
+        out: np.ndarray | None = None,
+        slab_size: int | None = None,
+    ) -> np.ndarray:
+        """Apply the projection to a volume.
+
+        Parameters
+        ----------
+        volume
+            An annotation volume of any shape.
+        out
+            The output array, it must have the same shape as `volume`. It
+            can be `volume` itself to project the volume in place. By default
+            a new array of the same data type as `volume` is created.
+        slab_size
+            The number of slices along the first axis that are processed at
+            once. This bounds the size of the temporary arrays. By default
+            the whole volume is processed at once.
+
+        Returns
+        -------
+        np.ndarray
+            The projected volume.
+
+        Raises
+        ------
+        ValueError
+            If the shapes of the volume and of the output don't match or if
+            the output data type can't hold the projected labels.
+        """
+        volume = np.atleast_1d(volume)
+        if out is None:
+            out = np.empty_like(volume)
+        elif out.shape != volume.shape:
+            raise ValueError("Data have to be of the same shape")
+        targets = self.targets.astype(out.dtype)
+        # Labels that the volume's data type can't hold never occur in it
+        possible = self.labels.astype(volume.dtype) == self.labels
+        if np.any(targets[possible] != self.targets[possible]) or (
+            self.default is not None
+            and np.array(self.default).astype(out.dtype) != self.default
+        ):
+            raise ValueError(f"The projected labels don't fit into {out.dtype}")
+        if len(self.labels) == 0:
+            out[...] = volume if self.default is None else self.default
+            return out
+
+        if slab_size is None:
+            slab_size = max(len(volume), 1)
+        for start in range(0, len(volume), slab_size):
+            slab = volume[start : start + slab_size]
+            idx = np.searchsorted(self.labels, slab)
+            np.minimum(idx, len(self.labels) - 1, out=idx)
+            found = self.labels[idx] == slab
+            if self.default is None:
+                np.copyto(out[start : start + slab_size], slab, casting="unsafe")
+            else:
+                out[start : start + slab_size] = self.default
+            np.copyto(out[start : start + slab_size], targets[idx], where=found)
+
+        return out
+
+
+def _as_tree(region_meta: RegionMeta | RegionTree) -> RegionTree:
+    """Freeze the region metadata unless it's already frozen."""
+    if isinstance(region_meta, RegionTree):
+        return region_meta
+    return region_meta.freeze()
+
+
+def project_to_level(
+    volume: np.ndarray,
+    region_meta: RegionMeta | RegionTree,
+    level: int,
+    *,
+    out: np.ndarray | None = None,
+    slab_size: int | None = None,
+) -> np.ndarray:
+    """Replace all regions in a volume by their ancestors at a given level.
+
+    Parameters
+    ----------
+    volume
+        An annotation volume of any shape.
+    region_meta
+        The region metadata or a frozen region hierarchy.
+    level
+        The hierarchy level. Regions at or above this level are kept.
+    out
+        The output array, see `LabelProjection.__call__`. Pass `volume`
+        to project in place.
+    slab_size
+        The number of slices along the first axis that are processed at once.
+
+    Returns
+    -------
+    np.ndarray
+        The projected volume.
+    """
+    projection = LabelProjection.to_level(region_meta, level)
+    return projection(volume, out=out, slab_size=slab_size)
+
+
+def project_to_ancestors(
+    volume: np.ndarray,
+    region_meta: RegionMeta | RegionTree,
+    allowed_ids: Collection[int],
+    *,
+    fill_value: int | None = None,
+    out: np.ndarray | None = None,
+    slab_size: int | None = None,
+) -> np.ndarray:
+    """Replace all regions in a volume by their nearest allowed ancestors.
+
+    Parameters
+    ----------
+    volume
+        An annotation volume of any shape.
+    region_meta
+        The region metadata or a frozen region hierarchy.
+    allowed_ids
+        The region IDs that the regions can be replaced with.
+    fill_value
+        The replacement of regions without an ancestor in `allowed_ids`. By
+        default it's the background ID.
+    out
+        The output array, see `LabelProjection.__call__`. Pass `volume`
+        to project in place.
+    slab_size
+        The number of slices along the first axis that are processed at once.
+
+    Returns
+    -------
+    np.ndarray
+        The projected volume.
+    """
+    projection = LabelProjection.to_ancestors(region_meta, allowed_ids, fill_value)
+    return projection(volume, out=out, slab_size=slab_size)
@@ -0,0 +1,234 @@
+# Copyright 2022, Blue Brain Project, EPFL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Index of the voxels of every region in an annotation volume."""
+from __future__ import annotations
+
+import numpy as np
+
+
+class RegionIndex:
+    """The voxels, voxel counts and bounding boxes of all labels of a volume.
+
+    The index is built in one pass over the volume. The flat indices of all
+    voxels are sorted by label, so that the voxels of each label form a
+    contiguous block, similar to the compressed sparse row (CSR) format.
+    This makes every per-label query cost O(region size) instead of a scan
+    of the whole volume.
+
+    The index is a snapshot of the volume at construction time. It has to
+    be rebuilt if the volume is modified.
+
+    Parameters
+    ----------
+    volume
+        An annotation volume.
+    slab_size
+        The number of slices along the first axis that are processed at once
+        when compacting the labels. This bounds the size of the temporary
+        arrays.
+
+    Attributes
+    ----------
+    shape : tuple
+        The shape of the indexed volume.
+    labels : np.ndarray
+        The sorted unique labels of the volume.
+    counts : np.ndarray
+        The number of voxels of each label.
+    offsets : np.ndarray
+        Array of length ``len(labels) + 1``. The flat indices of the voxels
+        of ``labels[i]`` are ``voxels[offsets[i]:offsets[i + 1]]``.
+    voxels : np.ndarray
+        The flat indices of all voxels grouped by label. Within each label
+        the indices are sorted.
+    bbox_min : np.ndarray
+        Array of shape ``(len(labels), ndim)`` with the smallest coordinates
+        of the voxels of each label.
+    bbox_max : np.ndarray
+        Array of shape ``(len(labels), ndim)`` with the largest coordinates
+        of the voxels of each label.
+    """
+
+    def __init__(self, volume: np.ndarray, *, slab_size: int = 32) -> None:
+        volume = np.atleast_1d(volume)
+        self.shape = volume.shape
+
+        labels = np.array([], dtype=volume.dtype)
+        for start in range(0, len(volume), slab_size):
+            labels = np.union1d(labels, np.unique(volume[start : start + slab_size]))
+        self.labels = labels
+
+        # The stable sort of a small integer type is a linear time radix sort
+        compact = np.empty(volume.size, dtype=np.min_scalar_type(len(labels)))
+        slab_stride = volume.size // len(volume) if len(volume) else 0
+        for start in range(0, len(volume), slab_size):
+            slab = volume[start : start + slab_size]
+            flat_start = start * slab_stride
+            compact[flat_start : flat_start + slab.size] = np.searchsorted(
+                labels, slab
+            ).reshape(-1)
+        self.voxels = np.argsort(compact, kind="stable")
+        self.counts = np.bincount(compact, minlength=len(labels))
+        self.offsets = np.concatenate([[0], np.cumsum(self.counts)])
+
+        n_dims = len(self.shape)
+        self.bbox_min = np.zeros((len(labels), n_dims), dtype=np.intp)
+        self.bbox_max = np.zeros((len(labels), n_dims), dtype=np.intp)
+        if len(labels) > 0:
+            strides = np.cumprod((self.shape[1:] + (1,))[::-1])[::-1]
+            for axis in range(n_dims):
+                coordinates = self.voxels // strides[axis] % self.shape[axis]
+                starts = self.offsets[:-1]
+                self.bbox_min[:, axis] = np.minimum.reduceat(coordinates, starts)
+                self.bbox_max[:, axis] = np.maximum.reduceat(coordinates, starts)
+
+    def __len__(self) -> int:
+        """Get the number of labels."""
+        return len(self.labels)
+
+    def __contains__(self, label: int) -> bool:
+        """Check if a label is present in the volume."""
+        return self.position(label) >= 0
+
+    def position(self, label: int) -> int:
+        """Find the position of a label in `labels`.
+
+        Parameters
+        ----------
+        label
+            A label.
+
+        Returns
+        -------
+        int
+            The position of the label in `labels`, or -1 if the label is
+            not present in the volume.
+        """
+        idx = int(np.searchsorted(self.labels, label))
+        if idx < len(self.labels) and self.labels[idx] == label:
+            return idx
+        return -1
+
+    def count(self, label: int) -> int:
+        """Get the number of voxels of a label."""
+        idx = self.position(label)
+        if idx < 0:
+            return 0
+        return int(self.counts[idx])
+
+    def flat_indices(self, label: int) -> np.ndarray:
+        """Get the sorted flat indices of the voxels of a label.
+
+        Parameters
+        ----------
+        label
+            A label. If it's not present in the volume then the result
+            is empty.
+
+        Returns
+        -------
+        np.ndarray
+            The flat indices of the voxels, see `np.ravel_multi_index`.
+        """
+        idx = self.position(label)
+        if idx < 0:
+            return self.voxels[:0]
+        return self.voxels[self.offsets[idx] : self.offsets[idx + 1]]
+
+    def coordinates(self, label: int) -> tuple[np.ndarray, ...]:
+        """Get the coordinates of the voxels of a label.
+
+        The result is the same as ``np.nonzero(volume == label)``.
+
+        Parameters
+        ----------
+        label
+            A label.
+
+        Returns
+        -------
+        tuple of np.ndarray
+            One array of coordinates per axis.
+        """
+        return np.unravel_index(self.flat_indices(label), self.shape)
+
+    def bbox(self, label: int, padding: int = 0) -> tuple[slice, ...] | None:
+        """Get the bounding box of a label.
+
+        Parameters
+        ----------
+        label
+            A label.
+        padding
+            The number of voxels by which the bounding box is extended on
+            each side. The result is clipped to the volume.
+
+        Returns
+        -------
+        tuple of slice or None
+            The bounding box in the same format as the output of
+            `scipy.ndimage.find_objects`. None if the label is not present
+            in the volume.
+        """
+        idx = self.position(label)
+        if idx < 0:
+            return None
+        return tuple(
+            slice(max(int(lo) - padding, 0), min(int(hi) + 1 + padding, size))
+            for lo, hi, size in zip(self.bbox_min[idx], self.bbox_max[idx], self.shape)
+        )
+
+    def intersection(
+        self,
+        label: int,
+        other: RegionIndex,
+        other_label: int | None = None,
+    ) -> int:
+        """Count the voxels of a label that also belong to a label of another index.
+
+        Parameters
+        ----------
+        label
+            A label in this index.
+        other
+            The index of another volume of the same shape.
+        other_label
+            A label in the other index. If not provided then it's the same
+            as `label`.
+
+        Returns
+        -------
+        int
+            The number of voxels labelled `label` in this volume and
+            `other_label` in the other volume.
+
+        Raises
+        ------
+        ValueError
+            If the indexed volumes have different shapes.
+        """
+        if self.shape != other.shape:
+            raise ValueError("Data have to be of the same shape")
+        if other_label is None:
+            other_label = label
+        voxels = self.flat_indices(label)
+        other_voxels = other.flat_indices(other_label)
+        if len(voxels) > len(other_voxels):
+            voxels, other_voxels = other_voxels, voxels
+        if len(voxels) == 0:
+            return 0
+        positions = np.searchsorted(other_voxels, voxels)
+        positions[positions == len(other_voxels)] = 0
+
+        return int(np.count_nonzero(other_voxels[positions] == voxels))
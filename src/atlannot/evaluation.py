@@ -14,17 +14,23 @@
 """Evaluation."""
 from __future__ import annotations
 
+import functools
+import hashlib
 import logging
+import os
+import pathlib
 import warnings
-from collections.abc import Collection
+from collections.abc import Callable, Collection, Mapping, Sequence
 from typing import Any
 
 import numpy as np
 from numpy import ma
 from scipy import stats
 
-from atlannot._atlalign import iou_score
+from atlannot.atlas.projection import LabelProjection
+from atlannot.atlas.region_index import RegionIndex
 from atlannot.region_meta import RegionMeta
+from atlannot.region_tree import RegionTree
 
 logger = logging.getLogger(__name__)
 
@@ -87,6 +93,50 @@ def jaggedness(
 ) -> dict[int, float]:
     """Compute the jaggedness of given region IDs for the specified volume.
 
+    The jaggedness is computed by `region_jaggedness` for all regions in a
+    single sweep along the axis. Use `meter_jaggedness` to compute it with
+    the atlas_alignment_meter package instead.
+
+    Parameters
+    ----------
+    volume
+        An annotation volume.
+    axis
+        Axis along which to compute the jaggedness.
+    region_ids
+        A collection of region IDs to compute the jaggedness. If None, the
+        jaggedness is computed for all the region IDs present in the volume.
+    all_region_ids
+        A collection of unique IDs in the volume provided. Can be useful to
+        speed up the computation. It's typically computed using
+        `np.unique(volume)`. If not provided, it will be set to
+        `np.unique(volume)`.
+
+    Returns
+    -------
+    results: dict[int, float]
+        Dictionary containing the region id as keys and the mean of the
+        jaggedness of that given region id as values.
+    """
+    if all_region_ids is None:
+        all_region_ids = unique_labels(volume)
+    region_ids, results = _split_missing(region_ids, all_region_ids)
+    results.update(region_jaggedness(volume, {id_: [id_] for id_ in region_ids}, axis))
+
+    return results
+
+
+def meter_jaggedness(
+    volume: np.ndarray,
+    axis: int = 0,
+    region_ids: Collection[int] | None = None,
+    all_region_ids: Collection[int] | None = None,
+) -> dict[int, float]:
+    """Compute the jaggedness with the atlas_alignment_meter package.
+
+    This is the reference implementation of `jaggedness`, it needs the
+    optional atlas_alignment_meter package and is much slower.
+
     Parameters
     ----------
     volume
@@ -104,178 +154,1892 @@ def jaggedness(
 
     Returns
     -------
-    results: dict[int, float]
-        Dictionary containing the region id as keys and the mean of the
-        jaggedness of that given region id as values.
+    results: dict[int, float]
+        Dictionary containing the region id as keys and the mean of the
+        jaggedness of that given region id as values.
+    """
+    if all_region_ids is None:
+        all_region_ids = np.unique(volume)
+    region_ids, results = _split_missing(region_ids, all_region_ids)
+
+    # core.compute breaks if region_ids is empty, so short-circuit.
+    if not region_ids:
+        return results
+
+    from atlas_alignment_meter import core
+
+    metrics = core.compute(
+        volume,
+        coronal_axis_index=axis,
+        regions=list(region_ids),
+        precomputed_all_region_ids=list(all_region_ids),
+    )
+
+    for region_id, scores in metrics["perRegion"].items():
+        results[region_id] = scores["mean"]
+
+    return results
+
+
+def _split_missing(
+    region_ids: Collection[int] | None,
+    all_region_ids: Collection[int],
+) -> tuple[set[int], dict[int, float]]:
+    """Split the region IDs into those present in a volume and the others.
+
+    The background is never evaluated. The results of the missing regions
+    are set to NaN, which is consistent with what happens in `iou`.
+    """
+    all_region_ids = set(all_region_ids)
+
+    if region_ids is None:
+        missing: set[int] = set()
+        region_ids = all_region_ids
+    else:
+        missing = {id_ for id_ in region_ids if id_ not in all_region_ids}
+        region_ids = set(region_ids) - missing
+    region_ids.discard(0)
+
+    return region_ids, {id_: np.nan for id_ in missing}
+
+
+def region_jaggedness(
+    volume: np.ndarray,
+    region_groups: Mapping[Any, Collection[int]],
+    axis: int = 0,
+) -> dict[Any, float]:
+    r"""Compute the jaggedness of many regions in one sweep.
+
+    The jaggedness measures how much the region boundary in each slice
+    deviates from the midpoint of the boundaries in the two neighbouring
+    slices along the given axis, i.e. the curvature of the region surface
+    along the axis. It's computed with NumPy and SciPy only.
+
+    More precisely, let :math:`\phi_k` be the in-plane signed distance to
+    the boundary of a region in slice :math:`k`, measured from the pixel
+    edges: it's negative inside the region and positive outside. For every
+    boundary pixel :math:`p` of the region in slice :math:`k` the jaggedness
+    is the discrete second derivative of the boundary position along the
+    axis,
+
+    .. math::
+        \frac{1}{2} |\phi_{k - 1}(p) - 2 \phi_k(p) + \phi_{k + 1}(p)|,
+
+    which vanishes for straight extrusions and for boundaries that move
+    linearly from slice to slice. The jaggedness of a region is the mean over
+    all its boundary pixels in slices where the region is also present in
+    both neighbouring slices. A pixel is a boundary pixel if one of its four
+    in-plane neighbours is outside the region.
+
+    The distance transforms are only computed within the bounding box of
+    each region in three consecutive slices.
+
+    Parameters
+    ----------
+    volume
+        An annotation volume.
+    region_groups
+        The regions for which to compute the jaggedness. The keys are
+        arbitrary region names and the values are collections of labels
+        that make up the region. For example, ``{id_: [id_]}`` gives the
+        jaggedness of a single label and ``{"name": descendant_ids}`` the
+        jaggedness of the union of the given labels.
+    axis
+        Axis along which to compute the jaggedness.
+
+    Returns
+    -------
+    dict[Any, float]
+        The jaggedness for each region. It's NaN for regions that are not
+        present in three consecutive slices.
+    """
+    volume = np.moveaxis(np.asarray(volume), axis, 0)
+    sums, counts = _jaggedness_terms(volume, region_groups)
+
+    return dict(zip(region_groups, _ratio(sums, counts)))
+
+
+def _jaggedness_terms(
+    volume: np.ndarray, region_groups: Mapping[Any, Collection[int]]
+) -> tuple[np.ndarray, np.ndarray]:
+    """Sum the jaggedness of the boundary pixels of many regions.
+
+    Parameters
+    ----------
+    volume
+        An annotation volume. The jaggedness is computed along the first
+        axis.
+    region_groups
+        The regions for which to compute the jaggedness, see
+        ``region_jaggedness``.
+
+    Returns
+    -------
+    sums : np.ndarray
+        Array of shape ``(n_groups,)`` with the sum of the jaggedness of the
+        boundary pixels of every region.
+    counts : np.ndarray
+        Array of shape ``(n_groups,)`` with the number of boundary pixels of
+        every region.
+    """
+    from scipy import ndimage
+
+    labels = unique_labels(volume)
+    n_labels = len(labels)
+    n_groups = len(region_groups)
+
+    # Lookup table telling which compact labels belong to which region
+    lut = np.zeros((n_groups, n_labels), dtype=bool)
+    for i, group in enumerate(region_groups.values()):
+        _, compact_ids, _ = np.intersect1d(labels, list(group), return_indices=True)
+        lut[i, compact_ids] = True
+
+    def slice_info(idx):
+        """Compact the labels of a slice and find the region bounding boxes."""
+        compact = np.searchsorted(labels, volume[idx])
+        # Bounding boxes of all labels as (row min, row max, col min, col max)
+        boxes = np.full((n_labels, 4), -1)
+        boxes[:, [0, 2]] = np.iinfo(boxes.dtype).max
+        for label_idx, box in enumerate(
+            ndimage.find_objects(compact + 1, max_label=n_labels)
+        ):
+            if box is not None:
+                boxes[label_idx] = box[0].start, box[0].stop, box[1].start, box[1].stop
+        group_boxes = np.stack(
+            [
+                np.where(lut, boxes[:, 0], np.iinfo(boxes.dtype).max).min(axis=1),
+                np.where(lut, boxes[:, 1], -1).max(axis=1),
+                np.where(lut, boxes[:, 2], np.iinfo(boxes.dtype).max).min(axis=1),
+                np.where(lut, boxes[:, 3], -1).max(axis=1),
+            ],
+            axis=1,
+        )
+        return compact, group_boxes
+
+    def signed_distance(mask):
+        """Compute the signed distance to the boundary of a mask."""
+        inside = ndimage.distance_transform_edt(mask)
+        outside = ndimage.distance_transform_edt(~mask)
+        return np.where(mask, 0.5 - inside, outside - 0.5)
+
+    sums = np.zeros(n_groups)
+    counts = np.zeros(n_groups, dtype=np.int64)
+    window = [slice_info(idx) for idx in range(min(2, len(volume)))]
+    for idx in range(2, len(volume)):
+        window.append(slice_info(idx))
+        (prev, prev_boxes), (cur, cur_boxes), (nxt, next_boxes) = window[-3:]
+        window.pop(0)
+        present = (
+            (prev_boxes[:, 1] >= 0) & (cur_boxes[:, 1] >= 0) & (next_boxes[:, 1] >= 0)
+        )
+        for group_idx in np.flatnonzero(present):
+            boxes = np.stack(
+                [prev_boxes[group_idx], cur_boxes[group_idx], next_boxes[group_idx]]
+            )
+            crop = (
+                slice(boxes[:, 0].min(), boxes[:, 1].max()),
+                slice(boxes[:, 2].min(), boxes[:, 3].max()),
+            )
+            # Pad the crops so that the region is surrounded by background
+            masks = [
+                np.pad(lut[group_idx][compact[crop]], 1) for compact in (prev, cur, nxt)
+            ]
+            boundary = masks[1] & ~ndimage.binary_erosion(masks[1])
+            phi_prev = signed_distance(masks[0])[boundary]
+            phi_next = signed_distance(masks[2])[boundary]
+            # The signed distance at the boundary pixels of the middle slice
+            # is always -0.5
+            sums[group_idx] += np.abs(phi_prev + phi_next + 1).sum() / 2
+            counts[group_idx] += len(phi_prev)
+
+    return sums, counts
+
+
+def unique_labels(*volumes: np.ndarray, slab_size: int = 32) -> np.ndarray:
+    """Find the sorted union of the labels of several volumes.
+
+    Parameters
+    ----------
+    volumes
+        Annotation volumes. They can have different shapes.
+    slab_size
+        The number of slices along the first axis that are processed at once.
+
+    Returns
+    -------
+    np.ndarray
+        The sorted unique labels across all volumes.
+    """
+    labels = np.array([], dtype=np.result_type(*volumes))
+    for volume in volumes:
+        volume = np.atleast_1d(volume)
+        for start in range(0, len(volume), slab_size):
+            labels = np.union1d(labels, np.unique(volume[start : start + slab_size]))
+
+    return labels
+
+
+def compact_labels(
+    *volumes: np.ndarray, slab_size: int = 32
+) -> tuple[np.ndarray, list[np.ndarray]]:
+    """Map the labels of several volumes onto a common compact range.
+
+    Parameters
+    ----------
+    volumes
+        Annotation volumes. They can have different shapes.
+    slab_size
+        The number of slices along the first axis that are processed at once
+        when collecting the unique labels. This bounds the size of the
+        temporary arrays.
+
+    Returns
+    -------
+    labels : np.ndarray
+        The sorted union of all labels found in the volumes.
+    compact_volumes : list[np.ndarray]
+        The volumes with every label replaced by its index in `labels`.
+    """
+    labels = unique_labels(*volumes, slab_size=slab_size)
+    compact_volumes = [np.searchsorted(labels, volume) for volume in volumes]
+
+    return labels, compact_volumes
+
+
+def _ratio(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    """Divide counts and set the result to NaN where there are none."""
+    result = np.full(np.shape(numerator), np.nan)
+    np.divide(numerator, denominator, out=result, where=denominator > 0)
+
+    return result
+
+
+def _mean_slice_iou(
+    intersection: np.ndarray, counts_1: np.ndarray, counts_2: np.ndarray
+) -> np.ndarray:
+    """Average per-slice IoUs given per-slice counts of shape (n_slices, ...).
+
+    Slices in which both counts are zero are ignored.
+    """
+    union = counts_1 + counts_2 - intersection
+    per_slice = _ratio(intersection, union)
+
+    return _ratio(np.nansum(per_slice, axis=0), np.count_nonzero(union, axis=0))
+
+
+def _sum_columns(array: np.ndarray, groups: np.ndarray, n_groups: int) -> np.ndarray:
+    """Sum the columns of a 2D array by groups.
+
+    Parameters
+    ----------
+    array
+        A 2D array.
+    groups
+        The group index of every column of `array`. Every group index
+        between 0 and `n_groups - 1` must occur at least once.
+    n_groups
+        The number of groups.
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape ``(len(array), n_groups)`` with the column sums.
+    """
+    if n_groups == 0:
+        return np.zeros((len(array), 0), dtype=array.dtype)
+    order = np.argsort(groups, kind="stable")
+    starts = np.searchsorted(groups[order], np.arange(n_groups))
+
+    return np.add.reduceat(array[:, order], starts, axis=1)
+
+
+class ConfusionMatrix:
+    """Label pair counts of two annotation volumes.
+
+    The labels of both volumes are compacted once and the voxel label pairs
+    are counted in a single pass. Overlap metrics for any region are then
+    derived from these counts without scanning the volumes again. Slices
+    are taken along the first axis of the volumes.
+
+    The counts are stored per slice. Voxels with the same label in both
+    volumes are counted in the dense `slice_intersection` table, and the
+    remaining voxels are recorded as sparse ``(slice, label_1, label_2)``
+    triplets, which are usually much fewer.
+
+    Usually instances are created using the ``from_volumes`` constructor.
+
+    Parameters
+    ----------
+    labels
+        The sorted labels present in at least one of the volumes. The
+        compact index of a label is its position in this array.
+    slice_counts_1
+        Array of shape ``(n_slices, n_labels)`` with the number of voxels of
+        each label in each slice of the first volume.
+    slice_counts_2
+        Same as `slice_counts_1` but for the second volume.
+    slice_intersection
+        Array of shape ``(n_slices, n_labels)`` with the number of voxels in
+        each slice where both volumes have the given label.
+    mismatch_slices
+        Array of shape ``(n_mismatches,)`` with the slice index of every
+        mismatch triplet.
+    mismatch_pairs
+        Array of shape ``(n_mismatches, 2)`` with the compact label indices
+        ``(label_1, label_2)`` of every mismatch triplet. The two labels are
+        always different.
+    mismatch_counts
+        Array of shape ``(n_mismatches,)`` with the number of voxels of
+        every mismatch triplet.
+    """
+
+    def __init__(
+        self,
+        labels: np.ndarray,
+        slice_counts_1: np.ndarray,
+        slice_counts_2: np.ndarray,
+        slice_intersection: np.ndarray,
+        mismatch_slices: np.ndarray,
+        mismatch_pairs: np.ndarray,
+        mismatch_counts: np.ndarray,
+    ) -> None:
+        self.labels = labels
+        self.slice_counts_1 = slice_counts_1
+        self.slice_counts_2 = slice_counts_2
+        self.slice_intersection = slice_intersection
+        self.mismatch_slices = mismatch_slices
+        self.mismatch_pairs = mismatch_pairs
+        self.mismatch_counts = mismatch_counts
+
+    @classmethod
+    def from_volumes(
+        cls,
+        annot_vol_1: np.ndarray,
+        annot_vol_2: np.ndarray,
+        *,
+        slab_size: int = 32,
+    ) -> ConfusionMatrix:
+        """Count the label pairs of two annotation volumes.
+
+        Parameters
+        ----------
+        annot_vol_1
+            The first annotation volume.
+        annot_vol_2
+            The second annotation volume. Must have the same shape as
+            `annot_vol_1`.
+        slab_size
+            The number of slices that are processed at once. This bounds the
+            size of the temporary arrays.
+
+        Returns
+        -------
+        ConfusionMatrix
+            The label pair counts of the two volumes.
+
+        Raises
+        ------
+        ValueError
+            If the shapes of the volumes don't match.
+        """
+        if annot_vol_1.shape != annot_vol_2.shape:
+            raise ValueError("Data have to be of the same shape")
+        annot_vol_1 = np.atleast_1d(annot_vol_1)
+        annot_vol_2 = np.atleast_1d(annot_vol_2)
+
+        labels = unique_labels(annot_vol_1, annot_vol_2, slab_size=slab_size)
+        n_labels = len(labels)
+        n_slices = len(annot_vol_1)
+        slice_counts_1 = np.zeros((n_slices, n_labels), dtype=np.int64)
+        slice_counts_2 = np.zeros((n_slices, n_labels), dtype=np.int64)
+        slice_intersection = np.zeros((n_slices, n_labels), dtype=np.int64)
+        mismatches = []
+
+        for start in range(0, n_slices, slab_size):
+            slab = slice(start, start + slab_size)
+            idx_1 = np.searchsorted(labels, annot_vol_1[slab]).reshape(-1)
+            idx_2 = np.searchsorted(labels, annot_vol_2[slab]).reshape(-1)
+
+            # Shift the label indices of each slice to get per-slice counts
+            n_slab = len(annot_vol_1[slab])
+            slice_idx = np.repeat(np.arange(n_slab), len(idx_1) // n_slab)
+            size = n_slab * n_labels
+            slab_1 = slice_idx * n_labels + idx_1
+            slab_2 = slice_idx * n_labels + idx_2
+            equal = idx_1 == idx_2
+            slice_counts_1[slab] = np.bincount(slab_1, minlength=size).reshape(
+                n_slab, n_labels
+            )
+            slice_counts_2[slab] = np.bincount(slab_2, minlength=size).reshape(
+                n_slab, n_labels
+            )
+            slice_intersection[slab] = np.bincount(
+                slab_1[equal], minlength=size
+            ).reshape(n_slab, n_labels)
+
+            # Sparse counts of the (slice, label_1, label_2) mismatch triplets
+            codes, counts = np.unique(
+                slab_1[~equal].astype(np.int64) * n_labels + idx_2[~equal],
+                return_counts=True,
+            )
+            slab_slices, pair_codes = np.divmod(codes, n_labels * n_labels)
+            mismatches.append((start + slab_slices, pair_codes, counts))
+
+        if mismatches:
+            slab_slices, pair_codes, counts = map(np.concatenate, zip(*mismatches))
+        else:
+            slab_slices = pair_codes = counts = np.array([], dtype=np.int64)
+
+        return cls(
+            labels,
+            slice_counts_1,
+            slice_counts_2,
+            slice_intersection,
+            slab_slices,
+            np.stack(np.divmod(pair_codes, n_labels), axis=1),
+            counts,
+        )
+
+    @classmethod
+    def concatenate(cls, matrices: Sequence[ConfusionMatrix]) -> ConfusionMatrix:
+        """Join the counts of consecutive slabs of two annotation volumes.
+
+        Parameters
+        ----------
+        matrices
+            The label pair counts of consecutive slabs. The labels of the
+            slabs don't need to be the same.
+
+        Returns
+        -------
+        ConfusionMatrix
+            The label pair counts of all slabs stacked along the first axis.
+        """
+        labels = functools.reduce(
+            np.union1d, [matrix.labels for matrix in matrices], np.array([])
+        )
+        if matrices:
+            labels = labels.astype(np.result_type(*[m.labels for m in matrices]))
+        n_labels = len(labels)
+        slice_counts: dict[str, list[np.ndarray]] = {
+            "1": [],
+            "2": [],
+            "intersection": [],
+        }
+        mismatch_slices = []
+        mismatch_pairs = []
+        n_slices = 0
+        for matrix in matrices:
+            columns = np.searchsorted(labels, matrix.labels)
+            for key, counts in [
+                ("1", matrix.slice_counts_1),
+                ("2", matrix.slice_counts_2),
+                ("intersection", matrix.slice_intersection),
+            ]:
+                expanded = np.zeros((matrix.n_slices, n_labels), dtype=np.int64)
+                expanded[:, columns] = counts
+                slice_counts[key].append(expanded)
+            mismatch_slices.append(matrix.mismatch_slices + n_slices)
+            mismatch_pairs.append(columns[matrix.mismatch_pairs])
+            n_slices += matrix.n_slices
+
+        def stack(arrays, shape):
+            return np.concatenate(arrays) if arrays else np.zeros(shape, np.int64)
+
+        return cls(
+            labels,
+            stack(slice_counts["1"], (0, n_labels)),
+            stack(slice_counts["2"], (0, n_labels)),
+            stack(slice_counts["intersection"], (0, n_labels)),
+            stack(mismatch_slices, (0,)),
+            stack(mismatch_pairs, (0, 2)),
+            stack([matrix.mismatch_counts for matrix in matrices], (0,)),
+        )
+
+    def save(self, path: str | os.PathLike) -> None:
+        """Save the label pair counts to an NPZ file.
+
+        Parameters
+        ----------
+        path
+            The output file. The ".npz" extension is appended if it's
+            missing.
+        """
+        np.savez(
+            path,
+            labels=self.labels,
+            slice_counts_1=self.slice_counts_1,
+            slice_counts_2=self.slice_counts_2,
+            slice_intersection=self.slice_intersection,
+            mismatch_slices=self.mismatch_slices,
+            mismatch_pairs=self.mismatch_pairs,
+            mismatch_counts=self.mismatch_counts,
+        )
+
+    @classmethod
+    def load(cls, path: str | os.PathLike) -> ConfusionMatrix:
+        """Load label pair counts saved with ``save``.
+
+        Parameters
+        ----------
+        path
+            The NPZ file with the label pair counts.
+
+        Returns
+        -------
+        ConfusionMatrix
+            The loaded label pair counts.
+        """
+        with np.load(path) as data:
+            return cls(
+                data["labels"],
+                data["slice_counts_1"],
+                data["slice_counts_2"],
+                data["slice_intersection"],
+                data["mismatch_slices"],
+                data["mismatch_pairs"],
+                data["mismatch_counts"],
+            )
+
+    @property
+    def pairs(self) -> np.ndarray:
+        """All compact label index pairs that occur in the volumes.
+
+        Returns
+        -------
+        np.ndarray
+            Array of shape ``(n_pairs, 2)`` with the distinct compact label
+            index pairs ``(label_1, label_2)``, sorted lexicographically.
+        """
+        return self._pair_table()[0]
+
+    @property
+    def pair_counts(self) -> np.ndarray:
+        """The number of voxels of each label pair in `pairs`.
+
+        Returns
+        -------
+        np.ndarray
+            Array of shape ``(n_pairs,)`` with the voxel counts.
+        """
+        return self._pair_table()[1]
+
+    def _pair_table(self) -> tuple[np.ndarray, np.ndarray]:
+        """Aggregate the per-slice counts into global label pair counts."""
+        intersection = self.slice_intersection.sum(axis=0)
+        (same,) = np.nonzero(intersection)
+        pair_codes = np.concatenate(
+            [
+                same * (self.n_labels + 1),
+                self.mismatch_pairs[:, 0] * self.n_labels + self.mismatch_pairs[:, 1],
+            ]
+        )
+        weights = np.concatenate([intersection[same], self.mismatch_counts])
+        pair_codes, inverse = np.unique(pair_codes, return_inverse=True)
+        counts = np.bincount(inverse.reshape(-1), weights=weights).astype(np.int64)
+
+        return np.stack(np.divmod(pair_codes, self.n_labels), axis=1), counts
+
+    def remap(self, new_labels: np.ndarray) -> ConfusionMatrix:
+        """Merge labels into new ones.
+
+        This gives the same result as relabelling both volumes and counting
+        the label pairs again, but only needs the existing counts.
+
+        Parameters
+        ----------
+        new_labels
+            Array of shape ``(n_labels,)`` with the new label of each label in
+            `labels`. Different labels can be mapped to the same new label.
+
+        Returns
+        -------
+        ConfusionMatrix
+            The label pair counts for the new labels.
+        """
+        labels, inverse = np.unique(new_labels, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        n_labels = len(labels)
+
+        slice_intersection = _sum_columns(self.slice_intersection, inverse, n_labels)
+        new_pairs = inverse[self.mismatch_pairs]
+        merged = new_pairs[:, 0] == new_pairs[:, 1]
+        slice_intersection += (
+            np.bincount(
+                self.mismatch_slices[merged] * n_labels + new_pairs[merged, 0],
+                weights=self.mismatch_counts[merged],
+                minlength=self.n_slices * n_labels,
+            )
+            .astype(np.int64)
+            .reshape(self.n_slices, n_labels)
+        )
+
+        codes, code_inverse = np.unique(
+            self.mismatch_slices[~merged] * n_labels * n_labels
+            + new_pairs[~merged, 0] * n_labels
+            + new_pairs[~merged, 1],
+            return_inverse=True,
+        )
+        counts = np.bincount(
+            code_inverse.reshape(-1),
+            weights=self.mismatch_counts[~merged],
+            minlength=len(codes),
+        ).astype(np.int64)
+        slices, pair_codes = np.divmod(codes, n_labels * n_labels)
+
+        return ConfusionMatrix(
+            labels,
+            _sum_columns(self.slice_counts_1, inverse, n_labels),
+            _sum_columns(self.slice_counts_2, inverse, n_labels),
+            slice_intersection,
+            slices,
+            np.stack(np.divmod(pair_codes, n_labels), axis=1),
+            counts,
+        )
+
+    @property
+    def n_labels(self) -> int:
+        """The number of distinct labels in both volumes."""
+        return len(self.labels)
+
+    @property
+    def n_slices(self) -> int:
+        """The number of slices along the first axis of the volumes."""
+        return len(self.slice_counts_1)
+
+    def _lookup(
+        self, region_ids: Collection[int] | None
+    ) -> tuple[list[int], np.ndarray, np.ndarray]:
+        """Find the compact indices of given region IDs.
+
+        Returns
+        -------
+        region_ids : list[int]
+            The sorted unique region IDs.
+        indices : np.ndarray
+            The compact index of each region ID. Only valid where `found`
+            is true.
+        found : np.ndarray
+            Boolean array telling which region IDs are present in at least
+            one of the volumes.
+        """
+        if region_ids is None:
+            ids = list(self.labels)
+            return ids, np.arange(self.n_labels), np.ones(self.n_labels, dtype=bool)
+
+        ids = sorted(set(region_ids))
+        indices = np.searchsorted(self.labels, ids)
+        indices = np.minimum(indices, max(self.n_labels - 1, 0))
+        if self.n_labels == 0:
+            found = np.zeros(len(ids), dtype=bool)
+        else:
+            found = self.labels[indices] == np.asarray(ids)
+
+        return ids, indices, found
+
+    def _scores(
+        self, region_ids: Collection[int] | None, values: np.ndarray
+    ) -> dict[int, Any]:
+        """Collect per-label values for the given region IDs.
+
+        Regions that are absent from both volumes get NaN values.
+        """
+        ids, indices, found = self._lookup(region_ids)
+        missing = np.full(values.shape[1:], np.nan) if values.ndim > 1 else np.nan
+        return {
+            id_: values[idx] if is_found else missing
+            for id_, idx, is_found in zip(ids, indices, found)
+        }
+
+    def iou(self, region_ids: Collection[int] | None = None) -> dict[int, float]:
+        """Compute the global intersection over union of regions.
+
+        Parameters
+        ----------
+        region_ids
+            The region IDs for which to compute the IoU. If None, the IoU is
+            computed for all region IDs present in at least one of the
+            volumes.
+
+        Returns
+        -------
+        dict[int, float]
+            The IoU for each region ID. It's NaN for regions that are absent
+            from both volumes.
+        """
+        intersection = self.slice_intersection.sum(axis=0)
+        union = (
+            self.slice_counts_1.sum(axis=0)
+            + self.slice_counts_2.sum(axis=0)
+            - intersection
+        )
+        return self._scores(region_ids, _ratio(intersection, union))
+
+    def dice(self, region_ids: Collection[int] | None = None) -> dict[int, float]:
+        """Compute the Dice coefficient of regions.
+
+        Parameters
+        ----------
+        region_ids
+            The region IDs for which to compute the Dice coefficient. If
+            None, it's computed for all region IDs present in at least one of
+            the volumes.
+
+        Returns
+        -------
+        dict[int, float]
+            The Dice coefficient for each region ID. It's NaN for regions
+            that are absent from both volumes.
+        """
+        intersection = self.slice_intersection.sum(axis=0)
+        total = self.slice_counts_1.sum(axis=0) + self.slice_counts_2.sum(axis=0)
+        return self._scores(region_ids, _ratio(2 * intersection, total))
+
+    def iou_per_slice(
+        self, region_ids: Collection[int] | None = None
+    ) -> dict[int, np.ndarray]:
+        """Compute the intersection over union of regions for every slice.
+
+        Parameters
+        ----------
+        region_ids
+            The region IDs for which to compute the IoU. If None, the IoU is
+            computed for all region IDs present in at least one of the
+            volumes.
+
+        Returns
+        -------
+        dict[int, np.ndarray]
+            Arrays of shape ``(n_slices,)`` with the IoU of each slice for
+            each region ID. The IoU is NaN for slices in which the region
+            is absent from both volumes.
+        """
+        union = self.slice_counts_1 + self.slice_counts_2 - self.slice_intersection
+        per_slice = _ratio(self.slice_intersection, union)
+        return self._scores(region_ids, per_slice.T)
+
+    def mean_iou_per_slice(
+        self, region_ids: Collection[int] | None = None
+    ) -> dict[int, float]:
+        """Average the per-slice intersection over union of regions.
+
+        Slices in which a region is absent from both volumes are ignored.
+        This is the score that ``atlannot._atlalign.iou_score`` computes.
+
+        Parameters
+        ----------
+        region_ids
+            The region IDs for which to compute the IoU. If None, the IoU is
+            computed for all region IDs present in at least one of the
+            volumes.
+
+        Returns
+        -------
+        dict[int, float]
+            The mean per-slice IoU for each region ID. It's NaN for regions
+            that are absent from both volumes.
+        """
+        mean_iou = _mean_slice_iou(
+            self.slice_intersection, self.slice_counts_1, self.slice_counts_2
+        )
+        return self._scores(region_ids, mean_iou)
+
+
+def iou(
+    annot_vol_1: np.ndarray,
+    annot_vol_2: np.ndarray,
+    region_ids: Collection[int] | None = None,
+) -> dict[int, float]:
+    """Compute the intersection over union of given region IDs.
+
+    The IoU of a region is computed for every slice along the first axis and
+    then averaged over all slices in which the region is present.
+
+    Parameters
+    ----------
+    annot_vol_1
+        The first annotation volume.
+    annot_vol_2
+        The second annotation volume.
+    region_ids
+        A sequence of region IDs to compute the intersection over union.
+        If None, the IoU is computed for all the region IDs present in at least
+        one of the volumes.
+
+    Returns
+    -------
+    results: dict[int, float]
+        Dictionary with the region IDs as keys and the intersection over union
+        scores as values. If a region ID is not in any of the volumes then
+        the IoU will be NaN.
+    """
+    confusion = ConfusionMatrix.from_volumes(annot_vol_1, annot_vol_2)
+
+    return confusion.mean_iou_per_slice(region_ids)
+
+
+def hierarchical_iou(
+    confusion: ConfusionMatrix,
+    region_meta: RegionMeta,
+    region_groups: Mapping[Any, Collection[int]],
+) -> dict[Any, float]:
+    """Compute the IoU of region groups including all their descendants.
+
+    A voxel belongs to a region group if its label is one of the group's
+    region IDs or a descendant of one of them. The counts of all labels in
+    the confusion matrix are summed up the region hierarchy for all groups
+    at once, so no volume needs to be scanned and the cost only weakly
+    depends on the number of groups.
+
+    As for the `iou` function the IoU is computed for every slice and then
+    averaged over all slices in which the region group is present.
+
+    Parameters
+    ----------
+    confusion
+        The label pair counts of the two annotation volumes.
+    region_meta
+        The region metadata holding the region hierarchy.
+    region_groups
+        The region groups. The keys are arbitrary group names and the values
+        are the region IDs of each group.
+
+    Returns
+    -------
+    dict[Any, float]
+        The IoU of each region group. It's NaN for groups that are absent
+        from both volumes.
+    """
+    tree = region_meta.freeze()
+    membership = np.zeros((confusion.n_labels, len(region_groups)), dtype=bool)
+    for j, region_ids in enumerate(region_groups.values()):
+        nearest = tree.nearest_ancestors(confusion.labels, region_ids, fill_value=-1)
+        # Labels unknown to the hierarchy only belong to their own groups
+        membership[:, j] = (nearest != -1) | np.isin(confusion.labels, list(region_ids))
+
+    weights = membership.astype(np.int64)
+    counts_1 = confusion.slice_counts_1 @ weights
+    counts_2 = confusion.slice_counts_2 @ weights
+    intersection = confusion.slice_intersection @ weights
+    # Mismatching labels can still belong to the same region group
+    both = membership[confusion.mismatch_pairs[:, 0]]
+    both &= membership[confusion.mismatch_pairs[:, 1]]
+    for j in range(len(region_groups)):
+        intersection[:, j] += np.bincount(
+            confusion.mismatch_slices[both[:, j]],
+            weights=confusion.mismatch_counts[both[:, j]],
+            minlength=confusion.n_slices,
+        ).astype(np.int64)
+
+    mean_iou = _mean_slice_iou(intersection, counts_1, counts_2)
+
+    return dict(zip(region_groups, mean_iou))
+
+
+def agreement_levels(
+    annot_vol_1: np.ndarray,
+    annot_vol_2: np.ndarray,
+    region_meta: RegionMeta | RegionTree,
+    *,
+    confusion: ConfusionMatrix | None = None,
+    slab_size: int = 32,
+) -> np.ndarray:
+    """Compute the histogram of the hierarchy levels at which voxels agree.
+
+    The agreement level of a voxel is the hierarchy level of the lowest
+    common ancestor of its labels in both volumes. It's the level of the
+    label itself if both labels are equal, and 0 if the labels only share
+    the background as ancestor. The higher the level, the finer the level
+    at which the volumes agree. Labels that are not part of the region
+    hierarchy are treated as background.
+
+    The label pairs are counted in one pass over the volumes, and the
+    lowest common ancestors are only found for the distinct label pairs.
+
+    Parameters
+    ----------
+    annot_vol_1
+        The first annotation volume.
+    annot_vol_2
+        The second annotation volume. Must have the same shape as
+        `annot_vol_1`.
+    region_meta
+        The region metadata or a frozen region hierarchy.
+    confusion
+        The label pair counts of the two volumes. If provided, the volumes
+        aren't scanned again.
+    slab_size
+        The number of slices along the first axis that are processed at once
+        when counting the label pairs.
+
+    Returns
+    -------
+    np.ndarray
+        The number of voxels that agree at every hierarchy level, from the
+        background level 0 to the deepest level of the hierarchy.
+    """
+    tree = region_meta if isinstance(region_meta, RegionTree) else region_meta.freeze()
+    if confusion is None:
+        confusion = ConfusionMatrix.from_volumes(
+            annot_vol_1, annot_vol_2, slab_size=slab_size
+        )
+    labels = np.where(
+        tree.index(confusion.labels) >= 0, confusion.labels, tree.background_id
+    )
+    pairs = confusion.pairs
+    lca = tree.lca(labels[pairs[:, 0]], labels[pairs[:, 1]])
+    # Regions without a common ancestor only agree at the background level
+    levels = tree.levels(np.where(lca >= 0, lca, tree.background_id))
+
+    return np.bincount(
+        levels, weights=confusion.pair_counts, minlength=tree.level.max() + 1
+    ).astype(np.int64)
+
+
+SURFACE_METRICS = ("hausdorff", "hd95", "mean_surface_distance")
+
+
+def surface_distances(
+    atlas: np.ndarray,
+    reference: np.ndarray,
+    region_groups: Mapping[Any, Collection[int]],
+    *,
+    spacing: float | Sequence[float] | None = None,
+    workers: int = 1,
+    atlas_index: RegionIndex | None = None,
+    reference_index: RegionIndex | None = None,
+) -> dict[str, dict[Any, float]]:
+    """Compute the distances between the region surfaces of two atlases.
+
+    The surface of a region consists of the voxels of the region that have
+    at least one face neighbour outside of the region. For every surface
+    voxel of a region in one atlas the distance to the closest surface voxel
+    of the same region in the other atlas is computed, and the following
+    symmetric metrics are derived from these distances:
+
+    - "hausdorff": the largest distance in both directions.
+    - "hd95": the larger one of the 95th percentiles of the distances in
+      each direction.
+    - "mean_surface_distance": the mean of the distances in both directions.
+
+    The distance transforms are only computed within the bounding box of
+    each region in both atlases. The bounding boxes are taken from region
+    indices of the atlases.
+
+    Parameters
+    ----------
+    atlas
+        Atlas to evaluate.
+    reference
+        Reference atlas of the same shape.
+    region_groups
+        The regions for which to compute the distances. The keys are
+        arbitrary region names and the values are collections of labels
+        that make up the region, see `region_jaggedness`.
+    spacing
+        The voxel size along each axis. By default all voxels have unit
+        size and the distances are in voxels.
+    workers
+        The number of worker processes. If greater than one, the distance
+        transforms of the regions are computed in a process pool.
+    atlas_index
+        The region index of the atlas. It's computed if not provided.
+    reference_index
+        The region index of the reference. It's computed if not provided.
+
+    Returns
+    -------
+    dict[str, dict[Any, float]]
+        For every metric the values for all regions. They're NaN for regions
+        that are missing in one of the atlases.
+
+    Raises
+    ------
+    ValueError
+        If the shapes of the atlases don't match.
+    """
+    if atlas.shape != reference.shape:
+        raise ValueError("Data have to be of the same shape")
+    if atlas_index is None:
+        atlas_index = RegionIndex(atlas)
+    if reference_index is None:
+        reference_index = RegionIndex(reference)
+
+    def region_masks():
+        """Crop the regions in both atlases to their common bounding box."""
+        for group in region_groups.values():
+            boxes = []
+            for index in (atlas_index, reference_index):
+                _, positions, _ = np.intersect1d(
+                    index.labels, list(group), return_indices=True
+                )
+                boxes.append((index.bbox_min[positions], index.bbox_max[positions]))
+            if any(len(box_min) == 0 for box_min, _ in boxes):
+                yield None
+                continue
+            box_min = np.min([box_min.min(axis=0) for box_min, _ in boxes], axis=0)
+            box_max = np.max([box_max.max(axis=0) for _, box_max in boxes], axis=0)
+            crop = tuple(slice(lo, hi + 1) for lo, hi in zip(box_min, box_max))
+            yield np.isin(atlas[crop], list(group)), np.isin(
+                reference[crop], list(group)
+            )
+
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            distances = list(
+                executor.map(
+                    _surface_distance_metrics,
+                    region_masks(),
+                    [spacing] * len(region_groups),
+                )
+            )
+    else:
+        distances = [
+            _surface_distance_metrics(masks, spacing) for masks in region_masks()
+        ]
+
+    per_metric = list(zip(*distances)) or [()] * len(SURFACE_METRICS)
+
+    return {
+        metric: dict(zip(region_groups, values))
+        for metric, values in zip(SURFACE_METRICS, per_metric)
+    }
+
+
+def _surface_distance_metrics(
+    masks: tuple[np.ndarray, np.ndarray] | None,
+    spacing: float | Sequence[float] | None,
+) -> tuple[float, float, float]:
+    """Compute the surface distance metrics of two region masks.
+
+    See `surface_distances` for the definition of the metrics.
+    """
+    from scipy import ndimage
+
+    if masks is None:
+        return np.nan, np.nan, np.nan
+
+    surfaces = []
+    for mask in masks:
+        # Pad the masks so that the region is surrounded by background
+        mask = np.pad(mask, 1)
+        surfaces.append(mask & ~ndimage.binary_erosion(mask))
+    surface_1, surface_2 = surfaces
+    distances_12 = ndimage.distance_transform_edt(~surface_2, sampling=spacing)
+    distances_21 = ndimage.distance_transform_edt(~surface_1, sampling=spacing)
+    distances_12 = distances_12[surface_1]
+    distances_21 = distances_21[surface_2]
+
+    hausdorff = max(distances_12.max(), distances_21.max())
+    hd95 = max(np.percentile(distances_12, 95), np.percentile(distances_21, 95))
+    mean_distance = (distances_12.sum() + distances_21.sum()) / (
+        len(distances_12) + len(distances_21)
+    )
+
+    return float(hausdorff), float(hd95), float(mean_distance)
+
+
+def entropy(
+    arr: np.ndarray | ma.MaskedArray,
+    *,
+    n_bins: int = 256,
+    value_range: tuple[float, float] | None = None,
+) -> float:
+    """Compute the entropy of the value distribution in an array.
+
+    The entropy is computed over the discrete value distribution of the
+    given data, which is obtained by putting all values into a given number
+    of bins that are uniformly distributed over a given value range. Note that
+    the exact pixel positions and the shape of the data array don't matter,
+    only the value distribution.
+
+    In order to obtain results that are compatible with each other it is
+    important that the entropy is computed using the same bins. This can be
+    ensured by using fixed values for the `n_bins` and `value_range` parameters.
+
+    Parameters
+    ----------
+    arr
+        The array for which to compute the entropy.
+    n_bins
+        The number of histogram bins. The entropy is computed over the
+        discretized value distribution of the given array. To obtain the
+        discretization, a histogram of all values in the given array is
+        computed using the given number of equally sized bins across the
+        value range specified by the `value_range` parameter.
+    value_range
+        The value range over which to compute the data distribution
+        specified the lower and upper bound. If not provided then the min and
+        max of all array values will be used. In order to obtain compatible
+        results for different arrays or for different masked regions of the
+        same array it is important to make sure that the histograms are
+        computed over exactly the same bins. The bins are uniquely specified
+        by the `n_bins` and `value_range` parameters, therefore, for
+        compatible results it is important to keep these constant.
+
+    Returns
+    -------
+    float
+        Entropy of the (masked) array.
+    """
+    if ma.isMaskedArray(arr):
+        arr = arr.compressed()
+        if value_range is None:
+            warnings.warn(
+                "Computing entropy on a masked array, but the value range "
+                "was not provided. As a result the bins will be determined "
+                "based on the intensities within the masked region only. "
+                "This will give different bins for different masks.",
+                stacklevel=2,
+            )
+    if value_range is None:
+        value_range = arr.min(), arr.max()
+
+    bins = np.linspace(*value_range, n_bins + 1)
+    hist, _ = np.histogram(arr.ravel(), bins=bins)
+
+    return stats.entropy(hist, base=n_bins)
+
+
+def region_histograms(
+    atlas: np.ndarray,
+    values: np.ndarray,
+    *,
+    n_bins: int = 256,
+    value_range: tuple[float, float] | None = None,
+    slab_size: int = 32,
+    region_index: RegionIndex | None = None,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Compute the value histograms of all regions in an atlas.
+
+    The histograms are obtained from a single joint histogram of the
+    (compacted) atlas labels and the binned values. The bins are the same
+    as the ones used by the `entropy` function for the same `n_bins` and
+    `value_range` parameters.
+
+    Parameters
+    ----------
+    atlas
+        An annotation atlas.
+    values
+        A volume of the same shape as `atlas`, for example a Nissl volume.
+    n_bins
+        The number of histogram bins.
+    value_range
+        The lower and upper bound of the histogram bins. If not provided then
+        the min and max of `values` will be used. Values outside of this
+        range are not counted in the histograms.
+    slab_size
+        The number of slices along the first axis that are processed at once.
+        This bounds the size of the temporary arrays.
+    region_index
+        The region index of the atlas. If provided, the labels and voxel
+        counts are taken from the index and the values are binned region by
+        region, without reading the atlas.
+
+    Returns
+    -------
+    labels : np.ndarray
+        The sorted unique labels of the atlas.
+    histograms : np.ndarray
+        Array of shape ``(n_labels, n_bins)`` with the value histogram of
+        each label.
+    counts : np.ndarray
+        Array of shape ``(n_labels,)`` with the number of voxels of each
+        label, including those with values outside of the value range.
+
+    Raises
+    ------
+    ValueError
+        If the shapes of the atlas and the values don't match.
+    """
+    if atlas.shape != values.shape:
+        raise ValueError("Data have to be of the same shape")
+    atlas = np.atleast_1d(atlas)
+    values = np.atleast_1d(values)
+    if value_range is None:
+        value_range = _value_range(values, slab_size=slab_size)
+    bin_edges = np.linspace(*value_range, n_bins + 1)
+
+    if region_index is not None:
+        if region_index.shape != atlas.shape:
+            raise ValueError("Data have to be of the same shape")
+        flat_values = values.reshape(-1)
+        histograms = np.zeros((len(region_index), n_bins), dtype=np.int64)
+        for i in range(len(region_index)):
+            voxels = region_index.voxels[
+                region_index.offsets[i] : region_index.offsets[i + 1]
+            ]
+            bin_idx = _bin_indices(flat_values[voxels], bin_edges)
+            histograms[i] = np.bincount(bin_idx, minlength=n_bins + 1)[:n_bins]
+
+        return region_index.labels, histograms, region_index.counts
+
+    labels = unique_labels(atlas, slab_size=slab_size)
+    # The extra bin collects all values outside of the value range
+    n_columns = n_bins + 1
+    joint_histogram = np.zeros(len(labels) * n_columns, dtype=np.int64)
+    for start in range(0, len(atlas), slab_size):
+        slab = slice(start, start + slab_size)
+        label_idx = np.searchsorted(labels, atlas[slab]).reshape(-1)
+        bin_idx = _bin_indices(values[slab].reshape(-1), bin_edges)
+        joint_histogram += np.bincount(
+            label_idx * n_columns + bin_idx, minlength=len(joint_histogram)
+        )
+    histograms = joint_histogram.reshape(len(labels), n_columns)
+
+    return labels, histograms[:, :n_bins], histograms.sum(axis=1)
+
+
+def _value_range(
+    values: np.ndarray,
+    atlas: np.ndarray | None = None,
+    *,
+    slab_size: int = 32,
+) -> tuple[Any, Any]:
+    """Find the min and max of values slab by slab.
+
+    Parameters
+    ----------
+    values
+        A volume of values.
+    atlas
+        If provided, only the values in the foreground of this annotation
+        volume are considered. Must have the same shape as `values`.
+    slab_size
+        The number of slices along the first axis that are processed at once.
+
+    Returns
+    -------
+    tuple
+        The min and the max of the values.
+
+    Raises
+    ------
+    ValueError
+        If there are no values.
+    """
+    values = np.atleast_1d(values)
+    minima = []
+    maxima = []
+    for start in range(0, len(values), slab_size):
+        slab_values = values[start : start + slab_size]
+        if atlas is not None:
+            slab_values = slab_values[atlas[start : start + slab_size] != 0]
+        if slab_values.size > 0:
+            minima.append(slab_values.min())
+            maxima.append(slab_values.max())
+    if not minima:
+        raise ValueError("Cannot find the value range of empty data")
+
+    return min(minima), max(maxima)
+
+
+def _bin_indices(values: np.ndarray, bin_edges: np.ndarray) -> np.ndarray:
+    """Find the histogram bin of every value.
+
+    The bins follow the convention of `np.histogram`: all bins are half-open
+    except the last one, which includes its right edge. Values outside of the
+    bins are assigned to the extra bin ``len(bin_edges) - 1``.
+    """
+    n_bins = len(bin_edges) - 1
+    indices = np.searchsorted(bin_edges, values, side="right") - 1
+    indices[values == bin_edges[-1]] = n_bins - 1
+    indices[(indices < 0) | (indices >= n_bins)] = n_bins
+
+    return indices
+
+
+def conditional_entropy(
+    nissl: np.ndarray,
+    atlas: np.ndarray,
+    *,
+    n_bins: int = 256,
+    value_range: tuple[float, float] | None = None,
+    slab_size: int = 32,
+    region_index: RegionIndex | None = None,
+) -> float:
+    """Compute entropies of Nissl densities.
+
+    The entropy of the Nissl densities is computed in each region and the
+    results are averaged with weights given by the region sizes. The
+    background is not taken into account.
+
+    Parameters
+    ----------
+    nissl
+        Nissl volume.
+    atlas
+        Annotation atlas.
+    n_bins
+        The number of histogram bins, see `entropy`.
+    value_range
+        The value range of the histogram bins, see `entropy`. If not
+        provided then the min and max of the Nissl volume will be used.
+    slab_size
+        The number of slices along the first axis that are processed at once.
+        This bounds the size of the temporary arrays.
+    region_index
+        The region index of the atlas, see `region_histograms`.
+
+    Returns
+    -------
+    conditional_entropy: float
+        Conditional entropy of the densities of Nissl depending on the brain regions.
+    """
+    labels, histograms, counts = region_histograms(
+        atlas,
+        nissl,
+        n_bins=n_bins,
+        value_range=value_range,
+        slab_size=slab_size,
+        region_index=region_index,
+    )
+
+    return _conditional_entropy(labels, histograms, counts)
+
+
+def _conditional_entropy(
+    labels: np.ndarray, histograms: np.ndarray, counts: np.ndarray
+) -> float:
+    """Compute the conditional entropy from the output of `region_histograms`."""
+    n_bins = histograms.shape[1]
+    foreground = labels != 0
+    entropies = stats.entropy(histograms[foreground], base=n_bins, axis=1)
+
+    return np.sum(entropies * counts[foreground]) / np.sum(counts[foreground])
+
+
+def joint_histogram(
+    values_1: np.ndarray,
+    values_2: np.ndarray,
+    *,
+    n_bins: int = 256,
+    value_range_1: tuple[float, float] | None = None,
+    value_range_2: tuple[float, float] | None = None,
+    atlas: np.ndarray | None = None,
+    region_ids: Collection[int] | None = None,
+    per_slice: bool = False,
+    slab_size: int = 32,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Compute the joint histogram of two intensity volumes.
+
+    The histogram is computed in a single pass over the volumes. The bins are
+    the same as the ones used by the `entropy` function for the same `n_bins`
+    and value range parameters.
+
+    Parameters
+    ----------
+    values_1
+        The first intensity volume, for example a warped Nissl volume.
+    values_2
+        The second intensity volume, for example the average brain. Must have
+        the same shape as `values_1`.
+    n_bins
+        The number of histogram bins along each axis.
+    value_range_1
+        The lower and upper bound of the bins of the first volume. If not
+        provided then the min and max of the whole volume will be used.
+        Values outside of this range are not counted.
+    value_range_2
+        The lower and upper bound of the bins of the second volume.
+    atlas
+        An annotation atlas of the same shape as the volumes. If provided,
+        only the voxels in the regions given by `region_ids` are counted.
+    region_ids
+        The labels of the regions to count. If not provided then all
+        foreground voxels of the atlas are counted.
+    per_slice
+        If true, one histogram per slice along the first axis is computed.
+    slab_size
+        The number of slices along the first axis that are processed at once.
+        This bounds the size of the temporary arrays.
+
+    Returns
+    -------
+    histogram : np.ndarray
+        The joint histogram of shape ``(n_bins, n_bins)``, where the first
+        axis corresponds to `values_1`. If `per_slice` is true, the shape is
+        ``(n_slices, n_bins, n_bins)``.
+    bin_edges_1 : np.ndarray
+        The bin edges of the first volume.
+    bin_edges_2 : np.ndarray
+        The bin edges of the second volume.
+
+    Raises
+    ------
+    ValueError
+        If the shapes of the volumes and of the atlas don't match.
+    """
+    if values_1.shape != values_2.shape or (
+        atlas is not None and atlas.shape != values_1.shape
+    ):
+        raise ValueError("Data have to be of the same shape")
+    values_1 = np.atleast_1d(values_1)
+    values_2 = np.atleast_1d(values_2)
+    if value_range_1 is None:
+        value_range_1 = _value_range(values_1, slab_size=slab_size)
+    if value_range_2 is None:
+        value_range_2 = _value_range(values_2, slab_size=slab_size)
+    bin_edges_1 = np.linspace(*value_range_1, n_bins + 1)
+    bin_edges_2 = np.linspace(*value_range_2, n_bins + 1)
+
+    # The extra bin of each axis collects all values outside of the range
+    n_cells = (n_bins + 1) ** 2
+    n_histograms = len(values_1) if per_slice else 1
+    counts = np.zeros(n_histograms * n_cells, dtype=np.int64)
+    for start in range(0, len(values_1), slab_size):
+        slab = slice(start, start + slab_size)
+        slab_1 = values_1[slab].reshape(len(values_1[slab]), -1)
+        slab_2 = values_2[slab].reshape(slab_1.shape)
+        codes = _bin_indices(slab_1, bin_edges_1) * (n_bins + 1)
+        codes += _bin_indices(slab_2, bin_edges_2)
+        if per_slice:
+            codes += n_cells * np.arange(start, start + len(slab_1))[:, np.newaxis]
+        if atlas is not None:
+            slab_atlas = atlas[slab].reshape(slab_1.shape)
+            if region_ids is None:
+                codes = codes[slab_atlas != 0]
+            else:
+                codes = codes[np.isin(slab_atlas, list(region_ids))]
+        counts += np.bincount(codes.ravel(), minlength=len(counts))
+    histograms = counts.reshape(n_histograms, n_bins + 1, n_bins + 1)
+    histograms = histograms[:, :n_bins, :n_bins]
+    if not per_slice:
+        histograms = histograms[0]
+
+    return histograms, bin_edges_1, bin_edges_2
+
+
+def mutual_information(histogram: np.ndarray) -> float | np.ndarray:
+    """Compute the mutual information from a joint histogram.
+
+    Like in `entropy`, the logarithm base is the number of bins, so that
+    the mutual information lies between 0 and 1.
+
+    Parameters
+    ----------
+    histogram
+        A joint histogram as computed by `joint_histogram`. Leading axes,
+        for example slices, are preserved.
+
+    Returns
+    -------
+    float or np.ndarray
+        The mutual information. It's NaN for empty histograms.
     """
-    from atlas_alignment_meter import core
+    entropy_1, entropy_2, joint_entropy = _histogram_entropies(histogram)
+    return entropy_1 + entropy_2 - joint_entropy
 
-    if all_region_ids is None:
-        all_region_ids = np.unique(volume)
-    all_region_ids = set(all_region_ids)
-
-    if region_ids is None:
-        missing: set[int] = set()
-        region_ids = all_region_ids
-    else:
-        missing = {id_ for id_ in region_ids if id_ not in all_region_ids}
-        region_ids = set(region_ids) - missing
-    region_ids.discard(0)
 
-    # Set the score of region IDs not found in the annotation volume to NaN.
-    # This behaviour is consistent with what happens in the iou function.
-    results = {id_: np.nan for id_ in missing}
+def normalized_mutual_information(histogram: np.ndarray) -> float | np.ndarray:
+    """Compute the normalized mutual information from a joint histogram.
 
-    # core.compute breaks if region_ids is empty, so short-circuit.
-    if not region_ids:
-        return results
+    The normalized mutual information is ``(H(X) + H(Y)) / H(X, Y)``. It's
+    1 for independent intensities and 2 for identical ones.
 
-    metrics = core.compute(
-        volume,
-        coronal_axis_index=axis,
-        regions=list(region_ids),
-        precomputed_all_region_ids=list(all_region_ids),
-    )
+    Parameters
+    ----------
+    histogram
+        A joint histogram as computed by `joint_histogram`. Leading axes,
+        for example slices, are preserved.
 
-    for region_id, scores in metrics["perRegion"].items():
-        results[region_id] = scores["mean"]
+    Returns
+    -------
+    float or np.ndarray
+        The normalized mutual information. It's NaN for empty histograms
+        and for histograms with a single non-empty bin.
+    """
+    entropy_1, entropy_2, joint_entropy = _histogram_entropies(histogram)
+    return _ratio(entropy_1 + entropy_2, joint_entropy)[()]
 
-    return results
 
+def correlation_ratio(
+    histogram: np.ndarray, bin_edges_2: np.ndarray
+) -> float | np.ndarray:
+    """Compute the correlation ratio from a joint histogram.
 
-def iou(
-    annot_vol_1: np.ndarray,
-    annot_vol_2: np.ndarray,
-    region_ids: Collection[int] | None = None,
-) -> dict[int, float]:
-    """Compute the intersection over union of given region IDs.
+    The correlation ratio measures how well the values of the second volume
+    are explained by a function of the values of the first one. It's the
+    part of the variance of the second volume that is explained by the bins
+    of the first one,  ``Var(E[Y | X]) / Var(Y)``. The values of the second
+    volume are represented by the centres of their bins.
 
     Parameters
     ----------
-    annot_vol_1
-        The first annotation volume.
-    annot_vol_2
-        The second annotation volume.
-    region_ids
-        A sequence of region IDs to compute the intersection over union.
-        If None, the IoU is computed for all the region IDs present in at least
-        one of the volumes.
+    histogram
+        A joint histogram as computed by `joint_histogram`. Leading axes,
+        for example slices, are preserved.
+    bin_edges_2
+        The bin edges of the second volume.
 
     Returns
     -------
-    results: dict[int, float]
-        Dictionary with the region IDs as keys and the intersection over union
-        scores as values.
+    float or np.ndarray
+        The correlation ratio between 0 and 1. It's NaN for empty
+        histograms and if the second volume is constant.
     """
-    if region_ids is None:
-        region_ids = np.union1d(np.unique(annot_vol_1), np.unique(annot_vol_2))
-    else:
-        region_ids = sorted(set(region_ids))
+    centres = (bin_edges_2[:-1] + bin_edges_2[1:]) / 2
+    counts_1 = histogram.sum(axis=-1)
+    counts_2 = histogram.sum(axis=-2)
+    mean = _ratio(counts_2 @ centres, counts_2.sum(axis=-1))[..., np.newaxis]
+    conditional_means = _ratio(histogram @ centres, counts_1)
+    conditional_means[counts_1 == 0] = 0
 
-    scores = {}
-    for id_ in region_ids:
-        # The check we disable would check if the shapes of the volumes match
-        # and that the region ID is present in both annotation volumes. This
-        # can be expensive, so we disable it. If a region ID is not in any of
-        # the volumes then the IoU will be NaN.
-        score, _ = iou_score(annot_vol_1, annot_vol_2, k=id_)
-        scores[id_] = score
+    variance = np.sum(counts_2 * (centres - mean) ** 2, axis=-1)
+    explained = np.sum(counts_1 * (conditional_means - mean) ** 2, axis=-1)
 
-    return scores
+    return _ratio(explained, variance)[()]
 
 
-def entropy(
-    arr: np.ndarray | ma.MaskedArray,
-    *,
-    n_bins: int = 256,
-    value_range: tuple[int, int] | None = None,
-) -> float:
-    """Compute the entropy of the value distribution in an array.
+def _histogram_entropies(
+    histogram: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Compute the marginal and joint entropies of a joint histogram."""
+    n_bins = histogram.shape[-1]
+    with np.errstate(invalid="ignore"):
+        entropy_1 = stats.entropy(histogram.sum(axis=-1), base=n_bins, axis=-1)
+        entropy_2 = stats.entropy(histogram.sum(axis=-2), base=n_bins, axis=-1)
+        flat = histogram.reshape(*histogram.shape[:-2], -1)
+        joint_entropy = stats.entropy(flat, base=n_bins, axis=-1)
 
-    The entropy is computed over the discrete value distribution of the
-    given data, which is obtained by putting all values into a given number
-    of bins that are uniformly distributed over a given value range. Note that
-    the exact pixel positions and the shape of the data array don't matter,
-    only the value distribution.
+    return entropy_1, entropy_2, joint_entropy
 
-    In order to obtain results that are compatible with each other it is
-    important that the entropy is computed using the same bins. This can be
-    ensured by using fixed values for the `n_bins` and `value_range` parameters.
+
+def image_similarity(
+    values_1: np.ndarray,
+    values_2: np.ndarray,
+    **kwargs: Any,
+) -> dict[str, float | np.ndarray]:
+    """Compute intensity-based similarity metrics of two volumes.
+
+    The mutual information, the normalized mutual information and the
+    correlation ratio are all computed from the same joint histogram.
 
     Parameters
     ----------
-    arr
-        The array for which to compute the entropy.
-    n_bins
-        The number of histogram bins. The entropy is computed over the
-        discretized value distribution of the given array. To obtain the
-        discretization, a histogram of all values in the given array is
-        computed using the given number of equally sized bins across the
-        value range specified by the `value_range` parameter.
-    value_range
-        The value range over which to compute the data distribution
-        specified the lower and upper bound. If not provided then the min and
-        max of all array values will be used. In order to obtain compatible
-        results for different arrays or for different masked regions of the
-        same array it is important to make sure that the histograms are
-        computed over exactly the same bins. The bins are uniquely specified
-        by the `n_bins` and `value_range` parameters, therefore, for
-        compatible results it is important to keep these constant.
+    values_1
+        The first intensity volume, for example a warped Nissl volume.
+    values_2
+        The second intensity volume, for example the average brain.
+    kwargs
+        The parameters of `joint_histogram`, for example the `atlas` and the
+        `region_ids` to compare only some regions, or `per_slice` to obtain
+        one value per slice.
 
     Returns
     -------
-    float
-        Entropy of the (masked) array.
+    dict[str, float | np.ndarray]
+        The similarity metrics.
     """
-    if ma.isMaskedArray(arr):
-        arr = arr.compressed()
-        if value_range is None:
-            warnings.warn(
-                "Computing entropy on a masked array, but the value range "
-                "was not provided. As a result the bins will be determined "
-                "based on the intensities within the masked region only. "
-                "This will give different bins for different masks.",
-                stacklevel=2,
-            )
-    if value_range is None:
-        value_range = arr.min(), arr.max()
+    histogram, _, bin_edges_2 = joint_histogram(values_1, values_2, **kwargs)
 
-    bins = np.linspace(*value_range, n_bins + 1)
-    hist, _ = np.histogram(arr.ravel(), bins=bins)
+    return {
+        "mutual_information": mutual_information(histogram),
+        "normalized_mutual_information": normalized_mutual_information(histogram),
+        "correlation_ratio": correlation_ratio(histogram, bin_edges_2),
+    }
 
-    return stats.entropy(hist, base=n_bins)
 
+class SliceCache:
+    """Persistent on-disk cache of per-slice evaluation statistics.
 
-def conditional_entropy(
-    nissl: np.ndarray,
-    atlas: np.ndarray,
-) -> float:
-    """Compute entropies of Nissl densities.
+    The label pair counts, the value histograms and the jaggedness terms of
+    every slice are stored in a directory, keyed by a hash of the slice
+    contents. When an atlas changes in only a few slices, only those slices
+    are processed again while the global metrics stay exact. Slices are
+    taken along the first axis of the volumes.
+
+    The value histograms are only reusable if their bins don't depend on the
+    other slices, therefore the value range of the histogram bins must
+    always be given explicitly.
 
     Parameters
     ----------
-    nissl
-        Nissl volume.
-    atlas
-        Annotation atlas.
-
-    Returns
-    -------
-    conditional_entropy: float
-        Conditional entropy of the densities of Nissl depending on the brain regions.
+    path
+        The cache directory. It's created if it doesn't exist.
     """
-    value_range = nissl.min(), nissl.max()
-    weighted_entropies = []
-    n_voxels = 0
-    for label, count in zip(*np.unique(atlas, return_counts=True)):
-        if label == 0:  # skip background
-            continue
-        n_voxels += count
-        nissl_region = ma.masked_where(atlas != label, nissl)
-        entropy_score = entropy(nissl_region, value_range=value_range)
-        weighted_entropies.append(entropy_score * count)
 
-    return np.sum(weighted_entropies) / n_voxels
+    def __init__(self, path: str | os.PathLike) -> None:
+        self.path = pathlib.Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def _entry_path(
+        self, kind: str, *slices: np.ndarray, params: Any = None
+    ) -> pathlib.Path:
+        """Get the path of the cache entry for given slices."""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(f"{kind}:{params!r}".encode())
+        for slice_ in slices:
+            digest.update(f"{slice_.dtype.str}{slice_.shape}".encode())
+            digest.update(np.ascontiguousarray(slice_).tobytes())
+
+        return self.path / kind / f"{digest.hexdigest()}.npz"
+
+    @staticmethod
+    def _load_arrays(path: pathlib.Path) -> dict[str, np.ndarray]:
+        """Load a dictionary of arrays from an NPZ file."""
+        with np.load(path) as data:
+            return dict(data)
+
+    @staticmethod
+    def _save_arrays(arrays: dict[str, Any], path: pathlib.Path) -> None:
+        """Save a dictionary of arrays to an NPZ file."""
+        np.savez(path, **arrays)
+
+    def _load_or_compute(
+        self,
+        entry_path: pathlib.Path,
+        compute: Callable[..., Any],
+        *args: Any,
+        load: Callable[[pathlib.Path], Any] | None = None,
+        save: Callable[[Any, pathlib.Path], None] | None = None,
+    ) -> Any:
+        """Load a cache entry or compute and store it.
+
+        The entry is computed by calling ``compute(*args)``, and is stored
+        and loaded with the `save` and `load` callables. By default, the
+        entry must be a dictionary of arrays.
+        """
+        if load is None:
+            load = self._load_arrays
+        if save is None:
+            save = self._save_arrays
+
+        if entry_path.exists():
+            self.hits += 1
+            return load(entry_path)
+
+        self.misses += 1
+        entry = compute(*args)
+        entry_path.parent.mkdir(exist_ok=True)
+        # Write to a temporary file first so that no partial entries are seen
+        tmp_path = entry_path.with_suffix(f".{os.getpid()}.tmp.npz")
+        save(entry, tmp_path)
+        os.replace(tmp_path, entry_path)
+
+        return entry
+
+    @staticmethod
+    def _slice_histograms(
+        atlas_slice: np.ndarray,
+        values_slice: np.ndarray,
+        n_bins: int,
+        value_range: tuple[float, float],
+    ) -> dict:
+        """Compute the region histograms of one slice."""
+        labels, histograms, counts = region_histograms(
+            atlas_slice[None],
+            values_slice[None],
+            n_bins=n_bins,
+            value_range=value_range,
+        )
+        return {"labels": labels, "histograms": histograms, "counts": counts}
+
+    @staticmethod
+    def _window_jaggedness(
+        window: np.ndarray, region_groups: Mapping[Any, Collection[int]]
+    ) -> dict:
+        """Compute the jaggedness terms of three consecutive slices."""
+        sums, counts = _jaggedness_terms(window, region_groups)
+        return {"sums": sums, "counts": counts}
+
+    def confusion_matrix(
+        self, annot_vol_1: np.ndarray, annot_vol_2: np.ndarray
+    ) -> ConfusionMatrix:
+        """Count the label pairs of two annotation volumes.
+
+        This gives the same result as ``ConfusionMatrix.from_volumes``, but
+        the counts of every slice pair are loaded from the cache if possible.
+
+        Parameters
+        ----------
+        annot_vol_1
+            The first annotation volume.
+        annot_vol_2
+            The second annotation volume. Must have the same shape as
+            `annot_vol_1`.
+
+        Returns
+        -------
+        ConfusionMatrix
+            The label pair counts of the two volumes.
+
+        Raises
+        ------
+        ValueError
+            If the shapes of the volumes don't match.
+        """
+        if annot_vol_1.shape != annot_vol_2.shape:
+            raise ValueError("Data have to be of the same shape")
+
+        matrices = []
+        for slice_1, slice_2 in zip(annot_vol_1, annot_vol_2):
+            entry_path = self._entry_path("confusion", slice_1, slice_2)
+            matrix = self._load_or_compute(
+                entry_path,
+                ConfusionMatrix.from_volumes,
+                slice_1[None],
+                slice_2[None],
+                load=ConfusionMatrix.load,
+                save=ConfusionMatrix.save,
+            )
+            matrices.append(matrix)
+
+        return ConfusionMatrix.concatenate(matrices)
+
+    def region_histograms(
+        self,
+        atlas: np.ndarray,
+        values: np.ndarray,
+        *,
+        n_bins: int = 256,
+        value_range: tuple[float, float],
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Compute the value histograms of all regions in an atlas.
+
+        This gives the same result as the `region_histograms` function, but
+        the histograms of every slice are loaded from the cache if possible.
+
+        Parameters
+        ----------
+        atlas
+            An annotation atlas.
+        values
+            A volume of the same shape as `atlas`, for example a Nissl volume.
+        n_bins
+            The number of histogram bins.
+        value_range
+            The lower and upper bound of the histogram bins. Values outside
+            of this range are not counted. Unlike in the `region_histograms`
+            function it's required so that the bins of a slice don't depend
+            on the other slices.
+
+        Returns
+        -------
+        labels : np.ndarray
+            The sorted unique labels of the atlas.
+        histograms : np.ndarray
+            Array of shape ``(n_labels, n_bins)`` with the value histogram of
+            each label.
+        counts : np.ndarray
+            Array of shape ``(n_labels,)`` with the number of voxels of each
+            label.
+
+        Raises
+        ------
+        ValueError
+            If the shapes of the atlas and the values don't match.
+        """
+        if atlas.shape != values.shape:
+            raise ValueError("Data have to be of the same shape")
+
+        params = (n_bins, tuple(float(x) for x in value_range))
+        entries = []
+        for atlas_slice, values_slice in zip(atlas, values):
+            entry_path = self._entry_path(
+                "histograms", atlas_slice, values_slice, params=params
+            )
+            entries.append(
+                self._load_or_compute(
+                    entry_path,
+                    self._slice_histograms,
+                    atlas_slice,
+                    values_slice,
+                    n_bins,
+                    value_range,
+                )
+            )
+
+        labels = unique_labels(*[entry["labels"] for entry in entries])
+        histograms = np.zeros((len(labels), n_bins), dtype=np.int64)
+        counts = np.zeros(len(labels), dtype=np.int64)
+        for entry in entries:
+            rows = np.searchsorted(labels, entry["labels"])
+            histograms[rows] += entry["histograms"]
+            counts[rows] += entry["counts"]
+
+        return labels, histograms, counts
+
+    def conditional_entropy(
+        self,
+        nissl: np.ndarray,
+        atlas: np.ndarray,
+        *,
+        n_bins: int = 256,
+        value_range: tuple[float, float],
+    ) -> float:
+        """Compute entropies of Nissl densities.
+
+        This gives the same result as the `conditional_entropy` function,
+        but the histograms of every slice are loaded from the cache if
+        possible.
+
+        Parameters
+        ----------
+        nissl
+            Nissl volume.
+        atlas
+            Annotation atlas.
+        n_bins
+            The number of histogram bins, see `entropy`.
+        value_range
+            The value range of the histogram bins, see `region_histograms`.
+
+        Returns
+        -------
+        float
+            Conditional entropy of the densities of Nissl depending on the
+            brain regions.
+        """
+        labels, histograms, counts = self.region_histograms(
+            atlas, nissl, n_bins=n_bins, value_range=value_range
+        )
+
+        return _conditional_entropy(labels, histograms, counts)
+
+    def region_jaggedness(
+        self,
+        volume: np.ndarray,
+        region_groups: Mapping[Any, Collection[int]],
+    ) -> dict[Any, float]:
+        """Compute the jaggedness of many regions in one sweep.
+
+        This gives the same result as the `region_jaggedness` function along
+        the first axis, but the jaggedness terms of every window of three
+        consecutive slices are loaded from the cache if possible.
+
+        Parameters
+        ----------
+        volume
+            An annotation volume.
+        region_groups
+            The regions for which to compute the jaggedness, see
+            `region_jaggedness`.
+
+        Returns
+        -------
+        dict[Any, float]
+            The jaggedness for each region. It's NaN for regions that are not
+            present in three consecutive slices.
+        """
+        params = [sorted(int(id_) for id_ in group) for group in region_groups.values()]
+        sums = np.zeros(len(region_groups))
+        counts = np.zeros(len(region_groups), dtype=np.int64)
+        for idx in range(2, len(volume)):
+            window = volume[idx - 2 : idx + 1]
+            entry_path = self._entry_path("jaggedness", *window, params=params)
+            terms = self._load_or_compute(
+                entry_path, self._window_jaggedness, window, region_groups
+            )
+            sums += terms["sums"]
+            counts += terms["counts"]
+
+        return dict(zip(region_groups, _ratio(sums, counts)))
 
 
 def evaluate_region(
@@ -283,6 +2047,14 @@ def evaluate_region(
     atlas: np.ndarray,
     reference: np.ndarray,
     region_meta: RegionMeta,
+    *,
+    confusion: ConfusionMatrix | None = None,
+    use_meter: bool = False,
+    surface_distance: bool = False,
+    workers: int = 1,
+    atlas_index: RegionIndex | None = None,
+    reference_index: RegionIndex | None = None,
+    cache: SliceCache | None = None,
 ) -> dict[str, Any]:
     """Evaluate the atlas.
 
@@ -296,6 +2068,31 @@ def evaluate_region(
         Reference atlas.
     region_meta
         Region Meta containing all the information concerning the labels.
+    confusion
+        The label pair counts of the reference and the atlas, see
+        ``ConfusionMatrix.from_volumes``. If provided, no volume needs to be
+        scanned for the IoU. This is useful to evaluate many regions of the
+        same atlas.
+    use_meter
+        If true, the jaggedness is computed with the atlas_alignment_meter
+        package, see `meter_jaggedness`. By default it's computed by
+        `region_jaggedness` in a single sweep for the whole region and all
+        its descendants.
+    surface_distance
+        If true, the surface distance metrics of `surface_distances` are
+        computed for the whole region and for all its descendants.
+    workers
+        The number of worker processes used for the surface distances.
+    atlas_index
+        The region index of the atlas, used for the surface distances. It's
+        computed if not provided.
+    reference_index
+        The region index of the reference, used for the surface distances.
+        It's computed if not provided.
+    cache
+        If provided, the jaggedness terms of every window of three slices
+        are taken from this cache where possible, see
+        ``SliceCache.region_jaggedness``. It's not used with `use_meter`.
 
     Returns
     -------
@@ -311,34 +2108,131 @@ def evaluate_region(
         "descendants": desc,
     }
 
-    # Jaggedness
-    mask = np.isin(atlas, desc)
-    global_jaggedness = jaggedness(mask, region_ids=[1])[1]
-    per_region_jaggedness = jaggedness(atlas, region_ids=desc)
+    # The region groups of the jaggedness and the surface distances
+    groups: dict[Any, Collection[int]] = {id_: [id_] for id_ in desc}
+    groups["global"] = desc
 
+    # Jaggedness
+    per_region_jaggedness: dict[Any, float]
+    if use_meter:
+        # The region and its descendants are projected onto the region
+        projection = LabelProjection.to_ancestors(region_meta, region_ids)
+        mask = projection(atlas) != region_meta.background_id
+        global_jaggedness = meter_jaggedness(mask, region_ids=[1])[1]
+        per_region_jaggedness = meter_jaggedness(atlas, region_ids=desc)
+    elif cache is not None:
+        per_region_jaggedness = cache.region_jaggedness(atlas, groups)
+        global_jaggedness = per_region_jaggedness.pop("global")
+    else:
+        per_region_jaggedness = region_jaggedness(atlas, groups)
+        global_jaggedness = per_region_jaggedness.pop("global")
     results["jaggedness"] = {
         "global": global_jaggedness,
         "per_region": per_region_jaggedness,
     }
 
     # Intersection Over Union
-    mask_ref = np.isin(reference, desc)
-    global_iou = iou(mask_ref, mask, region_ids=[1])[1]
-    per_region_iou = iou(reference, atlas, region_ids=desc)
+    if confusion is None:
+        confusion = ConfusionMatrix.from_volumes(reference, atlas)
+    global_iou = hierarchical_iou(confusion, region_meta, {0: region_ids})[0]
+    per_region_iou = confusion.mean_iou_per_slice(desc)
 
     results["iou"] = {
         "global": global_iou,
         "per_region": per_region_iou,
     }
+
+    # Surface distances
+    if surface_distance:
+        distances = surface_distances(
+            atlas,
+            reference,
+            groups,
+            workers=workers,
+            atlas_index=atlas_index,
+            reference_index=reference_index,
+        )
+        for metric, per_region_distance in distances.items():
+            results[metric] = {
+                "global": per_region_distance.pop("global"),
+                "per_region": per_region_distance,
+            }
+
     return results
 
 
+# Volumes and shared state of the evaluation worker processes
+_worker_state: dict[str, Any] = {}
+
+
+def _init_worker(
+    volume_specs: dict[str, tuple[str, tuple[int, ...], str]],
+    region_meta: RegionMeta,
+    confusion: ConfusionMatrix,
+    cache: SliceCache | None,
+) -> None:
+    """Attach the shared memory volumes in an evaluation worker process."""
+    from multiprocessing import shared_memory
+
+    for key, (shm_name, shape, dtype) in volume_specs.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        # Keep a reference to the shared memory, it must outlive the array
+        _worker_state[f"{key}_shm"] = shm
+        _worker_state[key] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    _worker_state["region_meta"] = region_meta
+    _worker_state["confusion"] = confusion
+    _worker_state["cache"] = cache
+
+
+def _evaluate_region_task(
+    region_ids: list[int],
+    use_meter: bool,
+    surface_distance: bool,
+) -> dict[str, Any]:
+    """Evaluate a region group in a worker process."""
+    return evaluate_region(
+        region_ids,
+        _worker_state["atlas"],
+        _worker_state["reference"],
+        _worker_state["region_meta"],
+        confusion=_worker_state["confusion"],
+        use_meter=use_meter,
+        surface_distance=surface_distance,
+        cache=_worker_state["cache"],
+    )
+
+
+def _brain_entropy_task(value_range: tuple[float, float] | None) -> float:
+    """Compute the entropy of the brain in a worker process."""
+    atlas = _worker_state["atlas"]
+    return entropy(_worker_state["nissl"][atlas != 0], value_range=value_range)
+
+
+def _conditional_entropy_task(value_range: tuple[float, float] | None) -> float:
+    """Compute the conditional entropy in a worker process."""
+    return conditional_entropy(
+        _worker_state["nissl"], _worker_state["atlas"], value_range=value_range
+    )
+
+
+def _brain_entropy(labels: np.ndarray, histograms: np.ndarray) -> float:
+    """Compute the brain entropy from the output of `region_histograms`."""
+    n_bins = histograms.shape[1]
+    return stats.entropy(histograms[labels != 0].sum(axis=0), base=n_bins)
+
+
 def evaluate(
     atlas: np.ndarray,
     nissl: np.ndarray,
     reference: np.ndarray,
     region_meta: RegionMeta,
     regions_to_evaluate: dict[str, list[int]] | None = None,
+    *,
+    use_meter: bool = False,
+    surface_distance: bool = False,
+    workers: int = 1,
+    cache: SliceCache | None = None,
+    value_range: tuple[float, float] | None = None,
 ) -> dict[str, Any]:
     """Evaluate the atlas.
 
@@ -362,25 +2256,272 @@ def evaluate(
         "Hippocampus": [1080],
         "Cerebullum": [512],
         "Basal Ganglia": [477, 1022, 470, 381],}
+    use_meter
+        If true, the jaggedness is computed for all regions with the
+        atlas_alignment_meter package, see `evaluate_region`.
+    surface_distance
+        If true, the surface distance metrics of `surface_distances` are
+        computed for all regions, see `evaluate_region`.
+    workers
+        The number of worker processes. If greater than one, the region
+        groups and the entropies are evaluated in a process pool. The
+        volumes are placed once in shared memory so that the workers don't
+        receive copies of them. This requires Python 3.8 or newer.
+    cache
+        If provided, the label pair counts, the Nissl histograms and the
+        jaggedness terms of every slice are taken from this cache where
+        possible. Re-evaluating an atlas in which only a few slices changed
+        is then much faster, and the results are the same. It requires
+        `value_range`. With several workers the hits and misses of the
+        worker processes are not counted in `cache`.
+    value_range
+        The value range of the Nissl histograms of the brain entropy and
+        the conditional entropy, see `entropy`. If not provided then the
+        min and max of the brain values and of the Nissl volume are used
+        respectively.
 
     Returns
     -------
     results: dict[str, Any]
         Dictionary containing the results of the evaluation.
+
+    Raises
+    ------
+    ValueError
+        If `cache` is provided without `value_range`.
     """
     results = {}
     if regions_to_evaluate is None:
         regions_to_evaluate = REGIONS_TO_EVALUATE
 
+    entropies: tuple[float, float] | None
+    if cache is None:
+        confusion = ConfusionMatrix.from_volumes(reference, atlas)
+        entropies = None
+    elif value_range is None:
+        raise ValueError("The slice cache requires a fixed value_range")
+    else:
+        confusion = cache.confusion_matrix(reference, atlas)
+        labels, histograms, counts = cache.region_histograms(
+            atlas, nissl, value_range=value_range
+        )
+        entropies = (
+            _brain_entropy(labels, histograms),
+            _conditional_entropy(labels, histograms, counts),
+        )
+    if workers > 1:
+        return _evaluate_parallel(
+            atlas,
+            nissl,
+            reference,
+            region_meta,
+            regions_to_evaluate,
+            confusion,
+            use_meter=use_meter,
+            surface_distance=surface_distance,
+            workers=workers,
+            cache=cache,
+            value_range=value_range,
+            entropies=entropies,
+        )
+
+    # The region indices are shared by the surface distances of all regions
+    atlas_index = RegionIndex(atlas) if surface_distance else None
+    reference_index = RegionIndex(reference) if surface_distance else None
     for name, region_ids in regions_to_evaluate.items():
-        results[name] = evaluate_region(region_ids, atlas, reference, region_meta)
+        results[name] = evaluate_region(
+            region_ids,
+            atlas,
+            reference,
+            region_meta,
+            confusion=confusion,
+            use_meter=use_meter,
+            surface_distance=surface_distance,
+            atlas_index=atlas_index,
+            reference_index=reference_index,
+            cache=cache,
+        )
 
     # Entropies
-    brain_entropy = entropy(nissl[atlas != 0])
-    cond_entropy = conditional_entropy(nissl, atlas)
+    if entropies is None:
+        brain_entropy = entropy(nissl[atlas != 0], value_range=value_range)
+        cond_entropy = conditional_entropy(nissl, atlas, value_range=value_range)
+    else:
+        brain_entropy, cond_entropy = entropies
     results["global"] = {
         "brain_entropy": brain_entropy,
         "conditional_entropy": cond_entropy,
     }
 
     return results
+
+
+def _evaluate_parallel(
+    atlas: np.ndarray,
+    nissl: np.ndarray,
+    reference: np.ndarray,
+    region_meta: RegionMeta,
+    regions_to_evaluate: dict[str, list[int]],
+    confusion: ConfusionMatrix,
+    *,
+    use_meter: bool,
+    surface_distance: bool,
+    workers: int,
+    cache: SliceCache | None = None,
+    value_range: tuple[float, float] | None = None,
+    entropies: tuple[float, float] | None = None,
+) -> dict[str, Any]:
+    """Evaluate the atlas in a process pool, see `evaluate`.
+
+    If the brain entropy and the conditional entropy are provided in
+    `entropies` they're not computed again.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    try:
+        from multiprocessing import shared_memory
+    except ImportError:  # Python 3.7
+        raise RuntimeError(
+            "Evaluating with several workers requires Python 3.8 or newer, "
+            "use workers=1 instead."
+        ) from None
+
+    volumes = {"atlas": atlas, "nissl": nissl, "reference": reference}
+    shared_blocks = []
+    volume_specs = {}
+    try:
+        for key, volume in volumes.items():
+            volume = np.ascontiguousarray(volume)
+            shm = shared_memory.SharedMemory(create=True, size=max(volume.nbytes, 1))
+            shared_blocks.append(shm)
+            shared = np.ndarray(volume.shape, dtype=volume.dtype, buffer=shm.buf)
+            shared[...] = volume
+            del shared
+            volume_specs[key] = (shm.name, volume.shape, volume.dtype.str)
+
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(volume_specs, region_meta, confusion, cache),
+        ) as executor:
+            region_futures = {
+                name: executor.submit(
+                    _evaluate_region_task,
+                    region_ids,
+                    use_meter,
+                    surface_distance,
+                )
+                for name, region_ids in regions_to_evaluate.items()
+            }
+            if entropies is None:
+                brain_future = executor.submit(_brain_entropy_task, value_range)
+                cond_future = executor.submit(_conditional_entropy_task, value_range)
+                entropies = brain_future.result(), cond_future.result()
+
+            results = {name: future.result() for name, future in region_futures.items()}
+            results["global"] = {
+                "brain_entropy": entropies[0],
+                "conditional_entropy": entropies[1],
+            }
+    finally:
+        for shm in shared_blocks:
+            shm.close()
+            shm.unlink()
+
+    return results
+
+
+def evaluate_streaming(
+    atlas: np.ndarray,
+    nissl: np.ndarray,
+    reference: np.ndarray,
+    region_meta: RegionMeta,
+    regions_to_evaluate: dict[str, list[int]] | None = None,
+    *,
+    slab_size: int = 32,
+) -> dict[str, Any]:
+    """Evaluate the atlas slab by slab without loading the volumes.
+
+    This is the out-of-core variant of `evaluate` for volumes that don't fit
+    into memory. The volumes are read in slabs of slices along the first
+    axis, and only the confusion counts, value histograms and jaggedness
+    statistics are accumulated. The peak memory is therefore bounded by
+    the slab size rather than by the volume size.
+
+    The volumes are typically memory-mapped, for example via
+    ``np.load(path, mmap_mode="r")`` or ``np.memmap``. The jaggedness is
+    computed by `region_jaggedness` in a single sweep for all region groups.
+    The results are the same as those of ``evaluate``.
+
+    Parameters
+    ----------
+    atlas
+        Atlas to evaluate.
+    nissl
+        Corresponding Nissl Volume.
+    reference
+        Reference atlas.
+    region_meta
+        Region Meta containing all the information concerning the labels.
+    regions_to_evaluate
+        Regions to evaluate. If None, `REGIONS_TO_EVALUATE` is used.
+    slab_size
+        The number of slices that are read and processed at once.
+
+    Returns
+    -------
+    results: dict[str, Any]
+        Dictionary containing the results of the evaluation.
+    """
+    if regions_to_evaluate is None:
+        regions_to_evaluate = REGIONS_TO_EVALUATE
+
+    logger.info("Counting the label pairs")
+    confusion = ConfusionMatrix.from_volumes(reference, atlas, slab_size=slab_size)
+
+    # Region descendants and the jaggedness groups for all regions at once
+    descendants = {}
+    jaggedness_groups: dict[Any, Collection[int]] = {}
+    for name, region_ids in regions_to_evaluate.items():
+        desc = list(region_meta.descendants(region_ids))
+        descendants[name] = desc
+        jaggedness_groups.update({id_: [id_] for id_ in desc})
+        jaggedness_groups[("global", name)] = desc
+    logger.info("Computing the jaggedness")
+    jaggedness_scores = region_jaggedness(atlas, jaggedness_groups)
+
+    results: dict[str, Any] = {}
+    for name, region_ids in regions_to_evaluate.items():
+        desc = descendants[name]
+        global_iou = hierarchical_iou(confusion, region_meta, {0: region_ids})[0]
+        results[name] = {
+            "region_ids": region_ids,
+            "level": [region_meta.level[id_] for id_ in region_ids],
+            "descendants": desc,
+            "jaggedness": {
+                "global": jaggedness_scores[("global", name)],
+                "per_region": {id_: jaggedness_scores[id_] for id_ in desc},
+            },
+            "iou": {
+                "global": global_iou,
+                "per_region": confusion.mean_iou_per_slice(desc),
+            },
+        }
+
+    logger.info("Computing the entropies")
+    atlas = np.atleast_1d(atlas)
+    nissl = np.atleast_1d(nissl)
+    value_range = _value_range(nissl, atlas, slab_size=slab_size)
+    n_bins = 256
+    bin_edges = np.linspace(*value_range, n_bins + 1)
+    histogram = np.zeros(n_bins + 1, dtype=np.int64)
+    for start in range(0, len(nissl), slab_size):
+        slab = slice(start, start + slab_size)
+        values = nissl[slab][atlas[slab] != 0]
+        histogram += np.bincount(_bin_indices(values, bin_edges), minlength=n_bins + 1)
+    results["global"] = {
+        "brain_entropy": stats.entropy(histogram[:n_bins], base=n_bins),
+        "conditional_entropy": conditional_entropy(nissl, atlas, slab_size=slab_size),
+    }
+
+    return results
@@ -14,9 +14,12 @@
 """Functionality common to all atlas merge strategies."""
 from __future__ import annotations
 
+from collections.abc import Collection
+
 import numpy as np
 
 from atlannot.region_meta import RegionMeta
+from atlannot.region_tree import RegionTree
 
 
 def replace(array: np.ndarray, old_value: int, new_value: int) -> None:
@@ -69,7 +72,7 @@ def atlas_remap(
     return new_atlas
 
 
-def descendants(region_id, allowed_ids, rm: RegionMeta):
+def descendants(region_id, allowed_ids, rm: RegionMeta | RegionTree):
     """Get all filtered descendant IDs of a given region ID.
 
     A descendant is only accepted if it's in ``allowed_ids`` or is a
@@ -77,11 +80,130 @@ def descendants(region_id, allowed_ids, rm: RegionMeta):
 
     This is mimicking Dimitri's algorithm, I'm not sure about why this must
     be that way.
+
+    If ``rm`` is a frozen region hierarchy, see ``RegionMeta.freeze()``, then
+    the descendants are filtered at once without walking the hierarchy.
     """
+    if isinstance(rm, RegionTree):
+        region_ids = rm.descendants(region_id)[1:]
+        keep = np.isin(region_ids, list(allowed_ids)) | rm.is_leaf(region_ids)
+        return set(region_ids[keep].tolist())
+
     all_descendants = set()
-    for child_id in rm.children(region_id):
+    stack = list(rm.children(region_id))
+    while stack:
+        child_id = stack.pop()
         if child_id in allowed_ids or rm.is_leaf(child_id):
             all_descendants.add(child_id)
-        all_descendants |= descendants(child_id, allowed_ids, rm)
+        stack.extend(rm.children(child_id))
 
     return all_descendants
+
+
+def collapse_unmatched(
+    ids_1: np.ndarray,
+    ids_2: np.ndarray,
+    allowed_1: Collection[int],
+    allowed_2: Collection[int],
+    rm: RegionMeta | RegionTree,
+    *,
+    target_ids: Collection[int] | None = None,
+    ignore_ids: Collection[int] = (),
+) -> None:
+    """Collapse regions in place until all regions of one atlas are in the other.
+
+    This is the "while-loop correction" of the merging. The original loop
+    took one region of ``ids_1`` that is not in ``ids_2`` at a time, went
+    up the hierarchy to its nearest ancestor in ``target_ids``, and replaced
+    the descendants of that ancestor by the ancestor itself in both arrays,
+    see ``descendants``. The sets of region IDs were rebuilt after every
+    such collapse, which is quadratic in the number of regions.
+
+    Here all unmatched regions are handled at once and the collapses are
+    repeated until a fixed point is reached, which only takes a few rounds.
+    A region below several collapsed ancestors gets the topmost one, which
+    is what the original loop ends up with in any order.
+
+    Parameters
+    ----------
+    ids_1
+        The (unique) region IDs of the first atlas. They are all matched by
+        region IDs of the second atlas in the end.
+    ids_2
+        The (unique) region IDs of the second atlas.
+    allowed_1
+        The region IDs considered when collecting the descendants in
+        ``ids_1``, see ``descendants``.
+    allowed_2
+        The region IDs considered when collecting the descendants in
+        ``ids_2``, see ``descendants``.
+    rm
+        The brain region metadata or a frozen region hierarchy.
+    target_ids
+        The region IDs that the unmatched regions can be collapsed into. By
+        default it's ``allowed_2``.
+    ignore_ids
+        The region IDs that don't need to be matched.
+
+    Raises
+    ------
+    ValueError
+        If an unmatched region has no ancestor in ``target_ids`` or if the
+        collapses can't match all regions. The original loop never ended
+        in the latter case.
+    """
+    tree = rm if isinstance(rm, RegionTree) else rm.freeze()
+    if target_ids is None:
+        target_ids = allowed_2
+    ignore = np.fromiter(ignore_ids, dtype=np.int64)
+    while True:
+        unmatched = np.setdiff1d(ids_1, ids_2)
+        unmatched = unmatched[~np.isin(unmatched, ignore)]
+        if len(unmatched) == 0:
+            return
+
+        roots = tree.nearest_ancestors(unmatched, target_ids, fill_value=-1)
+        if np.any(roots < 0):
+            raise ValueError(
+                f"The regions {unmatched[roots < 0].tolist()} have no "
+                "ancestors to be collapsed into"
+            )
+        roots = np.unique(roots)
+        changed_1 = _collapse(ids_1, roots, allowed_1, tree)
+        changed_2 = _collapse(ids_2, roots, allowed_2, tree)
+        if not (changed_1 or changed_2):
+            raise ValueError(
+                f"The regions {unmatched.tolist()} can't be matched by collapsing "
+                "their ancestors"
+            )
+
+
+def _collapse(
+    ids: np.ndarray,
+    roots: np.ndarray,
+    allowed_ids: Collection[int],
+    tree: RegionTree,
+) -> bool:
+    """Replace regions by their topmost ancestors among given roots.
+
+    Only the regions that ``descendants`` yields for the roots are replaced,
+    that is those in ``allowed_ids`` and the leaf regions.
+
+    Returns
+    -------
+    bool
+        Whether any region was replaced.
+    """
+    known = np.flatnonzero(tree.index(ids) >= 0)
+    values = ids[known]
+    below = tree.is_ancestor(roots[:, np.newaxis], values) & (
+        roots[:, np.newaxis] != values
+    )
+    below &= np.isin(values, list(allowed_ids)) | tree.is_leaf(values)
+    moved = np.flatnonzero(below.any(axis=0))
+    if len(moved) == 0:
+        return False
+
+    levels = np.where(below[:, moved], tree.levels(roots)[:, np.newaxis], len(tree))
+    ids[known[moved]] = roots[levels.argmin(axis=0)]
+    return True
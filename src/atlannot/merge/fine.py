@@ -22,15 +22,27 @@ from __future__ import annotations
 
 import logging
 from collections import deque
+from collections.abc import Iterable, Sequence
 
 import numpy as np
 from numpy import ma
+from scipy import ndimage
 
-from atlannot.merge.common import atlas_remap, descendants, replace
+from atlannot.atlas.region_index import RegionIndex
+from atlannot.merge.common import atlas_remap, collapse_unmatched, descendants, replace
+from atlannot.merge.rules import RuleTable, apply_rules, default_rules
 from atlannot.region_meta import RegionMeta
 
 logger = logging.getLogger(__name__)
 
+# The order in which `explore_voxel` visits the neighbours of a voxel, it
+# probably matters
+_DELTAS = ((-1, 0, 0), (0, -1, 0), (1, 0, 0), (0, 1, 0), (0, 0, -1), (0, 0, 1))
+
+# The initial padding of the bounding box searched by `correct_edge` when
+# there is no limit on the distance
+_MIN_PADDING = 8
+
 
 def explore_voxel(
     start_pos: tuple,
@@ -45,6 +57,10 @@ def explore_voxel(
     Seems like this is a BFS until a voxel with a different value is
     found or the maximal number of new voxels were seen.
 
+    This is the reference implementation of the edge correction, the
+    vectorized `correct_edge` finds the same labels for all voxels of a
+    region at once.
+
     Parameters
     ----------
     start_pos
@@ -70,8 +86,6 @@ def explore_voxel(
         """Check that the position is within the atlas bounds."""
         return all(0 <= x < x_max for x, x_max in zip(pos_, masked_atlas.shape))
 
-    # The order in which the neighbours are explored probably matters
-    deltas = [(-1, 0, 0), (0, -1, 0), (1, 0, 0), (0, 1, 0), (0, 0, -1), (0, 0, 1)]
     start_value = masked_atlas[start_pos]
     seen = {start_pos}
     queue = deque([start_pos])
@@ -84,7 +98,7 @@ def explore_voxel(
             return value
 
         # BFS step
-        for dx, dy, dz in deltas:
+        for dx, dy, dz in _DELTAS:
             new_pos = (pos[0] + dx, pos[1] + dy, pos[2] + dz)
             if in_bounds(new_pos) and new_pos not in seen:
                 seen.add(new_pos)
@@ -94,10 +108,267 @@ def explore_voxel(
     return start_value
 
 
+def _bfs_offsets(count: int) -> np.ndarray:
+    """Get the offsets of the first voxels visited by `explore_voxel`.
+
+    Far from the atlas boundaries the BFS visits the same offsets from
+    every starting voxel, regardless of the atlas values.
+
+    Parameters
+    ----------
+    count
+        The number of visited voxels.
+
+    Returns
+    -------
+    np.ndarray
+        The offsets of the first `count` visited voxels in the order of
+        their visit, with shape (count, 3). The first one is the starting
+        voxel itself.
+    """
+    offsets = [(0, 0, 0)]
+    seen = set(offsets)
+    i = 0
+    while len(offsets) < count:
+        x, y, z = offsets[i]
+        for dx, dy, dz in _DELTAS:
+            new_offset = (x + dx, y + dy, z + dz)
+            if new_offset not in seen:
+                seen.add(new_offset)
+                offsets.append(new_offset)
+        i += 1
+
+    return np.array(offsets[:count], dtype=np.int64).reshape(-1, 3)
+
+
+def _first_visited_labels(
+    region_id: int,
+    atlas: np.ndarray,
+    keep_ids: Sequence[int],
+    error_voxel: tuple[np.ndarray, ...],
+    count: int,
+) -> np.ndarray:
+    """Find the labels the BFS of `explore_voxel` with a limited count finds.
+
+    The voxels are checked offset by offset in the order of the BFS. Only
+    the voxels near the atlas boundaries, where the BFS skips the positions
+    outside of the atlas, are explored one by one.
+    """
+    new_values = np.full(len(error_voxel[0]), region_id, dtype=atlas.dtype)
+    offsets = _bfs_offsets(count)
+    if len(offsets) < 2:
+        return new_values
+
+    depth = int(np.abs(offsets).sum(axis=1).max())
+    coords = np.stack(error_voxel, axis=1)
+    interior = np.all(
+        (coords >= depth) & (coords < np.array(atlas.shape) - depth), axis=1
+    )
+    todo = np.flatnonzero(interior)
+    for offset in offsets[1:]:
+        values = atlas[tuple((coords[todo] + offset).T)]
+        found = np.isin(values, keep_ids) & (values != region_id)
+        new_values[todo[found]] = values[found]
+        todo = todo[~found]
+
+    # The BFS never reaches farther than `count` from the starting voxel
+    for i in np.flatnonzero(~interior):
+        lo = np.maximum(coords[i] - count, 0)
+        hi = np.minimum(coords[i] + count + 1, atlas.shape)
+        atlas_crop = atlas[tuple(slice(a, b) for a, b in zip(lo, hi))]
+        masked_crop = ma.masked_array(
+            atlas_crop, np.isin(atlas_crop, keep_ids, invert=True)
+        )
+        start_pos = tuple(int(x) for x in coords[i] - lo)
+        new_values[i] = explore_voxel(start_pos, masked_crop, count=count)
+
+    return new_values
+
+
+def _nearest_labels(
+    region_id: int,
+    atlas: np.ndarray,
+    keep_ids: Sequence[int],
+    error_voxel: tuple[np.ndarray, ...],
+    radius: int | None,
+) -> np.ndarray:
+    """Find the nearest labels with a multi-source distance transform.
+
+    The distance transform runs over the bounding box of the voxels. If
+    there is no limit on the distance the box is grown until the nearest
+    label of every voxel is found.
+    """
+    new_values = np.full(len(error_voxel[0]), region_id, dtype=atlas.dtype)
+    todo = np.arange(len(error_voxel[0]))
+    padding = radius if radius is not None else _MIN_PADDING
+    while len(todo) > 0:
+        coords = [axis_coords[todo] for axis_coords in error_voxel]
+        lo = np.array([max(int(x.min()) - padding, 0) for x in coords])
+        hi = np.array(
+            [min(int(x.max()) + 1 + padding, n) for x, n in zip(coords, atlas.shape)]
+        )
+        atlas_crop = atlas[tuple(slice(a, b) for a, b in zip(lo, hi))]
+        sources = np.isin(atlas_crop, keep_ids) & (atlas_crop != region_id)
+        local = tuple(x - x0 for x, x0 in zip(coords, lo))
+        whole_atlas = np.all(lo == 0) and np.all(hi == atlas.shape)
+        if not np.any(sources):
+            if radius is not None or whole_atlas:
+                break
+            padding *= 2
+            continue
+
+        distances, indices = ndimage.distance_transform_cdt(
+            ~sources, metric="taxicab", return_indices=True
+        )
+        distance = distances[local]
+        nearest = atlas_crop[tuple(axis_indices[local] for axis_indices in indices)]
+        if radius is not None:
+            # The crop contains all voxels within `radius` of the region
+            found = distance <= radius
+            new_values[todo[found]] = nearest[found]
+            break
+
+        # A voxel outside the crop is farther than the crop boundary. The
+        # boundaries of the atlas don't count, nothing is beyond them.
+        to_boundary = np.full(len(todo), np.iinfo(np.int64).max)
+        for x, x0, x1, n in zip(local, lo, hi, atlas.shape):
+            if x0 > 0:
+                np.minimum(to_boundary, x + 1, out=to_boundary)
+            if x1 < n:
+                np.minimum(to_boundary, x1 - x0 - x, out=to_boundary)
+        found = distance <= to_boundary
+        new_values[todo[found]] = nearest[found]
+        todo = todo[~found]
+        padding *= 2
+
+    return new_values
+
+
+def correct_edge(
+    region_id: int,
+    atlas: np.ndarray,
+    keep_ids: Sequence[int],
+    *,
+    count: int,
+    radius: int | None = None,
+    region_index: RegionIndex | None = None,
+) -> None:
+    """Correct the annotation edge of a region in place.
+
+    Every voxel of the region is relabelled to the nearest voxel with a
+    different label in `keep_ids`, all other labels are ignored. This gives
+    the same results as running `explore_voxel` on every voxel, but all
+    voxels of the region are processed at once.
+
+    With a non-negative `count` the search visits the same voxels as the
+    BFS of `explore_voxel` and the results are identical. Otherwise the
+    nearest labels are found with a multi-source distance transform in the
+    taxicab metric, which is the number of steps of the BFS. If several
+    labelled voxels are equally near, the BFS takes the first one in the
+    order of its neighbour deltas, while the distance transform takes the
+    first one in its raster scans. Such voxels can therefore get a
+    different, but equally near, label.
+
+    Parameters
+    ----------
+    region_id
+        The ID of the region to correct.
+    atlas
+        The annotation atlas. It will be modified in place.
+    keep_ids
+        The region IDs that are not masked, usually `region_id` and its
+        descendants.
+    count
+        The maximal number of voxels visited per voxel, as in
+        `explore_voxel`. A negative value means no limit.
+    radius
+        The maximal taxicab distance between a voxel and the voxel whose
+        label it gets. Voxels without a label within this distance keep
+        the region ID. It can only be used if `count` is negative.
+    region_index
+        The region index of the atlas. It must be up to date at least for
+        the voxels of `region_id`. If provided, the voxels of the region are
+        read from the index instead of being searched in the whole atlas.
+
+    Raises
+    ------
+    ValueError
+        If both `count` and `radius` limit the search.
+    """
+    if count >= 0 and radius is not None:
+        raise ValueError("The search can only be limited by one of count and radius")
+    if region_index is None:
+        error_voxel = np.nonzero(atlas == region_id)
+    else:
+        error_voxel = region_index.coordinates(region_id)
+    logger.info("Correcting %d voxels", len(error_voxel[0]))
+    if len(error_voxel[0]) == 0:
+        return
+
+    if count >= 0:
+        new_values = _first_visited_labels(
+            region_id, atlas, keep_ids, error_voxel, count
+        )
+    else:
+        new_values = _nearest_labels(region_id, atlas, keep_ids, error_voxel, radius)
+    atlas[error_voxel] = new_values
+
+
+def correct_edges(
+    region_ids: Iterable[int],
+    atlas: np.ndarray,
+    allowed_ids: set[int],
+    rm: RegionMeta,
+    *,
+    count: int,
+    radius: int | None = None,
+) -> None:
+    """Correct the annotation edges of several regions in place.
+
+    The regions are corrected one after the other with `correct_edge`,
+    keeping each region and its descendants in `allowed_ids`. A region index
+    of the atlas is built once and only rebuilt if a region to correct has
+    received voxels from a previous correction.
+
+    Parameters
+    ----------
+    region_ids
+        The IDs of the regions to correct.
+    atlas
+        The annotation atlas. It will be modified in place.
+    allowed_ids
+        The region IDs considered when collecting the descendants of the
+        regions.
+    rm
+        The brain region metadata.
+    count
+        The maximal number of voxels visited per voxel, see `correct_edge`.
+    radius
+        The maximal search distance per voxel, see `correct_edge`.
+    """
+    region_index = RegionIndex(atlas)
+    modified_ids: set[int] = set()
+    for region_id in region_ids:
+        if region_id in modified_ids:
+            region_index = RegionIndex(atlas)
+            modified_ids.clear()
+        keep_ids = [region_id, *descendants(region_id, allowed_ids, rm)]
+        correct_edge(
+            region_id,
+            atlas,
+            keep_ids,
+            count=count,
+            radius=radius,
+            region_index=region_index,
+        )
+        modified_ids.update(keep_ids)
+
+
 def manual_relabel_1(ids_v2: np.ndarray, ids_v3: np.ndarray) -> None:
     """Perform a manual re-labeling step on the CCFv2 and CCFv3 atlases.
 
-    The replacements were compiled by Dimitri Rodarie.
+    The replacements were compiled by Dimitri Rodarie. They are stored in
+    the rule table "manual_1" of ``rules/fine.json``.
 
     Parameters
     ----------
@@ -106,94 +377,14 @@ def manual_relabel_1(ids_v2: np.ndarray, ids_v3: np.ndarray) -> None:
     ids_v3
         The (unique) region IDs of the CCFv3 atlas.
     """
-    # Hippocampus Field CA2 is strongly different -> merge it with CA1
-    replace(ids_v2, 423, 382)
-    replace(ids_v3, 423, 382)
-
-    # Entorhinal area, lateral part
-    replace(ids_v2, 60, 28)  # L6b -> L6a
-    replace(ids_v2, 999, 20)  # L2/3 -> L2 # double check?
-    replace(ids_v2, 715, 20)  # L2a -> L2
-    replace(ids_v2, 764, 20)  # L2b -> L2
-    replace(ids_v2, 92, 139)  # L4 -> L5
-    replace(ids_v2, 312, 139)  # L4/5 -> L5
-
-    # Entorhinal area, medial part, dorsal zone
-    replace(ids_v2, 468, 543)  # L2a -> L2
-    replace(ids_v2, 508, 543)  # L2b -> L2
-    replace(ids_v2, 712, 727)  # L4 -> L5 # double check?
-
-    replace(ids_v2, 195, 304)  # L2 -> L2/3
-    replace(ids_v2, 524, 582)  # L2 -> L2/3
-    replace(ids_v2, 606, 430)  # L2 -> L2/3
-    replace(ids_v2, 747, 556)  # L2 -> L2/3
-
-    # subreg of Cochlear nuclei -> Cochlear nuclei
-    replace(ids_v2, 96, 607)
-    replace(ids_v2, 101, 607)
-    replace(ids_v2, 112, 607)
-    replace(ids_v2, 560, 607)
-    replace(ids_v3, 96, 607)
-    replace(ids_v3, 101, 607)
-    # subreg of Nucleus ambiguus -> Nucleus ambiguus
-    replace(ids_v2, 143, 135)
-    replace(ids_v2, 939, 135)
-    replace(ids_v3, 143, 135)
-    replace(ids_v3, 939, 135)
-    # subreg of Accessory olfactory bulb -> Accessory olfactory bulb
-    replace(ids_v2, 188, 151)
-    replace(ids_v2, 196, 151)
-    replace(ids_v2, 204, 151)
-    replace(ids_v3, 188, 151)
-    replace(ids_v3, 196, 151)
-    replace(ids_v3, 204, 151)
-    # subreg of Medial mammillary nucleus -> Medial mammillary nucleus
-    replace(ids_v2, 798, 491)
-    replace(ids_v3, 798, 491)
-    replace(ids_v3, 606826647, 491)
-    replace(ids_v3, 606826651, 491)
-    replace(ids_v3, 606826655, 491)
-    replace(ids_v3, 606826659, 491)
-    # Subreg to Dorsal part of the lateral geniculate complex
-    replace(ids_v3, 496345664, 170)
-    replace(ids_v3, 496345668, 170)
-    replace(ids_v3, 496345672, 170)
-    # Subreg to Lateral reticular nucleus
-    replace(ids_v2, 955, 235)
-    replace(ids_v2, 963, 235)
-    replace(ids_v3, 955, 235)
-    replace(ids_v3, 963, 235)
-
-    # subreg of Posterior parietal association areas combined layer by layer
-    replace(ids_v3, 312782550, 532)
-    replace(ids_v3, 312782604, 532)
-    replace(ids_v3, 312782554, 241)
-    replace(ids_v3, 312782608, 241)
-    replace(ids_v3, 312782558, 635)
-    replace(ids_v3, 312782612, 635)
-    replace(ids_v3, 312782562, 683)
-    replace(ids_v3, 312782616, 683)
-    replace(ids_v3, 312782566, 308)
-    replace(ids_v3, 312782620, 308)
-    replace(ids_v3, 312782570, 340)
-    replace(ids_v3, 312782624, 340)
-
-    # subreg to Parabrachial nucleus
-    replace(ids_v2, 123, 867)
-    replace(ids_v2, 860, 867)
-    replace(ids_v2, 868, 867)
-    replace(ids_v2, 875, 867)
-    replace(ids_v2, 883, 867)
-    replace(ids_v2, 891, 867)
-    replace(ids_v2, 899, 867)
-    replace(ids_v2, 915, 867)
-    replace(ids_v3, 123, 867)
+    apply_rules(default_rules("fine"), "manual_1", {"ccfv2": ids_v2, "ccfv3": ids_v3})
 
 
 def manual_relabel_2(ids_v2: np.ndarray, ids_v3: np.ndarray) -> None:
     """Perform a manual re-labeling step on the CCFv2 and CCFv3 atlases.
 
-    The replacements were compiled by Dimitri Rodarie.
+    The replacements were compiled by Dimitri Rodarie. They are stored in
+    the rule table "manual_2" of ``rules/fine.json``.
 
     Parameters
     ----------
@@ -202,41 +393,17 @@ def manual_relabel_2(ids_v2: np.ndarray, ids_v3: np.ndarray) -> None:
     ids_v3
         The (unique) region IDs of the CCFv3 atlas.
     """
-    # subreg of Prosubiculum to subiculum
-    replace(ids_v3, 484682470, 502)
-    # Orbital area, medial part, layer 6b -> 6a
-    replace(ids_v3, 527696977, 910)
-    replace(ids_v3, 355, 314)
-
-    # Frontal pole children to their parent
-    replace(ids_v3, 68, 184)
-    replace(ids_v3, 667, 184)
-    replace(ids_v3, 526157192, 184)
-    replace(ids_v3, 526157196, 184)
-    replace(ids_v3, 526322264, 184)
-    replace(ids_v2, 68, 184)
-    replace(ids_v2, 667, 184)
-
-    # Every region ventral to cortex transition area is merge because
-    # Entorhinal area, medial part, ventral zone is not in CCFv3
-    # ie 259,  324,  371, 1133, 655, 663, 780 -> 663
-    replace(ids_v2, 259, 663)
-    replace(ids_v2, 324, 663)
-    replace(ids_v2, 371, 663)
-    replace(ids_v2, 1133, 663)
-
-    replace(ids_v2, 655, 663)
-    replace(ids_v2, 780, 663)
-    replace(ids_v3, 655, 663)
-    replace(ids_v3, 780, 663)
+    apply_rules(default_rules("fine"), "manual_2", {"ccfv2": ids_v2, "ccfv3": ids_v3})
 
 
 def merge(
     ccfv2: np.ndarray,
     ccfv3: np.ndarray,
     rm: RegionMeta,
+    *,
+    rules: dict[str, RuleTable] | None = None,
 ) -> tuple[np.ndarray, np.ndarray]:
-    """Perform the coarse atlas merging.
+    """Perform the fine atlas merging.
 
     Parameters
     ----------
@@ -249,6 +416,9 @@ def merge(
         ``RegionMeta.from_dict(brain_regions)``, where ``brain_regions``
         can be obtained from the "msg" key of the ``brain_regions.json``
         (``1.json``) file.
+    rules
+        The relabel rule tables by stage name, see `atlannot.merge.rules`.
+        By default those in ``rules/fine.json`` are used.
 
     Returns
     -------
@@ -262,6 +432,9 @@ def merge(
     v2_to = v2_from.copy()
     v3_from = np.unique(ccfv3)
     v3_to = v3_from.copy()
+    tree = rm.freeze()
+    if rules is None:
+        rules = default_rules("fine")
 
     logger.info("Collecting all CCFv2 and CCFv3 region IDs")
     all_v2_region_ids: set = rm.ancestors(v2_to)
@@ -275,43 +448,28 @@ def merge(
         if rm.is_leaf(id_) and rm.parent(id_) in unique_v3:
             replace(v2_to, id_, rm.parent(id_))
         elif rm.is_leaf(id_) and (
-            rm.in_region_like("Medial amygdalar nucleus", id_)
-            or rm.in_region_like("Subiculum", id_)
-            or rm.in_region_like("Bed nuclei of the stria terminalis", id_)
+            id_ in tree.regions_like("Medial amygdalar nucleus")
+            or id_ in tree.regions_like("Subiculum")
+            or id_ in tree.regions_like("Bed nuclei of the stria terminalis")
         ):
             replace(v2_to, id_, rm.parent(rm.parent(id_)))
-        elif rm.in_region_like("Paraventricular hypothalamic nucleus", id_):
+        elif id_ in tree.regions_like("Paraventricular hypothalamic nucleus"):
             replace(v2_to, id_, 38)
 
     logger.info("Manual relabeling #1")
-    manual_relabel_1(v2_to, v3_to)
+    apply_rules(rules, "manual_1", {"ccfv2": v2_to, "ccfv3": v3_to})
 
     logger.info("Second for loop correction")
-    for id_ in (unique_v2 | unique_v3) - {0}:
-        if not rm.in_region_like("Visual areas", id_):
-            continue
-
-        if rm.in_region_like("ayer 1", id_):
-            replace(v3_to, id_, 801)
-            replace(v2_to, id_, 801)
-        elif rm.in_region_like("ayer 2/3", id_):
-            replace(v3_to, id_, 561)
-            replace(v2_to, id_, 561)
-        elif rm.in_region_like("ayer 4", id_):
-            replace(v3_to, id_, 913)
-            replace(v2_to, id_, 913)
-        elif rm.in_region_like("ayer 5", id_):
-            replace(v3_to, id_, 937)
-            replace(v2_to, id_, 937)
-        elif rm.in_region_like("ayer 6a", id_):
-            replace(v3_to, id_, 457)
-            replace(v2_to, id_, 457)
-        elif rm.in_region_like("ayer 6b", id_):
-            replace(v3_to, id_, 497)
-            replace(v2_to, id_, 497)
+    apply_rules(
+        rules,
+        "visual_layers",
+        {"ccfv2": v2_to, "ccfv3": v3_to},
+        rm,
+        (unique_v2 | unique_v3) - {0},
+    )
 
     logger.info("Manual relabeling #2")
-    manual_relabel_2(v2_to, v3_to)
+    apply_rules(rules, "manual_2", {"ccfv2": v2_to, "ccfv3": v3_to})
 
     logger.info("Ramapping atlases")
     # Need to get the remapped atlases here because the edge correction happens
@@ -322,40 +480,22 @@ def merge(
 
     # Medial terminal nucleus of the accessory optic tract -> Ventral tegmental area
 
-    def correct_edge(region_id: int, atlas: np.ndarray, *, count: int) -> None:
-        """Correct annotation edge for CCFv2 and CCFv3."""
-        # Mask non-descendant regions
-        keep_ids = [region_id, *descendants(region_id, all_v2_region_ids, rm)]
-        hide_mask = np.isin(atlas, keep_ids, invert=True)
-        masked_atlas = ma.masked_array(atlas, hide_mask)
-
-        # Get all voxels with the given region ID and run the correction on them
-        error_voxel = np.where(atlas == region_id)
-        logger.info("Exploring %d voxels", len(error_voxel[0]))
-        new_values = [
-            explore_voxel(xyz, masked_atlas, count=count) for xyz in zip(*error_voxel)
-        ]
-        atlas[error_voxel] = new_values
-
     # Correct annotation edge for CCFv2 and CCFv3
     # no limit for striatum
     logger.info("First filter")
-    correct_edge(278, ccfv2_new, count=-1)
+    correct_edges([278], ccfv2_new, all_v2_region_ids, rm, count=-1)
 
     logger.info("Second filter")
-    for id_ in [803, 477]:
-        correct_edge(id_, ccfv3_new, count=-1)
+    correct_edges([803, 477], ccfv3_new, all_v2_region_ids, rm, count=-1)
 
     # Correct CCFv2 annotation edge Cerebral cortex, Basic Cell group and
     # regions and root  1089, 688, 8, 997
     logger.info("Third filter")
-    for id_ in [688, 8, 997]:
-        correct_edge(id_, ccfv2_new, count=3)
+    correct_edges([688, 8, 997], ccfv2_new, all_v2_region_ids, rm, count=3)
 
     # Correct CCFv3 annotation edge for Hippocampal formation, Cortical subplate
     logger.info("Fourth filter")
-    for id_ in [1089, 703]:
-        correct_edge(id_, ccfv3_new, count=3)
+    correct_edges([1089, 703], ccfv3_new, all_v2_region_ids, rm, count=3)
 
     logger.info("Preparing region ID maps")
     v2_from = np.unique(ccfv2_new)
@@ -364,42 +504,21 @@ def merge(
     v3_to = v3_from.copy()
 
     logger.info("Some more manual replacement of descendants")
-    for id_main in [795]:
-        for id_ in descendants(id_main, all_v2_region_ids, rm):
-            if id_ in all_v2_region_ids:
-                replace(v2_to, id_, id_main)
-            if id_ in all_v3_region_ids:
-                replace(v3_to, id_, id_main)
+    # The original only collapsed the CCFv3 descendants that are either
+    # CCFv2 regions or leaf regions
+    v3_descendant_ids = {
+        id_ for id_ in all_v3_region_ids if id_ in all_v2_region_ids or rm.is_leaf(id_)
+    }
+    apply_rules(rules, "descendants", {"ccfv2": v2_to}, rm, all_v2_region_ids)
+    apply_rules(rules, "descendants", {"ccfv3": v3_to}, rm, v3_descendant_ids)
 
     logger.info("More for-loop corrections")
-    unique_v2 = set(v2_to)
-    unique_v3 = set(v3_to)
-    for id_ in unique_v2 - {0}:
-        if rm.in_region_like("fiber tracts", id_):
-            replace(v2_to, id_, 1009)
-        elif rm.in_region_like("ventricular systems", id_):
-            replace(v2_to, id_, 997)
-    for id_ in unique_v3 - {0}:
-        if rm.in_region_like("fiber tracts", id_):
-            replace(v3_to, id_, 1009)
-        elif rm.in_region_like("ventricular systems", id_):
-            replace(v3_to, id_, 997)
+    stage = "fiber_tracts_and_ventricles"
+    apply_rules(rules, stage, {"ccfv2": v2_to}, rm, set(v2_to) - {0})
+    apply_rules(rules, stage, {"ccfv3": v3_to}, rm, set(v3_to) - {0})
 
     logger.info("While-loop correction")
-    unique_v2 = set(v2_to)
-    unique_v3 = set(v3_to)
-    ids_to_correct = unique_v3 - unique_v2
-    while len(ids_to_correct) > 0:
-        id_ = ids_to_correct.pop()
-        while id_ not in all_v2_region_ids:
-            id_ = rm.parent(id_)
-        for child in descendants(id_, all_v3_region_ids, rm):
-            replace(v3_to, child, id_)
-        for child in descendants(id_, all_v2_region_ids, rm):
-            replace(v2_to, child, id_)
-        unique_v2 = set(v2_to)
-        unique_v3 = set(v3_to)
-        ids_to_correct = unique_v3 - unique_v2
+    collapse_unmatched(v3_to, v2_to, all_v3_region_ids, all_v2_region_ids, tree)
 
     logger.info("Ramapping atlases")
     ccfv2_new = atlas_remap(ccfv2_new, v2_from, v2_to)
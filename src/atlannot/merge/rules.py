@@ -0,0 +1,302 @@
+# Copyright 2022, Blue Brain Project, EPFL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Relabel rules of the atlas merging expressed as data.
+
+The manual relabeling steps of the merging strategies are stored as rule
+tables in the JSON files of the ``rules`` directory next to this module.
+A rules file maps the names of the relabeling stages to rule tables, and a
+rule table is a list of rules. Every rule moves some regions to a target
+region ``"to"`` and selects the regions in one of three ways:
+
+* ``"ids"``: a list of region IDs,
+* ``"subtree"``: all descendants of a region. The target defaults to the
+  region itself, which collapses the subtree,
+* ``"pattern"``: all regions that belong to a region whose name matches a
+  regex, see ``RegionMeta.in_region_like``. With the optional ``"within"``
+  regex only the regions that also belong to a region with a matching name
+  are selected.
+
+The optional key ``"atlases"`` lists the names of the atlases the rule
+applies to, by default it applies to all of them. The key ``"comment"``
+is ignored.
+
+A rule table is compiled into one mapping of region IDs. If several rules
+select the same region then the first one wins, and the moves are followed
+transitively: a region moved to a region that is moved itself ends up in
+the final target. Cycles of moves are an error.
+
+To try other rules, pass the tables loaded with `load_rules` to the
+``merge`` functions of the merging strategies.
+"""
+from __future__ import annotations
+
+import functools
+import json
+import pathlib
+from collections.abc import Collection, Iterable
+
+import numpy as np
+
+from atlannot.atlas.projection import LabelProjection
+from atlannot.region_meta import RegionMeta
+
+RULES_DIR = pathlib.Path(__file__).parent / "rules"
+_SELECTORS = ("ids", "subtree", "pattern")
+_KEYS = {*_SELECTORS, "to", "within", "atlases", "comment"}
+
+
+class RuleTable:
+    """A table of relabel rules.
+
+    Parameters
+    ----------
+    rules
+        The rules, see the module documentation for their format.
+
+    Raises
+    ------
+    ValueError
+        If a rule is malformed.
+    """
+
+    def __init__(self, rules: Iterable[dict]) -> None:
+        self.rules = list(rules)
+        for rule in self.rules:
+            unknown_keys = set(rule) - _KEYS
+            if unknown_keys:
+                raise ValueError(f"Unknown keys in the rule {rule}: {unknown_keys}")
+            selectors = [key for key in _SELECTORS if key in rule]
+            if len(selectors) != 1:
+                raise ValueError(
+                    f"The rule {rule} must have exactly one of the keys {_SELECTORS}"
+                )
+            if "to" not in rule and "subtree" not in rule:
+                raise ValueError(f"The rule {rule} has no target region")
+            if "within" in rule and "pattern" not in rule:
+                raise ValueError(f"The rule {rule} has 'within' without a pattern")
+
+    def __len__(self) -> int:
+        """Get the number of rules."""
+        return len(self.rules)
+
+    def moves(
+        self,
+        rm: RegionMeta | None = None,
+        region_ids: Collection[int] | None = None,
+        atlas: str | None = None,
+    ) -> dict[int, int]:
+        """Collect the moves of all rules without following them.
+
+        Parameters
+        ----------
+        rm
+            The brain region metadata. It's only needed for the subtree and
+            the pattern rules.
+        region_ids
+            If provided, the subtree and the pattern rules only select
+            regions in this collection.
+        atlas
+            The name of the atlas. If provided, only the rules for this
+            atlas are considered.
+
+        Returns
+        -------
+        dict
+            The target of every selected region. Regions moved to themselves
+            are left out.
+        """
+        moves: dict[int, int] = {}
+        tree = None
+        for rule in self.rules:
+            if atlas is not None and atlas not in rule.get("atlases", [atlas]):
+                continue
+            if "ids" in rule:
+                selected: Iterable[int] = rule["ids"]
+            else:
+                if rm is None:
+                    raise ValueError(f"The rule {rule} needs the region metadata")
+                if tree is None:
+                    tree = rm.freeze()
+                if "subtree" in rule:
+                    selected = tree.descendants(rule["subtree"])[1:].tolist()
+                else:
+                    selected = tree.regions_like(rule["pattern"])
+                    if "within" in rule:
+                        selected = selected & tree.regions_like(rule["within"])
+                if region_ids is not None:
+                    selected = [id_ for id_ in selected if id_ in region_ids]
+            target = rule["to"] if "to" in rule else rule["subtree"]
+            for id_ in selected:
+                if id_ not in moves and id_ != target:
+                    moves[id_] = target
+
+        return moves
+
+    def compile(
+        self,
+        rm: RegionMeta | None = None,
+        region_ids: Collection[int] | None = None,
+        atlas: str | None = None,
+    ) -> dict[int, int]:
+        """Compile the rules into one mapping of region IDs.
+
+        Parameters
+        ----------
+        rm
+            The brain region metadata. It's only needed for the subtree and
+            the pattern rules.
+        region_ids
+            If provided, the subtree and the pattern rules only select
+            regions in this collection.
+        atlas
+            The name of the atlas. If provided, only the rules for this
+            atlas are considered.
+
+        Returns
+        -------
+        dict
+            The final target of every region that is moved.
+
+        Raises
+        ------
+        ValueError
+            If the moves contain a cycle.
+        """
+        moves = self.moves(rm, region_ids, atlas)
+        mapping: dict[int, int] = {}
+        for id_ in moves:
+            path = [id_]
+            while path[-1] in moves and path[-1] not in mapping:
+                path.append(moves[path[-1]])
+                if path[-1] in path[:-1]:
+                    cycle = " -> ".join(str(x) for x in path[path.index(path[-1]) :])
+                    raise ValueError(f"The relabel rules contain a cycle: {cycle}")
+            target = mapping.get(path[-1], path[-1])
+            for step in path[:-1]:
+                mapping[step] = target
+
+        return mapping
+
+    def apply(
+        self,
+        ids: np.ndarray,
+        rm: RegionMeta | None = None,
+        region_ids: Collection[int] | None = None,
+        atlas: str | None = None,
+    ) -> None:
+        """Relabel region IDs in place.
+
+        Parameters
+        ----------
+        ids
+            The region IDs to relabel, usually the unique IDs of an atlas.
+        rm
+            The brain region metadata. It's only needed for the subtree and
+            the pattern rules.
+        region_ids
+            If provided, the subtree and the pattern rules only select
+            regions in this collection.
+        atlas
+            The name of the atlas. If provided, only the rules for this
+            atlas are applied.
+        """
+        mapping = self.compile(rm, region_ids, atlas)
+        if not mapping:
+            return
+        labels = np.array(sorted(mapping))
+        targets = np.array([mapping[label] for label in labels])
+        LabelProjection(labels, targets)(ids, out=ids)
+
+
+def load_rules(path: str | pathlib.Path) -> dict[str, RuleTable]:
+    """Load the rule tables from a file.
+
+    Parameters
+    ----------
+    path
+        The path to a JSON file, or to a YAML file if it has the suffix
+        ".yaml" or ".yml". Reading YAML files requires PyYAML.
+
+    Returns
+    -------
+    dict
+        The rule tables by stage name.
+    """
+    path = pathlib.Path(path)
+    with path.open() as fh:
+        if path.suffix in {".yaml", ".yml"}:
+            import yaml
+
+            tables = yaml.safe_load(fh)
+        else:
+            tables = json.load(fh)
+
+    return {stage: RuleTable(rules) for stage, rules in tables.items()}
+
+
+def default_rules(strategy: str) -> dict[str, RuleTable]:
+    """Load the default rule tables of a merging strategy.
+
+    The rules files are only read once, later calls reuse the tables.
+
+    Parameters
+    ----------
+    strategy
+        The merging strategy, "coarse" or "fine".
+
+    Returns
+    -------
+    dict
+        The rule tables by stage name. The dictionary is a new one for
+        every call, but the tables are shared.
+    """
+    return dict(_load_default_rules(strategy))
+
+
+@functools.lru_cache(maxsize=None)
+def _load_default_rules(strategy: str) -> dict[str, RuleTable]:
+    """Load the default rule tables of a merging strategy once."""
+    return load_rules(RULES_DIR / f"{strategy}.json")
+
+
+def apply_rules(
+    tables: dict[str, RuleTable],
+    stage: str,
+    atlases: dict[str, np.ndarray],
+    rm: RegionMeta | None = None,
+    region_ids: Collection[int] | None = None,
+) -> None:
+    """Apply the rule table of a relabeling stage to several atlases in place.
+
+    Parameters
+    ----------
+    tables
+        The rule tables by stage name. Nothing is done if there is no table
+        for the stage.
+    stage
+        The name of the relabeling stage.
+    atlases
+        The region IDs to relabel by atlas name, usually the unique IDs
+        of the atlases.
+    rm
+        The brain region metadata. It's only needed for the subtree and
+        the pattern rules.
+    region_ids
+        If provided, the subtree and the pattern rules only select regions
+        in this collection.
+    """
+    if stage not in tables:
+        return
+    for atlas, ids in atlases.items():
+        tables[stage].apply(ids, rm, region_ids, atlas)
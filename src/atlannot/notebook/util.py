@@ -19,7 +19,7 @@ import matplotlib.pyplot as plt
 import numpy as np
 from matplotlib import patches
 
-from ..atlas.align import get_misalignment
+from ..atlas.align import get_misalignment, level_misalignments
 
 
 def print_misalignments(unfurled_atlas_1, unfurled_atlas_2, file=None):
@@ -50,6 +50,35 @@ def print_misalignments(unfurled_atlas_1, unfurled_atlas_2, file=None):
         )
 
 
+def print_level_misalignments(atlas_1, atlas_2, region_meta, file=None):
+    """Print misalignment for every region hierarchy level.
+
+    The output is the same as that of `print_misalignments` for the unfurled
+    atlases, but the unfurled atlases don't need to be constructed.
+
+    Parameters
+    ----------
+    atlas_1 : np.ndarray
+        First atlas.
+    atlas_2 : np.ndarray
+        Second atlas of the same shape as atlas_1.
+    region_meta : atlannot.region_meta.RegionMeta
+        The region metadata.
+    file
+        The output file. If None then sys.stdout is used.
+    """
+    if file is None:
+        file = sys.stdout
+
+    misalignments = level_misalignments(atlas_1, atlas_2, region_meta)
+    for level, (mis, mis_fg) in misalignments.items():
+        print(
+            f"Misalignment at level {level:2d} (all / foreground): "
+            f"{mis * 100:6.2f}% / {mis_fg * 100:6.2f}%",
+            file=file,
+        )
+
+
 def image_grid(image_dict, n_columns=2, plot_width=12, fig_title=None, save_as=None):
     """Plot images in a grid.
 
@@ -14,13 +14,150 @@
 """Implementation of the RegionMeta class."""
 from __future__ import annotations
 
+import bisect
+import gc
+import hashlib
 import json
 import logging
 import numbers
+import os
+import pathlib
 import re
+import shutil
+from operator import itemgetter
+
+import numpy as np
+
+from atlannot.region_tree import RegionTree
 
 logger = logging.getLogger(__name__)
 
+SNAPSHOT_VERSION = 2
+_SNAPSHOT_INT_FIELDS = (
+    "parent_id",
+    "level",
+    "atlas_id",
+    "ontology_id",
+    "graph_order",
+    "st_level",
+    "hemisphere_id",
+)
+_SNAPSHOT_STR_FIELDS = ("acronym_", "name_", "color_hex_triplet")
+# The attributes filled from the structure graph and their keys in it
+_PARSED_FIELDS = (
+    ("atlas_id", "atlas_id"),
+    ("ontology_id", "ontology_id"),
+    ("acronym_", "acronym"),
+    ("name_", "name"),
+    ("color_hex_triplet", "color_hex_triplet"),
+    ("graph_order", "graph_order"),
+    ("st_level", "st_level"),
+    ("hemisphere_id", "hemisphere_id"),
+)
+
+
+def default_cache_dir():
+    """Get the default directory for cached region metadata snapshots.
+
+    It's ``$XDG_CACHE_HOME/atlannot/region_meta``, where ``XDG_CACHE_HOME``
+    defaults to ``~/.cache``.
+
+    Returns
+    -------
+    pathlib.Path
+        The cache directory.
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME") or "~/.cache"
+    return pathlib.Path(cache_home).expanduser() / "atlannot" / "region_meta"
+
+
+class _LabelIndex:
+    """Lookup of region IDs by their names or acronyms.
+
+    Parameters
+    ----------
+    labels : dict
+        The region names or acronyms keyed by region ID.
+    case_sensitive : bool
+        If false the lookups ignore the case of the labels.
+    """
+
+    def __init__(self, labels, case_sensitive):
+        self.case_sensitive = case_sensitive
+        self.ids: dict[str, int] = {}
+        for id_, label in labels.items():
+            # The first region with a given label wins, as for a linear scan
+            self.ids.setdefault(self.key(label), id_)
+        # A sorted list of the labels serves as a prefix tree
+        sorted_items = sorted(
+            (self.key(label), n, id_) for n, (id_, label) in enumerate(labels.items())
+        )
+        self.sorted_keys = [key for key, _, _ in sorted_items]
+        self.sorted_ids = [id_ for _, _, id_ in sorted_items]
+
+    def key(self, label):
+        """Normalize a label for the lookups."""
+        return label if self.case_sensitive else label.casefold()
+
+    def get(self, label):
+        """Find the region ID with a given label, None if there's none."""
+        return self.ids.get(self.key(label))
+
+    def with_prefix(self, prefix):
+        """Find the region IDs whose labels start with a given prefix."""
+        prefix = self.key(prefix)
+        start = bisect.bisect_left(self.sorted_keys, prefix)
+        stop = start
+        while stop < len(self.sorted_keys) and self.sorted_keys[stop].startswith(
+            prefix
+        ):
+            stop += 1
+        return self.sorted_ids[start:stop]
+
+
+class _VersionedDict(dict):
+    """A dictionary that counts its modifications.
+
+    The lookup indexes of `RegionMeta` compare the versions of the region
+    dictionaries to find out if they are stale.
+    """
+
+    # A class attribute so that unpickling can set items before the
+    # instance attributes are restored
+    version = 0
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.version += 1
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.version += 1
+
+    def __ior__(self, other):  # type: ignore[misc]
+        self.update(other)
+        return self
+
+    def clear(self):
+        super().clear()
+        self.version += 1
+
+    def pop(self, *args):
+        self.version += 1
+        return super().pop(*args)
+
+    def popitem(self):
+        self.version += 1
+        return super().popitem()
+
+    def setdefault(self, key, default=None):
+        self.version += 1
+        return super().setdefault(key, default)
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self.version += 1
+
 
 class RegionMeta:
     """Class holding the hierarchical region metadata.
@@ -54,6 +191,37 @@ class RegionMeta:
 
         self.level = {self.background_id: 0}
 
+        self._indexed_versions = None
+        self._label_indexes = {}
+        self._level_ids = {}
+
+    @property
+    def acronym_(self):
+        """The region acronyms keyed by region ID."""
+        return self._acronym
+
+    @acronym_.setter
+    def acronym_(self, acronyms):
+        self._acronym = _VersionedDict(acronyms)
+
+    @property
+    def name_(self):
+        """The region names keyed by region ID."""
+        return self._name
+
+    @name_.setter
+    def name_(self, names):
+        self._name = _VersionedDict(names)
+
+    @property
+    def level(self):
+        """The hierarchy levels keyed by region ID."""
+        return self._level
+
+    @level.setter
+    def level(self, levels):
+        self._level = _VersionedDict(levels)
+
     def __repr__(self):
         """Create the repr of the instance."""
         return f"<{str(self)}>"
@@ -89,9 +257,7 @@ class RegionMeta:
         region_id : int
             A region ID at the given level
         """
-        for region_id, region_level in self.level.items():
-            if region_level == level:
-                yield region_id
+        yield from self._indexes()[1].get(level, [])
 
     def is_valid_id(self, id_):
         """Check whether the given region ID is part of the structure graph.
@@ -209,11 +375,7 @@ class RegionMeta:
         int or None
             The region ID if a region is found, otherwise None
         """
-        for id_, region_name in self.name_.items():
-            if name == region_name:
-                return id_
-
-        return None
+        return self._label_index(acronym=False, case_sensitive=True).get(name)
 
     def find_by_acronym(self, acronym):
         """Find the region ID given its acronym.
@@ -228,11 +390,87 @@ class RegionMeta:
         int or None
             The region ID if a region is found, otherwise None
         """
-        for id_, region_acronym in self.acronym_.items():
-            if acronym == region_acronym:
-                return id_
+        return self._label_index(acronym=True, case_sensitive=True).get(acronym)
 
-        return None
+    def find_ids(self, labels, acronym=False, case_sensitive=True):
+        """Find the region IDs of many region names or acronyms at once.
+
+        Parameters
+        ----------
+        labels : iterable of str
+            Region names or region acronyms.
+        acronym : bool, default False
+            If true the labels are region acronyms, otherwise region names.
+        case_sensitive : bool, default True
+            If false the case of the labels is ignored.
+
+        Returns
+        -------
+        np.ndarray
+            The region IDs of the labels, -1 for labels that were not found.
+        """
+        index = self._label_index(acronym, case_sensitive)
+        ids = [index.get(label) for label in labels]
+        return np.array([-1 if id_ is None else id_ for id_ in ids], dtype=np.int64)
+
+    def find_by_prefix(self, prefix, acronym=False, case_sensitive=True):
+        """Find all regions whose name or acronym starts with a given prefix.
+
+        Parameters
+        ----------
+        prefix : str
+            The beginning of region names or acronyms.
+        acronym : bool, default False
+            If true the acronyms are searched, otherwise the names.
+        case_sensitive : bool, default True
+            If false the case of the names or acronyms is ignored.
+
+        Returns
+        -------
+        list of int
+            The IDs of the matching regions, sorted by name or acronym.
+        """
+        return self._label_index(acronym, case_sensitive).with_prefix(prefix)
+
+    def _indexes(self):
+        """Get the lookup indexes, rebuilding them if regions were modified.
+
+        The indexes are built when the hierarchy is parsed. Since the
+        region dictionaries are public they are also rebuilt whenever one
+        of the names, acronyms or levels was modified since they were
+        built. Assigning a new dictionary to one of these attributes stores
+        a copy of it.
+
+        Returns
+        -------
+        label_indexes : dict
+            The `_LabelIndex` instances keyed by the acronym and
+            case-sensitivity flags. They are built on demand.
+        level_ids : dict
+            The region IDs at every hierarchy level.
+        """
+        versions = tuple(
+            (id(labels), labels.version)
+            for labels in (self._name, self._acronym, self._level)
+        )
+        if versions != self._indexed_versions:
+            self._indexed_versions = versions
+            self._label_indexes = {}
+            self._level_ids = {}
+            for region_id, region_level in self.level.items():
+                self._level_ids.setdefault(region_level, []).append(region_id)
+
+        return self._label_indexes, self._level_ids
+
+    def _label_index(self, acronym, case_sensitive):
+        """Get the index of the region names or acronyms."""
+        label_indexes, _ = self._indexes()
+        key = (acronym, case_sensitive)
+        if key not in label_indexes:
+            labels = self.acronym_ if acronym else self.name_
+            label_indexes[key] = _LabelIndex(labels, case_sensitive)
+
+        return label_indexes[key]
 
     def ancestors(self, ids, include_background=False):
         """Find all ancestors of given regions.
@@ -292,19 +530,29 @@ class RegionMeta:
         else:
             unique_ids = set(ids)
 
-        def iter_descendants(region_id):
-            """Iterate over all descendants of a given region ID."""
-            yield region_id
-            for child in self.children(region_id):
-                yield child
-                yield from iter_descendants(child)
-
         descendants = set()
-        for id_ in unique_ids:
-            descendants |= set(iter_descendants(id_))
+        stack = list(unique_ids)
+        while stack:
+            id_ = stack.pop()
+            if id_ not in descendants:
+                descendants.add(id_)
+                stack.extend(self.children(id_))
 
         return descendants
 
+    def freeze(self) -> RegionTree:
+        """Create a frozen, array-backed copy of the region hierarchy.
+
+        The result supports fast and vectorized hierarchy queries, but
+        it does not reflect later modifications of this instance.
+
+        Returns
+        -------
+        RegionTree
+            The frozen region hierarchy.
+        """
+        return RegionTree.from_region_meta(self)
+
     @property
     def depth(self):
         """Find the depth of the region hierarchy.
@@ -337,6 +585,9 @@ class RegionMeta:
         Note that providing a simple string without any special characters
         is equivalent to a substring test.
 
+        To test many regions against the same pattern use the memoized
+        ``regions_like`` method of the frozen hierarchy, see `freeze`.
+
         Parameters
         ----------
         region_name_regex : str
@@ -379,10 +630,14 @@ class RegionMeta:
         """
         if root_id is None:
             root_id = self.root_id
-        # Tracks which parent region guide lines should be printed.
-        guides: list[bool] = []
 
-        def handle_region(id_, level=0, is_last=False):
+        # The stack entries are the region ID, the depth below the root, the
+        # flags telling which parent region guide lines should be printed,
+        # and whether the region is the last child of its parent.
+        stack: list[tuple[int, int, tuple[bool, ...], bool]] = [(root_id, 0, (), False)]
+        while stack:
+            id_, level, guides, is_last = stack.pop()
+
             # Print the region name line
             name = self.acronym(id_) if acronym else self.name(id_)
             indents = ["|   " if is_active else "    " for is_active in guides]
@@ -390,28 +645,51 @@ class RegionMeta:
                 indents[-1] = "└── " if is_last else "├── "
             print(f'{"".join(indents)}{name} ({id_})')
 
-            # Stop recursion at max depth
+            # Stop at max depth
             if level == max_depth:
-                return
+                continue
 
-            # Recurse to the children
+            # Visit the children next, in order
             children = self.children(id_)
-            if not children:
-                return
-            guides.append(True)
-            for child in children[:-1]:
-                handle_region(child, level + 1)
-            guides[-1] = False
-            handle_region(children[-1], level + 1, is_last=True)
-            guides.pop()
+            for i, child in reversed(list(enumerate(children))):
+                is_last_child = i == len(children) - 1
+                stack.append(
+                    (child, level + 1, (*guides, not is_last_child), is_last_child)
+                )
+
+    def iter_regions(self, root_id=None):
+        """Iterate over the region IDs in graph order.
 
-        handle_region(root_id)
+        The regions are visited depth-first, every region before its
+        children, and the children in the order of the structure graph.
+
+        Parameters
+        ----------
+        root_id : int, optional
+            The region ID at which the iteration starts. Defaults to the
+            hierarchy root region.
+
+        Yields
+        ------
+        int
+            The region ID of the root region or of one of its descendants.
+        """
+        if root_id is None:
+            root_id = self.root_id
+        stack = [root_id]
+        while stack:
+            id_ = stack.pop()
+            yield id_
+            stack.extend(reversed(self.children_ids[id_]))
 
     def _parse_region_hierarchy(self, region, is_root=False):
         """Parse and save a region and its children.
 
         This helper method is usually used to initialize the class
-        instance.
+        instance. The structure graph is first flattened into a list of
+        regions in parsing order with an explicit stack, so that arbitrarily
+        deep hierarchies can be parsed. The metadata is then stored column
+        by column.
 
         Parameters
         ----------
@@ -422,29 +700,31 @@ class RegionMeta:
             region. As a consequence it will be attached as the child of
             the background.
         """
-        region_id = region["id"]
+        regions = []
+        stack = [region]
+        while stack:
+            region = stack.pop()
+            regions.append(region)
+            # Reversed so that the children are parsed in order
+            stack.extend(reversed(region["children"]))
+
+        # Store the metadata column by column
+        ids = list(map(itemgetter("id"), regions))
+        parent_ids = list(map(itemgetter("parent_structure_id"), regions))
         if is_root:
-            self.root_id = region_id
-            parent_id = self.background_id
-        else:
-            parent_id = region["parent_structure_id"]
-        self.children_ids[parent_id].append(region_id)
-
-        self.atlas_id[region_id] = region["atlas_id"]
-        self.ontology_id[region_id] = region["ontology_id"]
-        self.acronym_[region_id] = region["acronym"]
-        self.name_[region_id] = region["name"]
-        self.color_hex_triplet[region_id] = region["color_hex_triplet"]
-        self.graph_order[region_id] = region["graph_order"]
-        self.st_level[region_id] = region["st_level"]
-        self.hemisphere_id[region_id] = region["hemisphere_id"]
-        self.parent_id[region_id] = parent_id
-
-        self.level[region_id] = self.level[parent_id] + 1
-        self.children_ids[region_id] = []
-
-        for child in region["children"]:
-            self._parse_region_hierarchy(child)
+            self.root_id = ids[0]
+            parent_ids[0] = self.background_id
+        for field, key in _PARSED_FIELDS:
+            getattr(self, field).update(zip(ids, map(itemgetter(key), regions)))
+        self.parent_id.update(zip(ids, parent_ids))
+
+        # The parents are parsed before their children
+        levels = dict(self.level)
+        self.children_ids.update((region_id, []) for region_id in ids)
+        for region_id, parent_id in zip(ids, parent_ids):
+            levels[region_id] = levels[parent_id] + 1
+            self.children_ids[parent_id].append(region_id)
+        self.level.update(levels)
 
     @classmethod
     def from_dict(cls, region_hierarchy, warn_raw_response=True):
@@ -473,7 +753,17 @@ class RegionMeta:
             region_hierarchy = region_hierarchy["msg"][0]
 
         self = cls()
-        self._parse_region_hierarchy(region_hierarchy, is_root=True)
+        # Parsing allocates many containers, but no reference cycles, so
+        # pause the garbage collector instead of letting it scan them again
+        # and again
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            self._parse_region_hierarchy(region_hierarchy, is_root=True)
+        finally:
+            if gc_enabled:
+                gc.enable()
+        self._indexes()
 
         return self
 
@@ -495,9 +785,12 @@ class RegionMeta:
         dict
             The serialised region structure data.
         """
+        if root_id is None:
+            root_id = self.root_id
 
-        def region_to_dict(id_):
-            region_dict = {
+        region_dicts = {}
+        for id_ in self.iter_regions(root_id):
+            region_dicts[id_] = {
                 "id": id_,
                 "atlas_id": self.atlas_id[id_],
                 "ontology_id": self.ontology_id[id_],
@@ -510,34 +803,75 @@ class RegionMeta:
                 "parent_structure_id": self.parent_id[id_],
                 "children": [],
             }
-            for child_id in self.children_ids[id_]:
-                region_dict["children"].append(region_to_dict(child_id))
-
-            return region_dict
-
-        if root_id is None:
-            root_id = self.root_id
-        result = region_to_dict(root_id)
+            # The parents are visited before their children
+            if id_ != root_id:
+                parent_dict = region_dicts[self.parent_id[id_]]
+                parent_dict["children"].append(region_dicts[id_])
+        result = region_dicts[root_id]
         # Detach the root region rest of the rest of structure graph
         result["parent_structure_id"] = None
 
         return result
 
     @classmethod
-    def load_json(cls, json_path):
+    def load_json(cls, json_path, use_cache=True, cache_dir=None):
         """Load the structure graph from a JSON file and create an instance.
 
+        Parsing a large structure graph is slow, so by default a binary
+        snapshot of the parsed metadata is cached, see `save_snapshot`. The
+        snapshots are keyed by a hash of the JSON file contents, so a
+        snapshot is only reused if the file is unchanged.
+
         Parameters
         ----------
         json_path : str or pathlib.Path
+        use_cache : bool, default True
+            If true snapshots are loaded from and saved to the cache
+            directory. If false the JSON file is always parsed and nothing
+            is written to the cache directory.
+        cache_dir : str or pathlib.Path, optional
+            The cache directory. By default it's given by `default_cache_dir`.
 
         Returns
         -------
         RegionMeta
             The initialized instance of this class.
         """
-        with open(json_path) as fh:
-            structure_graph = json.load(fh)
+        with open(json_path, "rb") as fh:
+            content = fh.read()
+        if not use_cache:
+            return cls._from_json_content(content)
+
+        if cache_dir is None:
+            cache_dir = default_cache_dir()
+        digest = hashlib.blake2b(content, digest_size=16).hexdigest()
+        snapshot_path = pathlib.Path(cache_dir) / digest
+        if snapshot_path.exists():
+            try:
+                return cls.load_snapshot(snapshot_path)
+            except Exception as exc:
+                # A broken snapshot must never prevent loading the JSON file
+                logger.warning("Ignoring invalid snapshot %s: %s", snapshot_path, exc)
+                shutil.rmtree(snapshot_path, ignore_errors=True)
+
+        self = cls._from_json_content(content)
+        # Write to a temporary directory first so that no partial snapshots
+        # are seen by concurrent processes
+        tmp_path = snapshot_path.with_name(f"{digest}.{os.getpid()}.tmp")
+        try:
+            self.save_snapshot(tmp_path)
+            os.replace(tmp_path, snapshot_path)
+        except (OSError, ValueError, TypeError) as exc:
+            logger.warning("Could not cache the region metadata: %s", exc)
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+        return self
+
+    @classmethod
+    def _from_json_content(cls, content):
+        """Create an instance from the contents of a JSON file."""
+        structure_graph = json.loads(content)
 
         # The JSON file could be either a raw response with the AIBS headers
         # or just the bare structure graph. We don't make any assumptions and
@@ -545,3 +879,116 @@ class RegionMeta:
         # raw response.
 
         return cls.from_dict(structure_graph, warn_raw_response=False)
+
+    def save_snapshot(self, path):
+        """Save the region metadata to a compact binary snapshot.
+
+        The snapshot is a directory of uncompressed NumPy ``.npy`` arrays,
+        which `load_snapshot` memory-maps. All integer fields of all regions
+        are stored in one table and all strings in one string table of
+        null-separated UTF-8 text, each with a mask of the missing values.
+        Loading a snapshot is much faster than parsing the structure graph.
+
+        Parameters
+        ----------
+        path : str or pathlib.Path
+            The path of the snapshot directory. It's created if necessary.
+        """
+        # The insertion order of the regions is the parsing order, which
+        # also determines the order of the children
+        ids = list(self.parent_id)
+        int_values = [
+            [getattr(self, field).get(id_) for field in _SNAPSHOT_INT_FIELDS]
+            for id_ in ids
+        ]
+        str_values = [
+            [getattr(self, field).get(id_) for field in _SNAPSHOT_STR_FIELDS]
+            for id_ in ids
+        ]
+        strings = "\0".join(
+            value or "" for values in zip(*str_values) for value in values
+        )
+        arrays = {
+            "header": np.array(
+                [
+                    SNAPSHOT_VERSION,
+                    self.background_id,
+                    -1 if self.root_id is None else self.root_id,
+                ],
+                dtype=np.int64,
+            ),
+            "ids": np.array(ids, dtype=np.int64),
+            "ints": np.array(
+                [[value or 0 for value in values] for values in int_values],
+                dtype=np.int64,
+            ).reshape(len(ids), len(_SNAPSHOT_INT_FIELDS)),
+            "nulls": np.array(
+                [[value is None for value in values] for values in int_values],
+                dtype=bool,
+            ).reshape(len(ids), len(_SNAPSHOT_INT_FIELDS)),
+            "strings": np.frombuffer(strings.encode(), dtype=np.uint8),
+            "string_nulls": np.array(
+                [[value is None for value in values] for values in str_values],
+                dtype=bool,
+            ).reshape(len(ids), len(_SNAPSHOT_STR_FIELDS)),
+        }
+
+        path = pathlib.Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for name, array in arrays.items():
+            np.save(path / f"{name}.npy", array)
+
+    @classmethod
+    def load_snapshot(cls, path):
+        """Load the region metadata from a snapshot created by `save_snapshot`.
+
+        Parameters
+        ----------
+        path : str or pathlib.Path
+            The path of the snapshot directory.
+
+        Returns
+        -------
+        RegionMeta
+            The initialized instance of this class.
+
+        Raises
+        ------
+        ValueError
+            If the snapshot was created by an incompatible version.
+        """
+        path = pathlib.Path(path)
+
+        def load(name):
+            """Memory-map an array of the snapshot."""
+            return np.load(path / f"{name}.npy", mmap_mode="r")
+
+        version, background_id, root_id = load("header").tolist()
+        if version != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported snapshot version {version}")
+        self = cls(background_id=background_id)
+        self.root_id = None if root_id == -1 else root_id
+        ids = load("ids").tolist()
+
+        ints = load("ints")
+        nulls = load("nulls")
+        for i, field in enumerate(_SNAPSHOT_INT_FIELDS):
+            values = ints[:, i].tolist()
+            for j in np.flatnonzero(nulls[:, i]).tolist():
+                values[j] = None
+            getattr(self, field).update(zip(ids, values))
+
+        strings = load("strings").tobytes().decode().split("\0")
+        string_nulls = load("string_nulls")
+        for i, field in enumerate(_SNAPSHOT_STR_FIELDS):
+            values = strings[i * len(ids) : (i + 1) * len(ids)]
+            for j in np.flatnonzero(string_nulls[:, i]).tolist():
+                values[j] = None
+            getattr(self, field).update(zip(ids, values))
+        self.children_ids = {id_: [] for id_ in ids}
+        for id_, parent_id in self.parent_id.items():
+            if parent_id is not None:
+                self.children_ids.setdefault(parent_id, []).append(id_)
+        self._indexes()
+
+        return self
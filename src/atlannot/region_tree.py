@@ -0,0 +1,602 @@
+# Copyright 2022, Blue Brain Project, EPFL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Implementation of the RegionTree class."""
+from __future__ import annotations
+
+import re
+from collections.abc import Collection, Iterator
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:  # pragma: no cover
+    from atlannot.region_meta import RegionMeta
+
+
+class RegionTree:
+    """Frozen, array-backed representation of a region hierarchy.
+
+    All regions, including the background, are stored as nodes in the
+    order of their sorted region IDs, so that region IDs are mapped to nodes
+    with a binary search. The hierarchy is stored in contiguous arrays, and
+    an Euler tour gives every node the range ``entry:exit`` of positions in
+    the pre-order traversal (`preorder`) that is covered by its subtree.
+    As a consequence
+
+    * checking if a region is an ancestor of another one is O(1),
+    * the descendants of a region are a contiguous slice of `preorder`,
+    * all queries are vectorized over arrays of region IDs.
+
+    Instances are usually obtained with ``RegionMeta.freeze()``. They don't
+    reflect later changes to the region metadata.
+
+    Parameters
+    ----------
+    ids
+        The sorted region IDs, including the background.
+    parent
+        The node of the parent of every node, -1 for the background.
+    background_id
+        The region ID of the background.
+    root_id
+        The region ID of the root region.
+    names
+        The region names of all nodes.
+    acronyms
+        The region acronyms of all nodes.
+    children_order
+        The order of the children of each node. By default the children
+        are sorted by region ID.
+
+    Attributes
+    ----------
+    ids : np.ndarray
+        The sorted region IDs of all nodes.
+    parent : np.ndarray
+        The node of the parent of every node, -1 for the background.
+    level : np.ndarray
+        The hierarchy level of every node, 0 for the background.
+    child_offsets : np.ndarray
+        The children of node ``i`` are
+        ``children[child_offsets[i]:child_offsets[i + 1]]``.
+    children : np.ndarray
+        The child nodes of all nodes.
+    preorder : np.ndarray
+        The nodes in the order of a depth-first pre-order traversal of the
+        hierarchy starting from the background.
+    entry : np.ndarray
+        The position of every node in `preorder`.
+    exit : np.ndarray
+        The position in `preorder` that follows the subtree of every node.
+    names : list of str
+        The region names of all nodes.
+    acronyms : list of str
+        The region acronyms of all nodes.
+    """
+
+    def __init__(
+        self,
+        ids: np.ndarray,
+        parent: np.ndarray,
+        *,
+        background_id: int = 0,
+        root_id: int | None = None,
+        names: list[str] | None = None,
+        acronyms: list[str] | None = None,
+        children_order: np.ndarray | None = None,
+    ) -> None:
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.parent = np.asarray(parent, dtype=np.intp)
+        self.background_id = background_id
+        self.root_id = root_id
+        n_nodes = len(self.ids)
+        self.names = names if names is not None else [""] * n_nodes
+        self.acronyms = acronyms if acronyms is not None else [""] * n_nodes
+        if np.any(self.ids[1:] <= self.ids[:-1]):
+            raise ValueError("The region IDs must be sorted and unique")
+
+        # Children in CSR format, sorted by parent and then in the given order
+        if children_order is None:
+            children_order = np.arange(n_nodes)
+        non_roots = children_order[self.parent[children_order] >= 0]
+        self.children = non_roots[
+            np.argsort(self.parent[non_roots], kind="stable")
+        ].astype(np.intp)
+        n_children = np.bincount(self.parent[non_roots], minlength=n_nodes)
+        self.child_offsets = np.concatenate([[0], np.cumsum(n_children)])
+
+        # Euler tour with an explicit stack, starting from all parentless nodes
+        self.preorder = np.empty(n_nodes, dtype=np.intp)
+        self.entry = np.empty(n_nodes, dtype=np.intp)
+        self.exit = np.empty(n_nodes, dtype=np.intp)
+        self.level = np.zeros(n_nodes, dtype=np.intp)
+        position = 0
+        stack = [(node, False) for node in np.flatnonzero(self.parent < 0)[::-1]]
+        while stack:
+            node, visited = stack.pop()
+            if visited:
+                self.exit[node] = position
+                continue
+            self.preorder[position] = node
+            self.entry[node] = position
+            position += 1
+            stack.append((node, True))
+            node_children = self.children[
+                self.child_offsets[node] : self.child_offsets[node + 1]
+            ]
+            self.level[node_children] = self.level[node] + 1
+            stack.extend((child, False) for child in node_children[::-1])
+        if position != n_nodes:
+            raise ValueError("The region hierarchy contains a cycle")
+
+        self._ancestor_table: np.ndarray | None = None
+        self._name_masks: dict[str | re.Pattern, np.ndarray] = {}
+        self._regions_like: dict[str | re.Pattern, frozenset[int]] = {}
+
+    @classmethod
+    def from_region_meta(cls, region_meta: RegionMeta) -> RegionTree:
+        """Construct the tree from region metadata.
+
+        Parameters
+        ----------
+        region_meta
+            The region metadata.
+
+        Returns
+        -------
+        RegionTree
+            The frozen region hierarchy.
+        """
+        # The order in which the regions were added is the order of the
+        # children in the hierarchy
+        insertion_order = list(region_meta.parent_id)
+        ids = np.array(sorted(insertion_order), dtype=np.int64)
+        nodes = {id_: node for node, id_ in enumerate(ids.tolist())}
+        parent = np.array(
+            [nodes.get(region_meta.parent_id[id_], -1) for id_ in ids.tolist()],
+            dtype=np.intp,
+        )
+        names = [region_meta.name_.get(id_, "") for id_ in ids.tolist()]
+        acronyms = [region_meta.acronym_.get(id_, "") for id_ in ids.tolist()]
+
+        return cls(
+            ids,
+            parent,
+            background_id=region_meta.background_id,
+            root_id=region_meta.root_id,
+            names=names,
+            acronyms=acronyms,
+            children_order=np.array([nodes[id_] for id_ in insertion_order]),
+        )
+
+    def __len__(self) -> int:
+        """Get the number of regions, including the background."""
+        return len(self.ids)
+
+    def __contains__(self, region_id: int) -> bool:
+        """Check if a region ID is part of the hierarchy."""
+        return bool(self.index(region_id) >= 0)
+
+    def index(self, ids: int | np.ndarray) -> np.ndarray:
+        """Find the nodes of region IDs.
+
+        Parameters
+        ----------
+        ids
+            A region ID or an array of region IDs.
+
+        Returns
+        -------
+        np.ndarray
+            The nodes of the regions, -1 for unknown region IDs. Has the same
+            shape as `ids`.
+        """
+        ids = np.asarray(ids)
+        nodes = np.minimum(np.searchsorted(self.ids, ids), len(self.ids) - 1)
+        return np.where(self.ids[nodes] == ids, nodes, -1)
+
+    def _nodes(self, ids: int | np.ndarray) -> np.ndarray:
+        """Find the nodes of region IDs and fail for unknown IDs."""
+        nodes = self.index(ids)
+        if np.any(nodes < 0):
+            unknown = np.unique(np.asarray(ids)[nodes < 0])
+            raise KeyError(f"Unknown region IDs: {unknown.tolist()}")
+        return nodes
+
+    def parent_ids(self, ids: int | np.ndarray) -> np.ndarray:
+        """Get the parent region IDs of regions.
+
+        Parameters
+        ----------
+        ids
+            A region ID or an array of region IDs.
+
+        Returns
+        -------
+        np.ndarray
+            The parent region IDs. The parent of the background is -1.
+        """
+        parent = self.parent[self._nodes(ids)]
+        return np.where(parent >= 0, self.ids[parent], -1)
+
+    def levels(self, ids: int | np.ndarray) -> np.ndarray:
+        """Get the hierarchy levels of regions.
+
+        Parameters
+        ----------
+        ids
+            A region ID or an array of region IDs.
+
+        Returns
+        -------
+        np.ndarray
+            The hierarchy levels, 0 for the background.
+        """
+        return self.level[self._nodes(ids)]
+
+    def is_leaf(self, ids: int | np.ndarray) -> np.ndarray:
+        """Check if regions are leaf regions.
+
+        Parameters
+        ----------
+        ids
+            A region ID or an array of region IDs.
+
+        Returns
+        -------
+        np.ndarray
+            Whether or not the regions have no children.
+        """
+        nodes = self._nodes(ids)
+        return self.child_offsets[nodes + 1] == self.child_offsets[nodes]
+
+    def is_ancestor(
+        self, ancestor_ids: int | np.ndarray, ids: int | np.ndarray
+    ) -> np.ndarray:
+        """Check if regions are ancestors of other regions.
+
+        Every region is considered to be its own ancestor. The arrays of
+        region IDs are broadcast against each other.
+
+        Parameters
+        ----------
+        ancestor_ids
+            A region ID or an array of region IDs of the potential ancestors.
+        ids
+            A region ID or an array of region IDs.
+
+        Returns
+        -------
+        np.ndarray
+            Whether or not each region in `ancestor_ids` is an ancestor of
+            the corresponding region in `ids`.
+        """
+        ancestors = self._nodes(ancestor_ids)
+        entry = self.entry[self._nodes(ids)]
+        return (self.entry[ancestors] <= entry) & (entry < self.exit[ancestors])
+
+    def children_ids(self, region_id: int) -> np.ndarray:
+        """Get the child region IDs of a region.
+
+        Parameters
+        ----------
+        region_id
+            A region ID.
+
+        Returns
+        -------
+        np.ndarray
+            The region IDs of the children in hierarchy order.
+        """
+        node = self._nodes(region_id)
+        start, stop = self.child_offsets[node], self.child_offsets[node + 1]
+        return self.ids[self.children[start:stop]]
+
+    def descendants(self, region_id: int) -> np.ndarray:
+        """Get all descendant region IDs of a region.
+
+        The result is inclusive, i.e. the region itself is the first entry.
+
+        Parameters
+        ----------
+        region_id
+            A region ID.
+
+        Returns
+        -------
+        np.ndarray
+            The region IDs of the descendants in pre-order.
+        """
+        node = self._nodes(region_id)
+        return self.ids[self.preorder[self.entry[node] : self.exit[node]]]
+
+    def descendants_of(self, ids: int | np.ndarray) -> np.ndarray:
+        """Get all descendants of several regions.
+
+        The result is inclusive, i.e. the input regions are included.
+
+        Parameters
+        ----------
+        ids
+            A region ID or an array of region IDs.
+
+        Returns
+        -------
+        np.ndarray
+            The sorted unique region IDs of all descendants.
+        """
+        nodes = np.atleast_1d(self._nodes(ids))
+        covered = np.zeros(len(self.ids) + 1, dtype=np.intp)
+        np.add.at(covered, self.entry[nodes], 1)
+        np.add.at(covered, self.exit[nodes], -1)
+        in_subtree = np.cumsum(covered[:-1]) > 0
+        return np.sort(self.ids[self.preorder[in_subtree]])
+
+    def ancestors(self, region_id: int, include_background: bool = False) -> np.ndarray:
+        """Get all ancestor region IDs of a region.
+
+        The result is inclusive, i.e. the region itself is the first entry.
+
+        Parameters
+        ----------
+        region_id
+            A region ID.
+        include_background
+            If true the background is included in the result.
+
+        Returns
+        -------
+        np.ndarray
+            The region IDs of the ancestors, from the region up to the root.
+        """
+        node = int(self._nodes(region_id))
+        nodes = []
+        while node >= 0:
+            nodes.append(node)
+            node = self.parent[node]
+        ancestors = self.ids[nodes]
+        if not include_background:
+            ancestors = ancestors[ancestors != self.background_id]
+        return ancestors
+
+    def lca(self, ids_1: int | np.ndarray, ids_2: int | np.ndarray) -> np.ndarray:
+        """Find the lowest common ancestors of pairs of regions.
+
+        The arrays of region IDs are broadcast against each other, so this
+        answers any number of queries at once. The ancestors are found by
+        binary lifting, which takes O(log(depth)) vectorized steps.
+
+        Parameters
+        ----------
+        ids_1
+            A region ID or an array of region IDs.
+        ids_2
+            A region ID or an array of region IDs.
+
+        Returns
+        -------
+        np.ndarray
+            The region IDs of the lowest common ancestors. Every region is
+            its own ancestor, so the lowest common ancestor of a region and
+            one of its descendants is the region itself. It's -1 for
+            regions without any common ancestor, which only happens if
+            the hierarchy has several roots.
+        """
+        nodes = self._lca_nodes(self._nodes(ids_1), self._nodes(ids_2))
+        return np.where(nodes >= 0, self.ids[nodes], -1)
+
+    def tree_distance(
+        self, ids_1: int | np.ndarray, ids_2: int | np.ndarray
+    ) -> np.ndarray:
+        """Count the edges on the hierarchy paths between pairs of regions.
+
+        Parameters
+        ----------
+        ids_1
+            A region ID or an array of region IDs.
+        ids_2
+            A region ID or an array of region IDs. It's broadcast
+            against `ids_1`.
+
+        Returns
+        -------
+        np.ndarray
+            The number of edges between the regions, via their lowest common
+            ancestor. It's -1 for regions without any common ancestor.
+        """
+        nodes_1 = self._nodes(ids_1)
+        nodes_2 = self._nodes(ids_2)
+        lca = self._lca_nodes(nodes_1, nodes_2)
+        distance = self.level[nodes_1] + self.level[nodes_2] - 2 * self.level[lca]
+        return np.where(lca >= 0, distance, -1)
+
+    def _lca_nodes(self, nodes_1: np.ndarray, nodes_2: np.ndarray) -> np.ndarray:
+        """Find the lowest common ancestors of pairs of nodes."""
+        if self._ancestor_table is None:
+            # Row k holds the 2**k-th ancestor of every node. Nodes without
+            # parents are their own ancestors.
+            parents = np.where(self.parent >= 0, self.parent, np.arange(len(self)))
+            rows = [parents]
+            while 2 ** len(rows) <= self.level.max(initial=0):
+                rows.append(rows[-1][rows[-1]])
+            self._ancestor_table = np.stack(rows)
+        table = self._ancestor_table
+
+        nodes_1, nodes_2 = np.broadcast_arrays(nodes_1, nodes_2)
+        shape = nodes_1.shape
+        deeper = nodes_1.ravel()
+        other = nodes_2.ravel()
+        swap = self.level[deeper] < self.level[other]
+        deeper, other = np.where(swap, other, deeper), np.where(swap, deeper, other)
+
+        # Lift the deeper nodes to the level of the other ones
+        level_difference = self.level[deeper] - self.level[other]
+        for k, ancestors in enumerate(table):
+            lift = (level_difference >> k) & 1 == 1
+            deeper = np.where(lift, ancestors[deeper], deeper)
+
+        # Lift both nodes as long as their ancestors differ
+        for ancestors in table[::-1]:
+            ancestors_deeper = ancestors[deeper]
+            ancestors_other = ancestors[other]
+            differ = ancestors_deeper != ancestors_other
+            deeper = np.where(differ, ancestors_deeper, deeper)
+            other = np.where(differ, ancestors_other, other)
+
+        parents = table[0]
+        lca = np.where(parents[deeper] == parents[other], parents[deeper], -1)
+        lca = np.where(deeper == other, deeper, lca)
+
+        return lca.reshape(shape)
+
+    def ancestors_at_level(self, ids: int | np.ndarray, level: int) -> np.ndarray:
+        """Replace regions by their ancestors at a given hierarchy level.
+
+        Regions at or above the given level, as well as unknown region IDs,
+        are kept as they are.
+
+        Parameters
+        ----------
+        ids
+            A region ID or an array of region IDs.
+        level
+            The hierarchy level.
+
+        Returns
+        -------
+        np.ndarray
+            The region IDs of the ancestors. Has the same shape as `ids`.
+        """
+        ancestors = np.arange(len(self.ids))
+        while True:
+            deeper = self.level[ancestors] > level
+            if not deeper.any():
+                break
+            ancestors[deeper] = self.parent[ancestors[deeper]]
+
+        ids = np.asarray(ids)
+        nodes = self.index(ids)
+        return np.where(nodes >= 0, self.ids[ancestors[nodes]], ids)
+
+    def nearest_ancestors(
+        self,
+        ids: int | np.ndarray,
+        allowed_ids: Collection[int],
+        fill_value: int | None = None,
+    ) -> np.ndarray:
+        """Replace regions by their nearest ancestors among given regions.
+
+        Every region is considered to be its own ancestor, so regions in
+        `allowed_ids` are kept as they are.
+
+        Parameters
+        ----------
+        ids
+            A region ID or an array of region IDs.
+        allowed_ids
+            The region IDs that the regions can be replaced with.
+        fill_value
+            The replacement of regions that have no ancestor in `allowed_ids`
+            and of unknown region IDs. By default it's the background ID.
+
+        Returns
+        -------
+        np.ndarray
+            The region IDs of the nearest ancestors. Has the same shape
+            as `ids`.
+        """
+        if fill_value is None:
+            fill_value = self.background_id
+        allowed_nodes = self.index(np.fromiter(allowed_ids, dtype=np.int64))
+        allowed = np.zeros(len(self.ids), dtype=bool)
+        allowed[allowed_nodes[allowed_nodes >= 0]] = True
+
+        nearest = np.where(allowed, np.arange(len(self.ids)), -1)
+        for nodes in self._levels_top_down():
+            nodes = nodes[~allowed[nodes]]
+            nearest[nodes] = nearest[self.parent[nodes]]
+
+        nodes = self.index(ids)
+        nodes = np.where(nodes >= 0, nearest[nodes], -1)
+        return np.where(nodes >= 0, self.ids[nodes], fill_value)
+
+    def name_mask(self, region_name_regex: str | re.Pattern) -> np.ndarray:
+        """Find all regions that belong to a region with a given name pattern.
+
+        This is the bulk version of ``RegionMeta.in_region_like``. The
+        pattern is compiled once and matched against every region name,
+        then the matches are propagated down the hierarchy in one sweep.
+        The result is memoized.
+
+        Parameters
+        ----------
+        region_name_regex
+            A regex to match the region names. As for `re.search`, a simple
+            string without special characters is a substring test.
+
+        Returns
+        -------
+        np.ndarray
+            A read-only boolean mask over all nodes. It's true for the
+            regions whose name or one of whose ancestor names matches the
+            pattern. It's always false for the background.
+        """
+        mask = self._name_masks.get(region_name_regex)
+        if mask is None:
+            regex = re.compile(region_name_regex)
+            mask = np.fromiter(
+                (regex.search(name) is not None for name in self.names),
+                dtype=bool,
+                count=len(self.names),
+            )
+            mask[self.ids == self.background_id] = False
+            for nodes in self._levels_top_down():
+                mask[nodes] |= mask[self.parent[nodes]]
+            mask.flags.writeable = False
+            self._name_masks[region_name_regex] = mask
+
+        return mask
+
+    def regions_like(self, region_name_regex: str | re.Pattern) -> frozenset[int]:
+        """Find all regions that belong to a region with a given name pattern.
+
+        This is the same as `name_mask` but the result is the memoized set
+        of matching region IDs, which is faster for membership tests of
+        single region IDs.
+
+        Parameters
+        ----------
+        region_name_regex
+            A regex to match the region names.
+
+        Returns
+        -------
+        frozenset of int
+            The IDs of the regions whose name or one of whose ancestor names
+            matches the pattern.
+        """
+        regions = self._regions_like.get(region_name_regex)
+        if regions is None:
+            mask = self.name_mask(region_name_regex)
+            regions = frozenset(self.ids[mask].tolist())
+            self._regions_like[region_name_regex] = regions
+
+        return regions
+
+    def _levels_top_down(self) -> Iterator[np.ndarray]:
+        """Iterate over the non-root nodes level by level from the top."""
+        by_level = np.argsort(self.level, kind="stable")
+        level_starts = np.searchsorted(self.level[by_level], np.unique(self.level))
+        for nodes in np.split(by_level, level_starts[1:]):
+            yield nodes[self.parent[nodes] >= 0]
@@ -15,6 +15,21 @@ import numpy as np
 import pytest
 
 from atlannot._atlalign import iou_score, iou_score_single
+from atlannot.atlas.region_index import RegionIndex
+
+
+def weighted_iou_reference(y_true, y_pred, excluded_labels=None):
+    """Compute the label-weighted IOU with one scan per label."""
+    excluded_labels = excluded_labels or []
+    n_pixels = (~np.isin(y_true, excluded_labels)).sum()
+    labels = (set(np.unique(y_true)) | set(np.unique(y_pred))) - set(excluded_labels)
+    score = 0
+    for label in labels:
+        intersection = np.sum((y_true == label) & (y_pred == label))
+        union = np.sum((y_true == label) | (y_pred == label))
+        score += intersection / union * (y_true == label).sum() / n_pixels
+
+    return score
 
 
 class TestIOUScoreSingle:
@@ -136,8 +151,53 @@ class TestIOUScoreSingle:
             == 2 / 3 * 2 / 8 + 2 / 3 * 6 / 8
         )
 
+    @pytest.mark.parametrize("k", [None, 0, 1, 2, 3])
+    @pytest.mark.parametrize("excluded_labels", [None, [0], [2, 4]])
+    def test_region_index(self, k, excluded_labels):
+        rng = np.random.default_rng(0)
+        y_true = rng.integers(0, 4, size=(10, 12))
+        y_pred = rng.integers(1, 5, size=(10, 12))
+
+        expected = iou_score_single(y_true, y_pred, k, excluded_labels)
+        result = iou_score_single(
+            y_true,
+            y_pred,
+            k,
+            excluded_labels,
+            index_true=RegionIndex(y_true),
+            index_pred=RegionIndex(y_pred),
+        )
+        assert result == pytest.approx(expected, nan_ok=True)
+
 
 class TestIOUScore:
+    @pytest.mark.parametrize("k", [None, 0, 3, 10])
+    @pytest.mark.parametrize("excluded_labels", [None, [0], [1, 2, 40]])
+    def test_same_as_per_sample(self, k, excluded_labels):
+        rng = np.random.default_rng(0)
+        y_true = rng.integers(0, 30, size=(40, 8, 9))
+        y_pred = rng.integers(2, 32, size=(40, 8, 9))
+        y_pred[-1] = y_true[-1]
+
+        mean, per_sample = iou_score(y_true, y_pred, k, excluded_labels)
+        for i, score in enumerate(per_sample):
+            if k is None:
+                expected = weighted_iou_reference(y_true[i], y_pred[i], excluded_labels)
+            else:
+                expected = iou_score_single(y_true[i], y_pred[i], k)
+            assert score == pytest.approx(expected, nan_ok=True)
+        assert mean == pytest.approx(np.nanmean(per_sample))
+
+    def test_all_labels_excluded(self):
+        y_true = np.zeros((2, 3, 3), dtype=int)
+        y_pred = np.zeros((2, 3, 3), dtype=int)
+        y_pred[1, 0, 0] = 1
+
+        with np.errstate(invalid="ignore"):
+            _, per_sample = iou_score(y_true, y_pred, excluded_labels=[0])
+        assert per_sample[0] == 0
+        assert np.isnan(per_sample[1])
+
     def test_perfect_score_many(self):
         y_true = np.array(
             [
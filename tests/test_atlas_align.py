@@ -18,7 +18,15 @@ import numpy as np
 import pytest
 from tqdm import tqdm
 
-from atlannot.atlas.align import get_misalignment, specific_label_iou, unfurl_regions
+from atlannot.atlas.align import (
+    UnfurledAtlas,
+    get_misalignment,
+    level_misalignments,
+    specific_label_iou,
+    specific_labels_iou,
+    unfurl_regions,
+)
+from atlannot.atlas.region_index import RegionIndex
 from atlannot.region_meta import RegionMeta
 
 
@@ -63,6 +71,109 @@ class TestAlign:
         assert get_misalignment(data_1, data_2, fg_only=False) == 2 / 16
         assert get_misalignment(data_1, data_2, fg_only=True) == 2 / 4
 
+    @pytest.mark.parametrize("slab_size", [1, 4, 32])
+    def test_specific_labels_iou(self, slab_size):
+        rng = np.random.default_rng(0)
+        data_1 = rng.integers(0, 5, size=(6, 10, 10))
+        data_2 = rng.integers(2, 8, size=(6, 10, 10))
+        labels = [0, 3, 7, 10, 2, 12]
+
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter("always")
+            ious = specific_labels_iou(data_1, data_2, labels, slab_size=slab_size)
+            assert len(w) == 1
+            assert "[10, 12]" in str(w[0].message)
+        assert list(ious) == labels
+        for label in labels:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                expected = specific_label_iou(data_1, data_2, label)
+            assert ious[label] == pytest.approx(expected, nan_ok=True)
+
+        with pytest.raises(ValueError):
+            specific_labels_iou(data_1, data_2[1:], labels)
+
+    @pytest.mark.parametrize("fg_only", [False, True])
+    @pytest.mark.parametrize("slab_size", [1, 3, 32])
+    def test_misalignment_profiles(self, fg_only, slab_size):
+        rng = np.random.default_rng(0)
+        data_1 = rng.integers(0, 3, size=(7, 5, 6))
+        data_2 = rng.integers(0, 3, size=(7, 5, 6))
+        data_1[2] = 0
+        data_2[2] = 0
+
+        misalignment, profiles = get_misalignment(
+            data_1, data_2, fg_only, return_profiles=True, slab_size=slab_size
+        )
+        assert misalignment == pytest.approx(get_misalignment(data_1, data_2, fg_only))
+        assert list(profiles) == [0, 1, 2]
+        for axis, profile in profiles.items():
+            assert profile.shape == (data_1.shape[axis],)
+            for i, value in enumerate(profile):
+                expected = get_misalignment(
+                    np.take(data_1, i, axis), np.take(data_2, i, axis), fg_only
+                )
+                assert value == pytest.approx(expected)
+        assert profiles[0][2] == 0
+
+    def test_unfurl_regions_same_as_masking(self):
+        region_meta = RegionMeta.load_json("tests/data/structure_graph_mini.json")
+        rng = np.random.default_rng(0)
+        # Label 7 is not part of the region hierarchy
+        atlas = rng.choice([0, 1, 2, 3, 4, 5, 7], size=(3, 10, 10)).astype(np.uint16)
+
+        expected = [atlas.copy()]
+        for remove_level in range(3, 0, -1):
+            level_atlas = expected[-1].copy()
+            for region_id in region_meta.ids_at_level(remove_level):
+                level_atlas[level_atlas == region_id] = region_meta.parent_id[region_id]
+            expected.append(level_atlas)
+
+        unfurled = unfurl_regions(atlas, region_meta)
+        assert unfurled.dtype == atlas.dtype
+        assert np.array_equal(unfurled, np.stack(expected))
+
+    def test_unfurled_atlas(self):
+        region_meta = RegionMeta.load_json("tests/data/structure_graph_mini.json")
+        rng = np.random.default_rng(0)
+        atlas = rng.choice([0, 1, 2, 3, 4, 5, 7], size=(3, 10, 10))
+        expected = unfurl_regions(atlas, region_meta)
+
+        unfurled = UnfurledAtlas(atlas, region_meta)
+        assert unfurled.shape == expected.shape
+        assert len(unfurled) == 4
+        assert unfurled.levels == [3, 2, 1, 0]
+        assert np.array_equal(np.asarray(unfurled), expected)
+        assert np.array_equal(unfurled[1], expected[1])
+        assert np.array_equal(unfurled[-1, 2], expected[-1, 2])
+        assert np.array_equal(unfurled[1:3, :, 4], expected[1:3, :, 4])
+        assert np.array_equal(unfurled.at_level(1), expected[2])
+
+    @pytest.mark.parametrize("slab_size", [1, 3, 32])
+    def test_level_misalignments(self, slab_size):
+        region_meta = RegionMeta.load_json("tests/data/structure_graph_mini.json")
+        rng = np.random.default_rng(0)
+        # Label 7 is not part of the region hierarchy
+        atlas_1 = rng.choice([0, 1, 2, 3, 4, 5, 7], size=(7, 10, 10))
+        atlas_2 = rng.choice([0, 1, 2, 3, 4, 5], size=(7, 10, 10))
+
+        unfurled_1 = unfurl_regions(atlas_1, region_meta)
+        unfurled_2 = unfurl_regions(atlas_2, region_meta)
+        misalignments = level_misalignments(
+            atlas_1, atlas_2, region_meta, slab_size=slab_size
+        )
+        assert list(misalignments) == [3, 2, 1, 0]
+        for (mis, mis_fg), level_1, level_2 in zip(
+            misalignments.values(), unfurled_1, unfurled_2
+        ):
+            assert mis == pytest.approx(get_misalignment(level_1, level_2))
+            assert mis_fg == pytest.approx(
+                get_misalignment(level_1, level_2, fg_only=True)
+            )
+
+        with pytest.raises(ValueError):
+            level_misalignments(atlas_1, atlas_2[1:], region_meta)
+
     def test_specific_label_iou(self):
         data_1 = np.zeros((20, 20))
         data_2 = np.zeros((10, 20))
@@ -82,3 +193,14 @@ class TestAlign:
         data_1[5:15, 5:15] = 1
         data_2[10:20, 10:20] = 1
         assert specific_label_iou(data_1, data_2, 1) == 1 / 7
+
+        # Check that the region indices give the same results
+        index_1 = RegionIndex(data_1)
+        index_2 = RegionIndex(data_2)
+        for label in [0, 1]:
+            assert specific_label_iou(
+                data_1, data_2, label, index_1, index_2
+            ) == specific_label_iou(data_1, data_2, label)
+        with warnings.catch_warnings(record=True) as w:
+            assert np.isnan(specific_label_iou(data_1, data_2, 10, index_1, index_2))
+            assert len(w) == 1
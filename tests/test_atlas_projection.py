@@ -0,0 +1,105 @@
+# Copyright 2022, Blue Brain Project, EPFL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import numpy as np
+import pytest
+
+from atlannot.atlas.align import unfurl_regions
+from atlannot.atlas.projection import (
+    LabelProjection,
+    project_to_ancestors,
+    project_to_level,
+)
+from atlannot.region_meta import RegionMeta
+
+
+@pytest.fixture()
+def region_meta():
+    # 1 (root)
+    # ├── 2 (Child 1)
+    # │   ├── 4 (Grandchild 1)
+    # │   └── 5 (Grandchild 2)
+    # └── 3 (Child 2)
+    return RegionMeta.load_json("tests/data/structure_graph_mini.json")
+
+
+@pytest.fixture()
+def atlas():
+    rng = np.random.default_rng(0)
+    return rng.choice([0, 1, 2, 3, 4, 5], size=(6, 7, 8)).astype(np.uint32)
+
+
+def test_project_to_level(region_meta, atlas):
+    unfurled = unfurl_regions(atlas, region_meta)
+    for i, level in enumerate(range(region_meta.depth, -1, -1)):
+        projected = project_to_level(atlas, region_meta, level)
+        assert projected.dtype == atlas.dtype
+        np.testing.assert_array_equal(projected, unfurled[i])
+
+
+@pytest.mark.parametrize("slab_size", [None, 1, 4])
+def test_project_to_ancestors(region_meta, atlas, slab_size):
+    allowed_ids = {2, 3}
+    projected = project_to_ancestors(
+        atlas, region_meta, allowed_ids, fill_value=7, slab_size=slab_size
+    )
+    expected = np.full_like(atlas, 7)
+    for region_id in allowed_ids:
+        expected[np.isin(atlas, list(region_meta.descendants(region_id)))] = region_id
+    np.testing.assert_array_equal(projected, expected)
+
+
+def test_large_ids_and_unknown_labels():
+    # The region IDs are far too large for a direct lookup table
+    region_meta = RegionMeta()
+    region_meta.root_id = 600_000_000
+    region_meta.parent_id[600_000_000] = region_meta.background_id
+    region_meta.parent_id[500_000_000] = 600_000_000  # type: ignore
+    volume = np.array([[500_000_000, 600_000_000], [0, 123]], dtype=np.uint32)
+    np.testing.assert_array_equal(
+        project_to_level(volume, region_meta, 1),
+        [[600_000_000, 600_000_000], [0, 123]],
+    )
+    np.testing.assert_array_equal(
+        project_to_ancestors(volume, region_meta, [600_000_000]),
+        [[600_000_000, 600_000_000], [0, 0]],
+    )
+
+
+def test_in_place(region_meta, atlas):
+    expected = project_to_level(atlas, region_meta, 1)
+    projection = LabelProjection.to_level(region_meta.freeze(), 1)
+    result = projection(atlas, out=atlas, slab_size=2)
+    assert result is atlas
+    np.testing.assert_array_equal(atlas, expected)
+
+
+def test_output_dtype(region_meta, atlas):
+    projection = LabelProjection.to_level(region_meta, 2)
+    out = np.empty(atlas.shape, dtype=np.float32)
+    projection(atlas, out=out)
+    np.testing.assert_array_equal(out, projection(atlas))
+
+    projection = LabelProjection(np.array([1, 2]), np.array([1, 300]))
+    with pytest.raises(ValueError, match="fit"):
+        projection(atlas.astype(np.uint8))
+    with pytest.raises(ValueError, match="same shape"):
+        projection(atlas, out=atlas[:2])
+
+    # Labels that can't be in the volume don't need to fit
+    projection = LabelProjection(np.array([1, 300]), np.array([2, 300]))
+    np.testing.assert_array_equal(
+        projection(np.array([0, 1], dtype=np.uint8)), np.array([0, 2])
+    )
+    with pytest.raises(ValueError, match="sorted"):
+        LabelProjection(np.array([2, 1]), np.array([1, 2]))
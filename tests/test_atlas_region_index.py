@@ -0,0 +1,82 @@
+# Copyright 2022, Blue Brain Project, EPFL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Test of the region index."""
+import numpy as np
+import pytest
+from scipy import ndimage
+
+from atlannot.atlas.region_index import RegionIndex
+
+
+@pytest.fixture
+def volume():
+    rng = np.random.default_rng(0)
+    volume = np.zeros((6, 10, 12), dtype=np.uint32)
+    volume[1:4, 2:7, 3:5] = 1000
+    volume[2:6, 5:10, 6:12] = 7
+    volume[0, 0, 0] = 7
+    volume[4:, :3, :3] = rng.integers(20, 23, size=(2, 3, 3))
+    return volume
+
+
+class TestRegionIndex:
+    def test_labels_and_counts(self, volume):
+        index = RegionIndex(volume, slab_size=4)
+        labels, counts = np.unique(volume, return_counts=True)
+        assert np.array_equal(index.labels, labels)
+        assert np.array_equal(index.counts, counts)
+        assert len(index) == len(labels)
+        assert index.offsets[-1] == volume.size
+        assert 1000 in index
+        assert 5 not in index
+
+    def test_voxels(self, volume):
+        index = RegionIndex(volume, slab_size=4)
+        for label in index.labels:
+            expected = np.flatnonzero(volume == label)
+            assert np.array_equal(index.flat_indices(label), expected)
+            assert index.count(label) == len(expected)
+            for coords, expected_coords in zip(
+                index.coordinates(label), np.nonzero(volume == label)
+            ):
+                assert np.array_equal(coords, expected_coords)
+        assert len(index.flat_indices(5)) == 0
+        assert index.count(5) == 0
+
+    def test_bbox(self, volume):
+        index = RegionIndex(volume)
+        objects = ndimage.find_objects(volume)
+        for label in index.labels[1:]:
+            assert index.bbox(label) == objects[label - 1]
+        assert index.bbox(1000, padding=2) == (slice(0, 6), slice(0, 9), slice(1, 7))
+        assert index.bbox(5) is None
+
+    def test_intersection(self, volume):
+        other = np.roll(volume, 1, axis=1)
+        index = RegionIndex(volume)
+        other_index = RegionIndex(other)
+        for label in index.labels:
+            for other_label in other_index.labels:
+                expected = np.sum((volume == label) & (other == other_label))
+                result = index.intersection(label, other_index, other_label)
+                assert result == expected
+        assert index.intersection(5, other_index) == 0
+
+        with pytest.raises(ValueError, match="same shape"):
+            index.intersection(7, RegionIndex(volume[1:]))
+
+    def test_empty_volume(self):
+        index = RegionIndex(np.zeros((0, 3), dtype=int))
+        assert len(index) == 0
+        assert index.count(1) == 0
@@ -11,17 +11,33 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import sys
+
 import numpy as np
 import pytest
 from numpy import ma
+from scipy import ndimage
 
+from atlannot._atlalign import iou_score
+from atlannot.atlas.region_index import RegionIndex
 from atlannot.evaluation import (
+    ConfusionMatrix,
+    SliceCache,
+    agreement_levels,
     conditional_entropy,
     entropy,
     evaluate,
     evaluate_region,
+    evaluate_streaming,
+    hierarchical_iou,
+    image_similarity,
     iou,
     jaggedness,
+    joint_histogram,
+    meter_jaggedness,
+    region_histograms,
+    region_jaggedness,
+    surface_distances,
 )
 from atlannot.region_meta import RegionMeta
 
@@ -46,6 +62,52 @@ def test_compute_jaggedness():
     assert np.isnan(scores[11])
 
 
+def test_jaggedness_same_as_meter(shapes_volume):
+    pytest.importorskip("atlas_alignment_meter")
+    volume = np.moveaxis(shapes_volume, 0, 2)
+    expected = meter_jaggedness(volume, axis=2, region_ids=[1, 2, 3, 11])
+    scores = jaggedness(volume, axis=2, region_ids=[1, 2, 3, 11])
+    assert scores.keys() == expected.keys()
+    for region_id, score in expected.items():
+        assert scores[region_id] == pytest.approx(score, nan_ok=True)
+
+
+@pytest.fixture()
+def shapes_volume():
+    volume = np.zeros((10, 30, 30), dtype=np.uint32)
+    volume[:, 5:20, 5:20] = 1  # straight extrusion
+    for i in range(10):
+        volume[i, 22:28, 2 + i : 12 + i] = 2  # boundaries move linearly
+        volume[i, 0:4, 2 + 3 * (i % 2) : 12 + 3 * (i % 2)] = 3  # alternating
+
+    return volume
+
+
+class TestRegionJaggedness:
+    def test_values(self, shapes_volume):
+        scores = region_jaggedness(shapes_volume, {1: [1], 2: [2], 3: [3]})
+        assert scores[1] == 0
+        # Only the corners of the moving rectangle deviate from the midpoint
+        assert scores[2] == pytest.approx(1 / 14)
+        assert scores[3] == pytest.approx(5 / 6)
+
+    def test_groups(self, shapes_volume):
+        scores = region_jaggedness(shapes_volume, {"all": [1, 2], "missing": [7]})
+        assert scores["all"] == pytest.approx(1 / 42)
+        assert np.isnan(scores["missing"])
+
+    def test_jaggedness(self, shapes_volume):
+        expected = region_jaggedness(shapes_volume, {1: [1], 2: [2], 3: [3]})
+        scores = jaggedness(shapes_volume, region_ids=[1, 2, 3, 7])
+        assert np.isnan(scores.pop(7))
+        assert scores == expected
+
+    def test_axis(self, shapes_volume):
+        expected = region_jaggedness(shapes_volume, {3: [3]})
+        volume = np.moveaxis(shapes_volume, 0, 2)
+        assert region_jaggedness(volume, {3: [3]}, axis=2) == expected
+
+
 def test_compute_iou():
     labels = np.arange(10)
     volume = labels * np.ones((10, 10, 10))
@@ -61,6 +123,167 @@ def test_compute_iou():
     assert np.isnan(scores[11])
 
 
+class TestConfusionMatrix:
+    @pytest.fixture()
+    def volumes(self):
+        rng = np.random.default_rng(0)
+        vol_1 = rng.integers(0, 10, size=(6, 8, 9))
+        vol_2 = vol_1.copy()
+        noise = rng.random(vol_1.shape) < 0.3
+        vol_2[noise] = rng.integers(0, 12, size=noise.sum())
+        vol_2[2] = 20  # region 20 is only present in one slice
+
+        return vol_1, vol_2
+
+    def test_shape_mismatch(self):
+        with pytest.raises(ValueError, match="same shape"):
+            ConfusionMatrix.from_volumes(np.zeros((2, 3)), np.zeros((3, 2)))
+
+    @pytest.mark.parametrize("slab_size", [1, 4, 32])
+    def test_counts(self, volumes, slab_size):
+        vol_1, vol_2 = volumes
+        cm = ConfusionMatrix.from_volumes(vol_1, vol_2, slab_size=slab_size)
+
+        assert np.array_equal(cm.labels, np.union1d(vol_1, vol_2))
+        assert cm.pair_counts.sum() == vol_1.size
+        assert cm.n_slices == len(vol_1)
+        for (idx_1, idx_2), count in zip(cm.pairs, cm.pair_counts):
+            mask = (vol_1 == cm.labels[idx_1]) & (vol_2 == cm.labels[idx_2])
+            assert mask.sum() == count
+
+    def test_scores(self, volumes):
+        vol_1, vol_2 = volumes
+        cm = ConfusionMatrix.from_volumes(vol_1, vol_2)
+
+        ious = cm.iou()
+        dices = cm.dice()
+        per_slice = cm.iou_per_slice()
+        for label in np.union1d(vol_1, vol_2):
+            mask_1 = vol_1 == label
+            mask_2 = vol_2 == label
+            intersection = np.sum(mask_1 & mask_2)
+            assert ious[label] == intersection / np.sum(mask_1 | mask_2)
+            assert dices[label] == 2 * intersection / (mask_1.sum() + mask_2.sum())
+
+            _, expected = iou_score(vol_1, vol_2, k=label)
+            assert np.allclose(per_slice[label], expected, equal_nan=True)
+
+    def test_remap(self, volumes):
+        vol_1, vol_2 = volumes
+        cm = ConfusionMatrix.from_volumes(vol_1, vol_2)
+        new_labels = cm.labels // 3
+        remapped = cm.remap(new_labels)
+        expected = ConfusionMatrix.from_volumes(vol_1 // 3, vol_2 // 3)
+
+        assert np.array_equal(remapped.labels, expected.labels)
+        assert np.array_equal(remapped.slice_counts_1, expected.slice_counts_1)
+        assert np.array_equal(remapped.slice_counts_2, expected.slice_counts_2)
+        assert np.array_equal(remapped.slice_intersection, expected.slice_intersection)
+        assert np.array_equal(remapped.pairs, expected.pairs)
+        assert np.array_equal(remapped.pair_counts, expected.pair_counts)
+
+    def test_concatenate(self, volumes):
+        vol_1, vol_2 = volumes
+        expected = ConfusionMatrix.from_volumes(vol_1, vol_2)
+        cm = ConfusionMatrix.concatenate(
+            [
+                ConfusionMatrix.from_volumes(vol_1[:2], vol_2[:2]),
+                ConfusionMatrix.from_volumes(vol_1[2:3], vol_2[2:3]),
+                ConfusionMatrix.from_volumes(vol_1[3:], vol_2[3:]),
+            ]
+        )
+        for key, value in vars(expected).items():
+            assert np.array_equal(getattr(cm, key), value)
+
+    def test_save_load(self, tmp_path, volumes):
+        expected = ConfusionMatrix.from_volumes(*volumes)
+        expected.save(tmp_path / "confusion.npz")
+        cm = ConfusionMatrix.load(tmp_path / "confusion.npz")
+
+        for key, value in vars(expected).items():
+            assert np.array_equal(getattr(cm, key), value)
+            assert getattr(cm, key).dtype == value.dtype
+
+    def test_missing_regions(self, volumes):
+        cm = ConfusionMatrix.from_volumes(*volumes)
+
+        assert np.isnan(cm.iou([100])[100])
+        assert np.isnan(cm.dice([100])[100])
+        assert np.isnan(cm.mean_iou_per_slice([100])[100])
+        assert np.all(np.isnan(cm.iou_per_slice([100])[100]))
+        assert cm.iou_per_slice([100])[100].shape == (cm.n_slices,)
+
+
+def test_iou_matches_iou_score():
+    rng = np.random.default_rng(1)
+    vol_1 = rng.integers(0, 5, size=(4, 10, 10))
+    vol_2 = rng.integers(0, 6, size=(4, 10, 10))
+
+    scores = iou(vol_1, vol_2)
+    assert list(scores) == list(np.union1d(vol_1, vol_2))
+    for label, score in scores.items():
+        expected, _ = iou_score(vol_1, vol_2, k=label)
+        assert score == pytest.approx(expected)
+
+
+def test_hierarchical_iou():
+    # 1 (root)
+    # ├── 2 (Child 1)
+    # │   ├── 4 (Grandchild 1)
+    # │   └── 5 (Grandchild 2)
+    # └── 3 (Child 2)
+    rm = RegionMeta.load_json("tests/data/structure_graph_mini.json")
+    rng = np.random.default_rng(0)
+    reference = rng.choice([0, 2, 3, 4, 5], size=(5, 8, 8))
+    atlas = rng.choice([0, 1, 2, 3, 4, 5], size=(5, 8, 8))
+    cm = ConfusionMatrix.from_volumes(reference, atlas)
+
+    groups = {"C1": [2], "C1 + C2": [2, 3], "Gc2": [5], "root": [1], "none": [99]}
+    scores = hierarchical_iou(cm, rm, groups)
+    assert scores.keys() == groups.keys()
+    for name, region_ids in groups.items():
+        descendants = list(rm.descendants(region_ids)) if name != "none" else [99]
+        mask_ref = np.isin(reference, descendants)
+        mask = np.isin(atlas, descendants)
+        expected = iou(mask_ref, mask, region_ids=[1])[1]
+        if np.isnan(expected):
+            assert np.isnan(scores[name])
+        else:
+            assert scores[name] == pytest.approx(expected)
+
+
+def test_agreement_levels():
+    # 1 (root)
+    # ├── 2 (Child 1)
+    # │   ├── 4 (Grandchild 1)
+    # │   └── 5 (Grandchild 2)
+    # └── 3 (Child 2)
+    rm = RegionMeta.load_json("tests/data/structure_graph_mini.json")
+    rng = np.random.default_rng(0)
+    atlas_1 = rng.choice([0, 1, 2, 3, 4, 5, 99], size=(5, 8, 8))
+    atlas_2 = rng.choice([0, 1, 2, 3, 4, 5], size=(5, 8, 8))
+
+    expected = np.zeros(rm.depth + 1, dtype=np.int64)
+    for label_1, label_2 in zip(atlas_1.ravel(), atlas_2.ravel()):
+        if label_1 == 99:
+            label_1 = 0
+        ancestors_1 = rm.ancestors(label_1, include_background=True)
+        ancestors_2 = rm.ancestors(label_2, include_background=True)
+        expected[max(rm.level[id_] for id_ in ancestors_1 & ancestors_2)] += 1
+
+    levels = agreement_levels(atlas_1, atlas_2, rm)
+    np.testing.assert_array_equal(levels, expected)
+    assert levels.sum() == atlas_1.size
+
+    confusion = ConfusionMatrix.from_volumes(atlas_1, atlas_2)
+    levels = agreement_levels(atlas_1, atlas_2, rm.freeze(), confusion=confusion)
+    np.testing.assert_array_equal(levels, expected)
+    np.testing.assert_array_equal(
+        agreement_levels(atlas_2, atlas_2, rm),
+        np.bincount([rm.level[id_] for id_ in atlas_2.ravel()], minlength=4),
+    )
+
+
 class TestEntropy:
     def test_constant_data(self):
         arr = np.ones((100, 100))
@@ -97,6 +320,228 @@ def test_compute_conditional_entropy():
     assert cond_entr > 0
 
 
+def test_conditional_entropy_matches_masked_entropies():
+    rng = np.random.default_rng(0)
+    atlas = rng.integers(0, 5, size=(4, 10, 10))
+    nissl = rng.random((4, 10, 10))
+
+    value_range = nissl.min(), nissl.max()
+    weighted_entropies = []
+    for label in range(1, 5):
+        nissl_region = ma.masked_where(atlas != label, nissl)
+        score = entropy(nissl_region, value_range=value_range)
+        weighted_entropies.append(score * np.sum(atlas == label))
+    expected = np.sum(weighted_entropies) / np.sum(atlas != 0)
+
+    assert conditional_entropy(nissl, atlas) == pytest.approx(expected)
+
+
+class TestRegionHistograms:
+    def test_matches_np_histogram(self):
+        rng = np.random.default_rng(0)
+        atlas = rng.integers(0, 5, size=(4, 10, 10))
+        nissl = rng.random((4, 10, 10))
+        value_range = (0.2, 0.8)
+        bins = np.linspace(*value_range, 11)
+
+        labels, histograms, counts = region_histograms(
+            atlas, nissl, n_bins=10, value_range=value_range, slab_size=3
+        )
+        assert np.array_equal(labels, np.unique(atlas))
+        for label, histogram, count in zip(labels, histograms, counts):
+            expected, _ = np.histogram(nissl[atlas == label], bins=bins)
+            assert np.array_equal(histogram, expected)
+            assert count == np.sum(atlas == label)
+
+    def test_region_index(self):
+        rng = np.random.default_rng(0)
+        atlas = rng.integers(0, 5, size=(4, 10, 10))
+        nissl = rng.random((4, 10, 10))
+
+        expected = region_histograms(atlas, nissl, n_bins=10, value_range=(0.2, 0.8))
+        result = region_histograms(
+            atlas,
+            nissl,
+            n_bins=10,
+            value_range=(0.2, 0.8),
+            region_index=RegionIndex(atlas),
+        )
+        for array, expected_array in zip(result, expected):
+            assert np.array_equal(array, expected_array)
+
+    def test_right_edge_included(self):
+        atlas = np.ones((2, 2), dtype=int)
+        values = np.array([[0.0, 0.5], [1.0, 1.0]])
+        _, histograms, _ = region_histograms(atlas, values, n_bins=2)
+        assert histograms.tolist() == [[1, 3]]
+
+    def test_shape_mismatch(self):
+        with pytest.raises(ValueError, match="same shape"):
+            region_histograms(np.zeros((2, 3)), np.zeros((3, 2)))
+
+
+class TestSurfaceDistances:
+    @staticmethod
+    def brute_force(mask_1, mask_2, spacing):
+        from scipy.spatial.distance import cdist
+
+        def surface_points(mask):
+            mask = np.pad(mask, 1)
+            surface = mask & ~ndimage.binary_erosion(mask)
+            return np.argwhere(surface) * spacing
+
+        distances = cdist(surface_points(mask_1), surface_points(mask_2))
+        distances_12 = distances.min(axis=1)
+        distances_21 = distances.min(axis=0)
+        return {
+            "hausdorff": max(distances_12.max(), distances_21.max()),
+            "hd95": max(
+                np.percentile(distances_12, 95), np.percentile(distances_21, 95)
+            ),
+            "mean_surface_distance": np.concatenate(
+                [distances_12, distances_21]
+            ).mean(),
+        }
+
+    def test_same_as_brute_force(self, shapes_volume):
+        reference = np.roll(shapes_volume, (1, 2), axis=(0, 2))
+        spacing = (2.0, 1.0, 0.5)
+        groups = {1: [1], 3: [3], "all": [1, 2, 3]}
+
+        results = surface_distances(shapes_volume, reference, groups, spacing=spacing)
+        for name, group in groups.items():
+            expected = self.brute_force(
+                np.isin(shapes_volume, group), np.isin(reference, group), spacing
+            )
+            for metric, value in expected.items():
+                assert results[metric][name] == pytest.approx(value)
+
+    def test_shifted_box(self):
+        atlas = np.zeros((10, 10, 10), dtype=int)
+        atlas[2:6, 2:6, 2:6] = 1
+        reference = np.roll(atlas, 3, axis=1)
+
+        results = surface_distances(atlas, reference, {1: [1]})
+        assert results["hausdorff"][1] == 3
+        assert results["hd95"][1] == 3
+        assert 0 < results["mean_surface_distance"][1] < 3
+
+    def test_missing_region(self, shapes_volume):
+        atlas = shapes_volume.copy()
+        atlas[atlas == 3] = 0
+        results = surface_distances(atlas, shapes_volume, {1: [1], 3: [3], 7: [7]})
+        assert results["hausdorff"][1] == 0
+        assert np.isnan(results["hausdorff"][3])
+        assert np.isnan(results["mean_surface_distance"][7])
+
+    def test_workers(self, shapes_volume):
+        reference = np.roll(shapes_volume, 2, axis=1)
+        groups = {1: [1], 2: [2], 3: [3], 7: [7]}
+        expected = surface_distances(shapes_volume, reference, groups)
+        results = surface_distances(shapes_volume, reference, groups, workers=2)
+        np.testing.assert_equal(results, expected)
+
+    def test_shape_mismatch(self):
+        with pytest.raises(ValueError, match="same shape"):
+            surface_distances(np.zeros((2, 3)), np.zeros((3, 2)), {1: [1]})
+
+
+class TestJointHistogram:
+    def test_same_as_histogram2d(self):
+        rng = np.random.default_rng(0)
+        values_1 = rng.random((5, 6, 7))
+        values_2 = rng.normal(size=(5, 6, 7))
+        value_range_2 = (-1, 1)
+
+        histogram, bin_edges_1, bin_edges_2 = joint_histogram(
+            values_1, values_2, n_bins=8, value_range_2=value_range_2, slab_size=2
+        )
+        expected, expected_edges_1, expected_edges_2 = np.histogram2d(
+            values_1.ravel(),
+            values_2.ravel(),
+            bins=8,
+            range=[(values_1.min(), values_1.max()), value_range_2],
+        )
+        assert np.array_equal(histogram, expected)
+        assert np.allclose(bin_edges_1, expected_edges_1)
+        assert np.allclose(bin_edges_2, expected_edges_2)
+
+    def test_per_slice_and_mask(self):
+        rng = np.random.default_rng(0)
+        values_1 = rng.random((5, 6, 7))
+        values_2 = rng.random((5, 6, 7))
+        atlas = rng.integers(0, 4, size=(5, 6, 7))
+        kwargs: dict = {"n_bins": 8, "value_range_1": (0, 1), "value_range_2": (0, 1)}
+
+        histograms, _, _ = joint_histogram(
+            values_1,
+            values_2,
+            atlas=atlas,
+            region_ids=[1, 3],
+            per_slice=True,
+            slab_size=2,
+            **kwargs,
+        )
+        assert histograms.shape == (5, 8, 8)
+        for i in range(5):
+            mask = np.isin(atlas[i], [1, 3])
+            expected, _, _ = joint_histogram(
+                values_1[i][mask], values_2[i][mask], **kwargs
+            )
+            assert np.array_equal(histograms[i], expected)
+
+        foreground, _, _ = joint_histogram(values_1, values_2, atlas=atlas, **kwargs)
+        assert foreground.sum() == np.sum(atlas != 0)
+
+    def test_shape_mismatch(self):
+        with pytest.raises(ValueError, match="same shape"):
+            joint_histogram(np.zeros((2, 3)), np.zeros((3, 2)))
+        with pytest.raises(ValueError, match="same shape"):
+            joint_histogram(np.zeros((2, 3)), np.zeros((2, 3)), atlas=np.zeros(6))
+
+
+class TestImageSimilarity:
+    def test_identical(self):
+        values = np.random.default_rng(0).random((4, 10, 10))
+        scores = image_similarity(values, values, n_bins=16)
+        assert scores["mutual_information"] == pytest.approx(entropy(values, n_bins=16))
+        assert scores["normalized_mutual_information"] == pytest.approx(2)
+        assert scores["correlation_ratio"] == pytest.approx(1)
+
+    def test_independent(self):
+        rng = np.random.default_rng(0)
+        values_1 = rng.random((10, 50, 50))
+        values_2 = rng.random((10, 50, 50))
+        scores = image_similarity(values_1, values_2, n_bins=8)
+        assert scores["mutual_information"] == pytest.approx(0, abs=0.01)
+        assert scores["normalized_mutual_information"] == pytest.approx(1, abs=0.01)
+        assert scores["correlation_ratio"] == pytest.approx(0, abs=0.01)
+
+    def test_functional_dependence(self):
+        values_1 = np.random.default_rng(0).random((4, 10, 10))
+        scores = image_similarity(values_1, np.cos(4 * values_1), n_bins=64)
+        assert scores["correlation_ratio"] > 0.99
+
+    def test_per_slice(self):
+        rng = np.random.default_rng(0)
+        values_1 = rng.random((4, 10, 10))
+        values_2 = values_1 + rng.random((4, 10, 10))
+        atlas = np.ones((4, 10, 10), dtype=int)
+        atlas[2] = 0
+        kwargs = {"n_bins": 8, "value_range_1": (0, 1), "value_range_2": (0, 2)}
+
+        scores = image_similarity(
+            values_1, values_2, atlas=atlas, per_slice=True, **kwargs
+        )
+        for metric, values in scores.items():
+            assert isinstance(values, np.ndarray)
+            assert values.shape == (4,)
+            assert np.isnan(values[2])
+            for i in [0, 1, 3]:
+                expected = image_similarity(values_1[i], values_2[i], **kwargs)
+                assert values[i] == pytest.approx(expected[metric])
+
+
 def test_evaluate_region():
     labels = np.arange(10)
     volume = labels * np.ones((10, 10, 10))
@@ -107,6 +552,19 @@ def test_evaluate_region():
     assert "iou" in results.keys()
 
 
+def test_evaluate_region_jaggedness(shapes_volume):
+    # Map the labels of the volume onto the mini structure graph
+    atlas = np.array([0, 4, 5, 3])[shapes_volume]
+    rm = RegionMeta.load_json("tests/data/structure_graph_mini.json")
+    results = evaluate_region([2], atlas, atlas, rm)
+
+    assert results["jaggedness"]["per_region"].keys() == {2, 4, 5}
+    assert results["jaggedness"]["per_region"][4] == 0
+    expected = region_jaggedness(atlas, {0: [2, 4, 5]})[0]
+    assert results["jaggedness"]["global"] == expected
+    assert results["iou"]["global"] == 1
+
+
 def test_evaluate():
     labels = np.arange(10)
     volume = labels * np.ones((10, 10, 10))
@@ -126,3 +584,202 @@ def test_evaluate():
         assert "iou" in results[name].keys()
     assert "global" in results.keys()
     assert ["brain_entropy", "conditional_entropy"] == list(results["global"].keys())
+
+
+def test_evaluate_parallel():
+    rng = np.random.default_rng(0)
+    atlas = rng.choice([0, 2, 3, 4, 5], size=(6, 20, 20)).astype(np.uint32)
+    reference = rng.choice([0, 2, 3, 4, 5], size=(6, 20, 20)).astype(np.uint32)
+    nissl = rng.random((6, 20, 20))
+    rm = RegionMeta.load_json("tests/data/structure_graph_mini.json")
+    regions_to_evaluate = {"Child 1": [2], "Child 2": [3], "Root": [1]}
+
+    serial = evaluate(
+        atlas,
+        nissl,
+        reference,
+        rm,
+        regions_to_evaluate,
+    )
+    parallel = evaluate(
+        atlas,
+        nissl,
+        reference,
+        rm,
+        regions_to_evaluate,
+        workers=2,
+    )
+
+    assert list(parallel) == list(serial)
+    np.testing.assert_equal(parallel, serial)
+
+
+def test_evaluate_workers_python37(monkeypatch):
+    import multiprocessing
+
+    # Emulate Python 3.7, which has no multiprocessing.shared_memory
+    monkeypatch.delattr(multiprocessing, "shared_memory", raising=False)
+    monkeypatch.setitem(sys.modules, "multiprocessing.shared_memory", None)
+
+    atlas = np.zeros((3, 4, 5), dtype=np.uint32)
+    rm = RegionMeta.load_json("tests/data/structure_graph_mini.json")
+    with pytest.raises(RuntimeError, match="Python 3.8"):
+        evaluate(atlas, atlas, atlas, rm, {"Root": [1]}, workers=2)
+
+
+def test_evaluate_surface_distance():
+    rng = np.random.default_rng(0)
+    atlas = rng.choice([0, 2, 3, 4, 5], size=(6, 20, 20)).astype(np.uint32)
+    reference = np.roll(atlas, 1, axis=1)
+    nissl = rng.random((6, 20, 20))
+    rm = RegionMeta.load_json("tests/data/structure_graph_mini.json")
+    regions_to_evaluate = {"Child 1": [2], "Root": [1]}
+
+    serial = evaluate(
+        atlas,
+        nissl,
+        reference,
+        rm,
+        regions_to_evaluate,
+        surface_distance=True,
+    )
+    parallel = evaluate(
+        atlas,
+        nissl,
+        reference,
+        rm,
+        regions_to_evaluate,
+        surface_distance=True,
+        workers=2,
+    )
+    np.testing.assert_equal(parallel, serial)
+
+    results = serial["Child 1"]
+    expected = surface_distances(atlas, reference, {"global": [2, 4, 5], 4: [4]})
+    for metric, values in expected.items():
+        assert results[metric]["global"] == values["global"]
+        assert results[metric]["per_region"][4] == values[4]
+        assert list(results[metric]["per_region"]) == [2, 4, 5]
+
+
+@pytest.mark.parametrize("slab_size", [1, 4, 32])
+def test_evaluate_streaming(tmp_path, slab_size):
+    rng = np.random.default_rng(0)
+    atlas = rng.choice([0, 2, 3, 4, 5], size=(7, 20, 20)).astype(np.uint32)
+    atlas[:, :8] = 4  # make sure there are some contiguous regions
+    reference = np.roll(atlas, 2, axis=2)
+    nissl = rng.random((7, 20, 20), dtype=np.float32)
+    rm = RegionMeta.load_json("tests/data/structure_graph_mini.json")
+    regions_to_evaluate = {"Child 1": [2], "Child 2": [3], "Root": [1]}
+
+    np.save(tmp_path / "atlas.npy", atlas)
+    np.save(tmp_path / "nissl.npy", nissl)
+    np.save(tmp_path / "reference.npy", reference)
+    results = evaluate_streaming(
+        np.load(tmp_path / "atlas.npy", mmap_mode="r"),
+        np.load(tmp_path / "nissl.npy", mmap_mode="r"),
+        np.load(tmp_path / "reference.npy", mmap_mode="r"),
+        rm,
+        regions_to_evaluate,
+        slab_size=slab_size,
+    )
+    expected = evaluate(
+        atlas,
+        nissl,
+        reference,
+        rm,
+        regions_to_evaluate,
+    )
+
+    assert list(results) == list(expected)
+    np.testing.assert_equal(results, expected)
+
+
+class TestSliceCache:
+    @pytest.fixture()
+    def data(self):
+        rng = np.random.default_rng(0)
+        atlas = rng.choice([0, 2, 3, 4, 5], size=(6, 10, 10)).astype(np.uint32)
+        reference = np.roll(atlas, 1, axis=2)
+        nissl = rng.random((6, 10, 10))
+
+        return atlas, nissl, reference
+
+    def test_confusion_matrix(self, tmp_path, data):
+        atlas, _, reference = data
+        cache = SliceCache(tmp_path)
+        expected = ConfusionMatrix.from_volumes(reference, atlas)
+
+        for _ in range(2):
+            cm = cache.confusion_matrix(reference, atlas)
+            for key, value in vars(expected).items():
+                assert np.array_equal(getattr(cm, key), value)
+        assert cache.misses == 6
+        assert cache.hits == 6
+
+    def test_incremental(self, tmp_path, data):
+        atlas, nissl, reference = data
+        rm = RegionMeta.load_json("tests/data/structure_graph_mini.json")
+        regions = {"Child 1": [2], "Root": [1]}
+        cache = SliceCache(tmp_path)
+        evaluate(
+            atlas,
+            nissl,
+            reference,
+            rm,
+            regions,
+            cache=cache,
+            value_range=(0, 1),
+        )
+
+        # Change the last slice
+        atlas = atlas.copy()
+        atlas[5, :5] = 3
+        cache = SliceCache(tmp_path)
+        results = evaluate(
+            atlas,
+            nissl,
+            reference,
+            rm,
+            regions,
+            cache=cache,
+            value_range=(0, 1),
+        )
+        # One changed slice for the confusion counts and the histograms, and
+        # one changed window of three slices for the jaggedness of each of
+        # the two regions
+        assert cache.misses == 4
+        assert cache.hits == 16
+
+        expected = evaluate(atlas, nissl, reference, rm, regions, value_range=(0, 1))
+        np.testing.assert_equal(results, expected)
+
+    def test_value_range_required(self, tmp_path, data):
+        atlas, nissl, reference = data
+        rm = RegionMeta.load_json("tests/data/structure_graph_mini.json")
+        with pytest.raises(ValueError, match="value_range"):
+            evaluate(atlas, nissl, reference, rm, cache=SliceCache(tmp_path))
+
+    def test_conditional_entropy(self, tmp_path, data):
+        atlas, nissl, _ = data
+        cache = SliceCache(tmp_path)
+        expected = conditional_entropy(nissl, atlas, n_bins=10, value_range=(0, 1))
+
+        for _ in range(2):
+            result = cache.conditional_entropy(
+                nissl, atlas, n_bins=10, value_range=(0, 1)
+            )
+            assert result == expected
+        assert cache.hits == 6
+
+    def test_region_jaggedness(self, tmp_path, shapes_volume):
+        cache = SliceCache(tmp_path)
+        groups = {1: [1], 2: [2], "both": [1, 2]}
+        expected = region_jaggedness(shapes_volume, groups)
+
+        for _ in range(2):
+            result = cache.region_jaggedness(shapes_volume, groups)
+            assert result == expected
+        n_windows = len(shapes_volume) - 2
+        assert cache.misses == n_windows
+        assert cache.hits == n_windows
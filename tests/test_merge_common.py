@@ -0,0 +1,113 @@
+# Copyright 2022, Blue Brain Project, EPFL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Test of the functionality common to all atlas merge strategies."""
+import numpy as np
+import pytest
+
+from atlannot.merge.common import collapse_unmatched, descendants, replace
+from atlannot.region_meta import RegionMeta
+
+
+def random_region_meta(rng, n_regions):
+    rm = RegionMeta()
+    rm.root_id = 1
+    rm.parent_id[1] = rm.background_id
+    rm.children_ids[rm.background_id].append(1)
+    rm.children_ids[1] = []
+    for id_ in range(2, n_regions + 1):
+        parent_id = int(rng.integers(max(id_ - 8, 1), id_))
+        rm.parent_id[id_] = parent_id  # type: ignore
+        rm.children_ids[parent_id].append(id_)
+        rm.children_ids[id_] = []
+
+    return rm
+
+
+def while_loop_correction(ids_1, ids_2, allowed_1, allowed_2, rm, max_iter):
+    """Run the original while-loop correction."""
+    ids_to_correct = set(ids_1) - set(ids_2)
+    for _ in range(max_iter):
+        if not ids_to_correct:
+            return True
+        id_ = ids_to_correct.pop()
+        while id_ not in allowed_2:
+            id_ = rm.parent(id_)
+        for child in descendants(id_, allowed_1, rm):
+            replace(ids_1, child, id_)
+        for child in descendants(id_, allowed_2, rm):
+            replace(ids_2, child, id_)
+        ids_to_correct = set(ids_1) - set(ids_2)
+
+    return False
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_collapse_unmatched(seed):
+    rng = np.random.default_rng(seed)
+    rm = random_region_meta(rng, 60)
+    region_ids = np.arange(1, 61)
+    leaves = [id_ for id_ in region_ids if rm.is_leaf(id_)]
+    ids_2 = np.unique(np.r_[leaves, rng.choice(region_ids, size=20)])
+    ids_1 = np.unique(rng.choice(region_ids, size=30))
+    allowed_1 = rm.ancestors(ids_1)
+    allowed_2 = rm.ancestors(ids_2)
+
+    expected_1 = ids_1.copy()
+    expected_2 = ids_2.copy()
+    assert while_loop_correction(
+        expected_1, expected_2, allowed_1, allowed_2, rm, max_iter=1000
+    )
+    collapse_unmatched(ids_1, ids_2, allowed_1, allowed_2, rm)
+
+    assert np.array_equal(ids_1, expected_1)
+    assert np.array_equal(ids_2, expected_2)
+    assert set(ids_1) <= set(ids_2)
+
+
+def test_collapse_unmatched_options():
+    # 1
+    # ├── 2
+    # │   ├── 4
+    # │   └── 5
+    # └── 3
+    rm = RegionMeta()
+    rm.root_id = 1
+    rm.parent_id.update({1: 0, 2: 1, 3: 1, 4: 2, 5: 2})  # type: ignore
+    rm.children_ids.update({0: [1], 1: [2, 3], 2: [4, 5], 3: [], 4: [], 5: []})
+
+    ids_1 = np.array([3, 4])
+    ids_2 = np.array([3, 5])
+    collapse_unmatched(ids_1, ids_2, {1, 2, 3, 4}, {1, 2, 3, 5}, rm)
+    assert ids_1.tolist() == [3, 2]
+    assert ids_2.tolist() == [3, 2]
+
+    # Ignored regions don't need to be matched
+    ids_1 = np.array([3, 4])
+    ids_2 = np.array([3, 5])
+    collapse_unmatched(ids_1, ids_2, {1, 2, 3, 4}, {1, 2, 3, 5}, rm, ignore_ids={4})
+    assert ids_1.tolist() == [3, 4]
+    assert ids_2.tolist() == [3, 5]
+
+    # Collapse into the root
+    ids_1 = np.array([3, 4])
+    ids_2 = np.array([5])
+    collapse_unmatched(ids_1, ids_2, {1, 2, 3, 4}, {1, 2, 5}, rm, target_ids={1})
+    assert ids_1.tolist() == [1, 1]
+    assert ids_2.tolist() == [1]
+
+    # The original loop would never end
+    with pytest.raises(ValueError, match="can't be matched"):
+        collapse_unmatched(np.array([4]), np.array([5]), {4}, {4, 5}, rm)
+    with pytest.raises(ValueError, match="no ancestors"):
+        collapse_unmatched(np.array([4]), np.array([5]), {4}, {5}, rm)
@@ -0,0 +1,163 @@
+# Copyright 2022, Blue Brain Project, EPFL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Test of the fine merging."""
+import json
+
+import numpy as np
+import pytest
+from numpy import ma
+
+from atlannot.atlas.region_index import RegionIndex
+from atlannot.merge.common import descendants
+from atlannot.merge.fine import correct_edge, correct_edges, explore_voxel
+from atlannot.region_meta import RegionMeta
+
+
+def correct_edge_bfs(region_id, atlas, keep_ids, count):
+    """Run the original edge correction with one BFS per voxel."""
+    masked_atlas = ma.masked_array(atlas, np.isin(atlas, keep_ids, invert=True))
+    error_voxel = np.where(atlas == region_id)
+    new_values = [
+        explore_voxel(xyz, masked_atlas, count=count) for xyz in zip(*error_voxel)
+    ]
+    atlas[error_voxel] = new_values
+
+
+@pytest.mark.parametrize("count, radius", [(-1, None), (2, None), (-1, 3)])
+def test_correct_edge_region_index(count, radius):
+    rng = np.random.default_rng(0)
+    atlas = rng.choice([2, 4, 5, 9], size=(8, 9, 10), p=[0.6, 0.15, 0.15, 0.1])
+    atlas[:2] = 2
+    keep_ids = [2, 4, 5]
+
+    expected = atlas.copy()
+    correct_edge(2, expected, keep_ids, count=count, radius=radius)
+    result = atlas.copy()
+    correct_edge(
+        2,
+        result,
+        keep_ids,
+        count=count,
+        radius=radius,
+        region_index=RegionIndex(atlas),
+    )
+
+    assert np.array_equal(result, expected)
+    assert not np.array_equal(result, atlas)
+
+
+@pytest.mark.parametrize("radius", [None, 0, 1, 3])
+def test_correct_edge_nearest_label(radius):
+    rng = np.random.default_rng(1)
+    atlas = rng.choice([2, 4, 5, 9], size=(7, 8, 9), p=[0.85, 0.05, 0.05, 0.05])
+    keep_ids = [2, 4, 5]
+
+    result = atlas.copy()
+    correct_edge(2, result, keep_ids, count=-1, radius=radius)
+
+    sources = np.argwhere(np.isin(atlas, [4, 5]))
+    for voxel in np.argwhere(atlas == 2):
+        distances = np.abs(sources - voxel).sum(axis=1)
+        if radius is not None and radius < distances.min():
+            assert result[tuple(voxel)] == 2
+        else:
+            nearest = sources[distances == distances.min()]
+            assert result[tuple(voxel)] in atlas[tuple(nearest.T)]
+    assert np.array_equal(result[atlas != 2], atlas[atlas != 2])
+
+
+def test_correct_edge_far_labels():
+    atlas = np.full((40, 3, 3), 2)
+    atlas[0, 0, 0] = 4
+    atlas[-1, -1, -1] = 9
+
+    result = atlas.copy()
+    correct_edge(2, result, [2, 4], count=-1)
+    assert np.all(result == np.where(atlas == 9, 9, 4))
+
+    result = atlas.copy()
+    correct_edge(2, result, [2, 4], count=-1, radius=10)
+    distances = np.indices(atlas.shape).sum(axis=0)
+    expected = np.where(distances <= 10, 4, atlas)
+    assert np.array_equal(result, expected)
+
+    # No label to take
+    result = atlas.copy()
+    correct_edge(2, result, [2], count=-1)
+    assert np.array_equal(result, atlas)
+
+    with pytest.raises(ValueError, match="one of count and radius"):
+        correct_edge(2, result, [2], count=3, radius=3)
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("count", [0, 1, 2, 3, 7, 8, 30])
+def test_correct_edge_count(seed, count):
+    rng = np.random.default_rng(seed)
+    atlas = rng.choice([2, 4, 5, 9], size=(9, 8, 7), p=[0.7, 0.1, 0.1, 0.1])
+    keep_ids = [2, 4, 5]
+
+    expected = atlas.copy()
+    correct_edge_bfs(2, expected, keep_ids, count)
+    result = atlas.copy()
+    correct_edge(2, result, keep_ids, count=count)
+
+    assert np.array_equal(result, expected)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_correct_edge_same_as_bfs(seed):
+    rng = np.random.default_rng(seed)
+    atlas = rng.choice([2, 4, 5, 9], size=(12, 11, 10), p=[0.94, 0.02, 0.02, 0.02])
+    keep_ids = [2, 4, 5]
+
+    expected = atlas.copy()
+    correct_edge_bfs(2, expected, keep_ids, -1)
+    result = atlas.copy()
+    correct_edge(2, result, keep_ids, count=-1)
+
+    # Only compare the voxels whose nearest labels are all the same
+    sources = np.argwhere(np.isin(atlas, [4, 5]))
+    n_compared = 0
+    for voxel in np.argwhere(atlas == 2):
+        distances = np.abs(sources - voxel).sum(axis=1)
+        nearest = sources[distances == distances.min()]
+        if len(np.unique(atlas[tuple(nearest.T)])) == 1:
+            assert result[tuple(voxel)] == expected[tuple(voxel)]
+            n_compared += 1
+    assert n_compared > 0.5 * np.count_nonzero(atlas == 2)
+
+
+def test_correct_edges_same_as_bfs():
+    # 1 (root)
+    # ├── 2 (Child 1)
+    # │   ├── 4 (Grandchild 1)
+    # │   └── 5 (Grandchild 2)
+    # └── 3 (Child 2)
+    with open("tests/data/structure_graph_mini.json") as fh:
+        rm = RegionMeta.from_dict(json.load(fh))
+    allowed_ids = {1, 2, 3, 4, 5}
+    rng = np.random.default_rng(0)
+    atlas = rng.choice([0, 1, 2, 3, 4, 5], size=(10, 11, 12))
+
+    # The third and fourth filters of the fine merging
+    expected = atlas.copy()
+    for region_id in [2, 1]:
+        keep_ids = [region_id, *descendants(region_id, allowed_ids, rm)]
+        correct_edge_bfs(region_id, expected, keep_ids, 3)
+    result = atlas.copy()
+    correct_edges([2, 1], result, allowed_ids, rm, count=3)
+
+    assert np.array_equal(result, expected)
+    assert not np.array_equal(result, atlas)
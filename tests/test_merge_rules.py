@@ -0,0 +1,191 @@
+# Copyright 2022, Blue Brain Project, EPFL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Test of the relabel rules of the atlas merging."""
+import json
+
+import numpy as np
+import pytest
+
+from atlannot.merge.coarse import manual_relabel
+from atlannot.merge.common import descendants, replace
+from atlannot.merge.fine import manual_relabel_1
+from atlannot.merge.rules import RuleTable, apply_rules, default_rules, load_rules
+from atlannot.region_meta import RegionMeta
+
+
+@pytest.fixture()
+def region_meta():
+    # 1 (root)
+    # ├── 2 (Child 1)
+    # │   ├── 4 (Grandchild 1)
+    # │   └── 5 (Grandchild 2)
+    # └── 3 (Child 2)
+    with open("tests/data/structure_graph_mini.json") as fh:
+        structure_graph = json.load(fh)
+
+    return RegionMeta.from_dict(structure_graph)
+
+
+def test_exact_ids():
+    table = RuleTable(
+        [
+            {"ids": [1, 2], "to": 3},
+            {"ids": [2], "to": 4},
+            {"ids": [5], "to": 6, "atlases": ["ccfv3"]},
+        ]
+    )
+    assert table.compile() == {1: 3, 2: 3, 5: 6}
+    assert table.compile(atlas="ccfv2") == {1: 3, 2: 3}
+
+    ids = np.array([0, 1, 2, 5, 7])
+    table.apply(ids, atlas="ccfv3")
+    assert ids.tolist() == [0, 3, 3, 6, 7]
+
+
+def test_transitive_moves():
+    table = RuleTable(
+        [{"ids": [1], "to": 2}, {"ids": [3], "to": 4}, {"ids": [2], "to": 3}]
+    )
+    assert table.compile() == {1: 4, 2: 4, 3: 4}
+
+    # Moves to the region itself are ignored
+    table = RuleTable([{"ids": [1, 2], "to": 2}])
+    assert table.compile() == {1: 2}
+
+
+def test_cycle():
+    table = RuleTable(
+        [{"ids": [1], "to": 2}, {"ids": [2], "to": 3}, {"ids": [3], "to": 1}]
+    )
+    with pytest.raises(ValueError, match="cycle"):
+        table.compile()
+
+
+def test_subtree_and_pattern(region_meta):
+    table = RuleTable([{"subtree": 2}])
+    assert table.compile(region_meta) == {4: 2, 5: 2}
+
+    table = RuleTable([{"pattern": "Grandchild", "to": 3}])
+    assert table.compile(region_meta) == {4: 3, 5: 3}
+    assert table.compile(region_meta, region_ids={5, 3}) == {5: 3}
+
+    table = RuleTable([{"pattern": "Child", "within": "Child 1", "to": 3}])
+    assert table.compile(region_meta) == {2: 3, 4: 3, 5: 3}
+
+    with pytest.raises(ValueError, match="region metadata"):
+        table.compile()
+
+
+@pytest.mark.parametrize(
+    "rule",
+    [
+        {"to": 1},
+        {"ids": [1], "subtree": 2},
+        {"ids": [1]},
+        {"ids": [1], "to": 2, "within": "root"},
+        {"ids": [1], "to": 2, "target": 3},
+    ],
+)
+def test_malformed_rule(rule):
+    with pytest.raises(ValueError):
+        RuleTable([rule])
+
+
+@pytest.mark.parametrize("suffix", [".json", ".yaml"])
+def test_load_rules(tmp_path, suffix):
+    path = tmp_path / f"rules{suffix}"
+    path.write_text('{"stage": [{"ids": [1], "to": 2}]}')
+    tables = load_rules(path)
+    assert list(tables) == ["stage"]
+    assert tables["stage"].compile() == {1: 2}
+
+    ids_v2 = np.array([1, 2])
+    ids_v3 = np.array([1, 3])
+    apply_rules(tables, "stage", {"ccfv2": ids_v2, "ccfv3": ids_v3})
+    apply_rules(tables, "other stage", {"ccfv2": ids_v2})
+    assert ids_v2.tolist() == [2, 2]
+    assert ids_v3.tolist() == [2, 3]
+
+
+@pytest.mark.parametrize("strategy", ["coarse", "fine"])
+def test_default_rules(strategy, region_meta):
+    tables = default_rules(strategy)
+    assert "manual_1" in tables
+    for stage, table in tables.items():
+        assert len(table) > 0
+        if stage == "descendants":
+            # Selects a subtree that is not in the mini structure graph
+            continue
+        for atlas in ["ccfv2", "ccfv3"]:
+            table.compile(region_meta, atlas=atlas)
+
+
+def test_default_rules_cached(monkeypatch):
+    tables = default_rules("coarse")
+    monkeypatch.setattr("atlannot.merge.rules.load_rules", None)
+    tables_again = default_rules("coarse")
+    assert tables_again == tables
+    assert tables_again is not tables
+
+
+def test_fine_descendants():
+    # 1 (root)
+    # ├── 795 (Child 1)
+    # │   ├── 4 (Grandchild 1)
+    # │   └── 5 (Grandchild 2)
+    # └── 3 (Child 2)
+    with open("tests/data/structure_graph_mini.json") as fh:
+        structure_graph = json.load(fh)
+    child = structure_graph["children"][0]
+    child["id"] = 795
+    for grandchild in child["children"]:
+        grandchild["parent_structure_id"] = 795
+    rm = RegionMeta.from_dict(structure_graph)
+    all_v2_region_ids = {1, 795, 4}
+    all_v3_region_ids = {1, 795, 4, 5}
+
+    # The loop that the "descendants" stage replaces
+    expected_v2 = np.array([0, 4, 5, 3])
+    expected_v3 = expected_v2.copy()
+    for id_ in descendants(795, all_v2_region_ids, rm):
+        if id_ in all_v2_region_ids:
+            replace(expected_v2, id_, 795)
+        if id_ in all_v3_region_ids:
+            replace(expected_v3, id_, 795)
+
+    ids_v2 = np.array([0, 4, 5, 3])
+    ids_v3 = ids_v2.copy()
+    v3_descendant_ids = {
+        id_ for id_ in all_v3_region_ids if id_ in all_v2_region_ids or rm.is_leaf(id_)
+    }
+    tables = default_rules("fine")
+    apply_rules(tables, "descendants", {"ccfv2": ids_v2}, rm, all_v2_region_ids)
+    apply_rules(tables, "descendants", {"ccfv3": ids_v3}, rm, v3_descendant_ids)
+
+    assert ids_v2.tolist() == expected_v2.tolist() == [0, 795, 5, 3]
+    assert ids_v3.tolist() == expected_v3.tolist() == [0, 795, 795, 3]
+
+
+def test_manual_relabel():
+    ids_v2 = np.array([60, 96, 423, 999], dtype=np.uint32)
+    ids_v3 = ids_v2.copy()
+    manual_relabel(ids_v2, ids_v3)
+    assert ids_v2.tolist() == [28, 607, 423, 20]
+    assert ids_v3.tolist() == [60, 607, 423, 999]
+
+    ids_v2 = np.array([60, 96, 423, 999], dtype=np.uint32)
+    ids_v3 = ids_v2.copy()
+    manual_relabel_1(ids_v2, ids_v3)
+    assert ids_v2.tolist() == [28, 607, 382, 20]
+    assert ids_v3.tolist() == [60, 607, 382, 999]
@@ -12,11 +12,18 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 """Test for notebook package."""
+import io
+
 import matplotlib.patches as patches
 import numpy as np
 import pytest
 
-from atlannot.notebook.util import create_legend_handles
+from atlannot.atlas.align import unfurl_regions
+from atlannot.notebook.util import (
+    create_legend_handles,
+    print_level_misalignments,
+    print_misalignments,
+)
 from atlannot.region_meta import RegionMeta
 
 
@@ -35,3 +42,19 @@ class TestNotebook:
         assert len(handles) == max_value
         for handle in handles:
             assert isinstance(handle, patches.Patch)
+
+    def test_print_level_misalignments(self):
+        region_meta = RegionMeta.load_json("tests/data/structure_graph_mini.json")
+        rng = np.random.default_rng(0)
+        atlas_1 = rng.choice([0, 1, 2, 3, 4, 5], size=(4, 10, 10))
+        atlas_2 = rng.choice([0, 1, 2, 3, 4, 5], size=(4, 10, 10))
+
+        expected = io.StringIO()
+        print_misalignments(
+            unfurl_regions(atlas_1, region_meta),
+            unfurl_regions(atlas_2, region_meta),
+            file=expected,
+        )
+        output = io.StringIO()
+        print_level_misalignments(atlas_1, atlas_2, region_meta, file=output)
+        assert output.getvalue() == expected.getvalue()
@@ -15,6 +15,7 @@ import json
 import logging
 import textwrap
 
+import numpy as np
 import pytest
 
 from atlannot.region_meta import RegionMeta
@@ -242,6 +243,7 @@ def test_descendants(structure_graph):
     assert rm.descendants(2) == {2, 4, 5}
     assert rm.descendants([2, 3]) == {2, 3, 4, 5}
     assert rm.descendants([1, 2]) == {1, 2, 3, 4, 5}
+    assert rm.descendants(0) == {0, 1, 2, 3, 4, 5}
 
 
 def test_depth(structure_graph):
@@ -357,3 +359,176 @@ def test_print_regions(structure_graph, capsys):
     """
     assert stdout == textwrap.dedent(expect_stdout)
     assert stderr == ""
+
+
+def test_find_ids(structure_graph):
+    rm = RegionMeta.from_dict(structure_graph)
+    names = ["Child 2", "child 1", "Non-existing", "root"]
+    np.testing.assert_array_equal(rm.find_ids(names), [3, -1, -1, 1])
+    np.testing.assert_array_equal(
+        rm.find_ids(names, case_sensitive=False), [3, 2, -1, 1]
+    )
+    acronyms = [rm.acronym(id_) for id_ in [5, 0, 2]]
+    np.testing.assert_array_equal(rm.find_ids(acronyms, acronym=True), [5, 0, 2])
+    assert rm.find_ids([]).shape == (0,)
+
+
+def test_find_by_prefix(structure_graph):
+    rm = RegionMeta.from_dict(structure_graph)
+    assert rm.find_by_prefix("Child") == [2, 3]
+    assert rm.find_by_prefix("child") == []
+    assert rm.find_by_prefix("grand", case_sensitive=False) == [4, 5]
+    assert rm.find_by_prefix("") == [2, 3, 4, 5, 0, 1]
+    assert rm.find_by_prefix(rm.acronym(4), acronym=True) == [4]
+
+
+def test_indexes_follow_added_regions(structure_graph):
+    rm = RegionMeta.from_dict(structure_graph)
+    assert rm.find_by_name("New region") is None
+    assert list(rm.ids_at_level(4)) == []
+
+    rm.name_[6] = "New region"
+    rm.acronym_[6] = "NR"
+    rm.level[6] = 4
+    assert rm.find_by_name("New region") == 6
+    assert rm.find_by_acronym("NR") == 6
+    assert list(rm.ids_at_level(4)) == [6]
+
+
+def test_indexes_follow_modified_regions(structure_graph):
+    rm = RegionMeta.from_dict(structure_graph)
+    assert rm.find_by_name("Child 1") == 2
+    assert rm.find_by_prefix("Gc", acronym=True) == [4, 5]
+
+    # Rename in place, the number of regions doesn't change
+    rm.name_[2] = "Basic"
+    rm.acronym_.update({4: "X4"})
+    assert rm.find_by_name("Child 1") is None
+    assert rm.find_by_name("Basic") == 2
+    assert rm.find_by_prefix("Gc", acronym=True) == [5]
+
+    rm.level[5] = 4
+    del rm.level[4]
+    assert list(rm.ids_at_level(3)) == []
+    assert list(rm.ids_at_level(4)) == [5]
+
+    # New dictionaries are tracked as well
+    rm.name_ = {**rm.name_, 3: "Other"}
+    assert rm.find_by_name("Other") == 3
+    rm.name_[3] = "Child 2"
+    assert rm.find_by_name("Other") is None
+
+
+def assert_same_region_meta(rm, rm_expected):
+    for attr in [
+        "background_id",
+        "root_id",
+        "atlas_id",
+        "ontology_id",
+        "acronym_",
+        "name_",
+        "color_hex_triplet",
+        "graph_order",
+        "st_level",
+        "hemisphere_id",
+        "parent_id",
+        "children_ids",
+        "level",
+    ]:
+        assert getattr(rm, attr) == getattr(rm_expected, attr), attr
+        if isinstance(getattr(rm, attr), dict):
+            assert list(getattr(rm, attr)) == list(getattr(rm_expected, attr))
+
+
+def test_snapshot(structure_graph, tmp_path):
+    structure_graph["children"][0]["atlas_id"] = None
+    structure_graph["children"][1]["name"] = "Child 2 – ünïcode"
+    structure_graph["children"][1]["acronym"] = None
+    structure_graph["children"][0]["color_hex_triplet"] = ""
+    rm_expected = RegionMeta.from_dict(structure_graph)
+    rm_expected.save_snapshot(tmp_path / "snapshot")
+    rm = RegionMeta.load_snapshot(tmp_path / "snapshot")
+    assert_same_region_meta(rm, rm_expected)
+    assert rm.acronym(3) is None
+    assert rm.color_hex_triplet[2] == ""
+    assert rm.to_dict() == structure_graph
+    assert rm.find_by_name("Child 2 – ünïcode") == 3
+    assert list(rm.ids_at_level(2)) == [2, 3]
+
+
+def test_load_json_cache(structure_graph, tmp_path, monkeypatch):
+    json_path = tmp_path / "structure_graph.json"
+    with json_path.open("w") as fh:
+        json.dump(structure_graph, fh)
+    cache_dir = tmp_path / "cache"
+
+    rm = RegionMeta.load_json(json_path, use_cache=True, cache_dir=cache_dir)
+    snapshots = list(cache_dir.iterdir())
+    assert len(snapshots) == 1
+
+    # The snapshot is used instead of the JSON file
+    monkeypatch.setattr(RegionMeta, "from_dict", None)
+    rm_cached = RegionMeta.load_json(json_path, use_cache=True, cache_dir=cache_dir)
+    assert_same_region_meta(rm_cached, rm)
+    monkeypatch.undo()
+
+    # Modified JSON files get a new snapshot
+    structure_graph["name"] = "new root"
+    with json_path.open("w") as fh:
+        json.dump(structure_graph, fh)
+    rm = RegionMeta.load_json(json_path, use_cache=True, cache_dir=cache_dir)
+    assert rm.name(1) == "new root"
+    assert len(list(cache_dir.iterdir())) == 2
+
+    # Invalid snapshots are ignored and replaced
+    structure_graph["name"] = "root"
+    with json_path.open("w") as fh:
+        json.dump(structure_graph, fh)
+    for name in ["header.npy", "strings.npy"]:
+        array_path = snapshots[0] / name
+        array_path.write_bytes(array_path.read_bytes()[:-3])
+        rm = RegionMeta.load_json(json_path, use_cache=True, cache_dir=cache_dir)
+        assert rm.name(1) == "root"
+        assert_same_region_meta(RegionMeta.load_snapshot(snapshots[0]), rm)
+
+    # The cache is used by default, in the default cache directory
+    cache_dir = tmp_path / "xdg" / "atlannot" / "region_meta"
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "xdg"))
+    RegionMeta.load_json(json_path, use_cache=False)
+    assert not cache_dir.exists()
+    RegionMeta.load_json(json_path)
+    assert len(list(cache_dir.iterdir())) == 1
+
+    # Opting out ignores existing snapshots
+    monkeypatch.setattr(RegionMeta, "load_snapshot", None)
+    rm = RegionMeta.load_json(json_path, use_cache=False)
+    assert rm.name(1) == "root"
+
+
+def test_iter_regions(structure_graph):
+    rm = RegionMeta.from_dict(structure_graph)
+    assert list(rm.iter_regions()) == [1, 2, 4, 5, 3]
+    assert list(rm.iter_regions(2)) == [2, 4, 5]
+    assert list(rm.iter_regions(3)) == [3]
+
+
+def test_deep_hierarchy(structure_graph, capsys):
+    # Deeper than the default recursion limit
+    depth = 3000
+    regions = [dict(structure_graph, id=i, children=[]) for i in range(1, depth + 1)]
+    for parent, child in zip(regions, regions[1:]):
+        child["parent_structure_id"] = parent["id"]
+        parent["children"].append(child)
+    rm = RegionMeta.from_dict(regions[0])
+    assert rm.depth == depth
+    assert list(rm.iter_regions()) == list(range(1, depth + 1))
+
+    region = rm.to_dict()
+    for i in range(1, depth + 1):
+        assert region["id"] == i
+        region = region["children"][0] if i < depth else region
+    assert region["children"] == []
+
+    rm.print_regions(acronym=True)
+    stdout, _ = capsys.readouterr()
+    assert len(stdout.splitlines()) == depth
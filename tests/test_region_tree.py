@@ -0,0 +1,201 @@
+# Copyright 2022, Blue Brain Project, EPFL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+
+import numpy as np
+import pytest
+
+from atlannot.merge.common import descendants
+from atlannot.region_meta import RegionMeta
+from atlannot.region_tree import RegionTree
+
+
+@pytest.fixture()
+def region_meta():
+    # The mini structure graph has the following simple structure:
+    # 1 (root)
+    # ├── 2 (Child 1)
+    # │   ├── 4 (Grandchild 1)
+    # │   └── 5 (Grandchild 2)
+    # └── 3 (Child 2)
+    with open("tests/data/structure_graph_mini.json") as fh:
+        structure_graph = json.load(fh)
+
+    return RegionMeta.from_dict(structure_graph)
+
+
+def test_freeze(region_meta):
+    tree = region_meta.freeze()
+    assert isinstance(tree, RegionTree)
+    assert len(tree) == 6
+    assert tree.root_id == 1
+    assert tree.background_id == 0
+    assert 4 in tree
+    assert 6 not in tree
+    np.testing.assert_array_equal(tree.ids, [0, 1, 2, 3, 4, 5])
+    np.testing.assert_array_equal(tree.level, [0, 1, 2, 2, 3, 3])
+    assert tree.names == [region_meta.name(id_) for id_ in range(6)]
+    assert tree.acronyms == [region_meta.acronym(id_) for id_ in range(6)]
+
+
+def test_index(region_meta):
+    tree = region_meta.freeze()
+    np.testing.assert_array_equal(tree.index([5, 0, 7, -1, 3]), [5, 0, -1, -1, 3])
+    assert tree.index(2) == 2
+
+
+def test_bulk_queries(region_meta):
+    tree = region_meta.freeze()
+    ids = np.array([[1, 2], [4, 0]])
+    np.testing.assert_array_equal(tree.parent_ids(ids), [[0, 1], [2, -1]])
+    np.testing.assert_array_equal(tree.levels(ids), [[1, 2], [3, 0]])
+    np.testing.assert_array_equal(tree.is_leaf(ids), [[False, False], [True, False]])
+    with pytest.raises(KeyError, match=r"\[6, 7\]"):
+        tree.levels([1, 7, 6])
+
+
+def test_is_ancestor(region_meta):
+    tree = region_meta.freeze()
+    ids = np.arange(6)
+    for ancestor in ids:
+        expected = [ancestor in region_meta.ancestors(id_, True) for id_ in ids]
+        np.testing.assert_array_equal(tree.is_ancestor(ancestor, ids), expected)
+    # Broadcasting
+    result = tree.is_ancestor(ids[:, np.newaxis], ids[np.newaxis, :])
+    assert result.shape == (6, 6)
+    assert result.sum() == sum(len(region_meta.descendants(id_)) for id_ in ids)
+
+
+def test_children_descendants_ancestors(region_meta):
+    tree = region_meta.freeze()
+    for id_ in range(6):
+        assert tree.children_ids(id_).tolist() == list(region_meta.children(id_))
+        descendants_ = tree.descendants(id_)
+        assert descendants_[0] == id_
+        assert set(descendants_.tolist()) == region_meta.descendants(id_)
+        assert len(descendants_) == len(region_meta.descendants(id_))
+        for include_background in (False, True):
+            ancestors = tree.ancestors(id_, include_background)
+            expected = region_meta.ancestors(id_, include_background)
+            assert set(ancestors.tolist()) == expected
+    np.testing.assert_array_equal(tree.descendants(1), [1, 2, 4, 5, 3])
+    np.testing.assert_array_equal(tree.ancestors(5), [5, 2, 1])
+    np.testing.assert_array_equal(tree.descendants_of([4, 2, 3]), [2, 3, 4, 5])
+    np.testing.assert_array_equal(tree.descendants_of(5), [5])
+
+
+def test_children_order():
+    # The children are in the order in which they were added, not sorted
+    rm = RegionMeta()
+    rm.root_id = 10
+    for id_, parent_id in [(10, 0), (30, 10), (20, 10), (15, 20)]:
+        rm.parent_id[id_] = parent_id  # type: ignore
+        rm.children_ids[id_] = []
+        rm.children_ids[parent_id].append(id_)
+    tree = rm.freeze()
+    np.testing.assert_array_equal(tree.children_ids(10), [30, 20])
+    np.testing.assert_array_equal(tree.descendants(10), [10, 30, 20, 15])
+    np.testing.assert_array_equal(tree.levels(np.array([10, 30, 20, 15])), [1, 2, 2, 3])
+
+
+def test_invalid_trees():
+    with pytest.raises(ValueError, match="sorted"):
+        RegionTree(np.array([0, 2, 1]), np.array([-1, 0, 0]))
+    with pytest.raises(ValueError, match="cycle"):
+        RegionTree(np.array([0, 1, 2]), np.array([-1, 2, 1]))
+
+
+@pytest.mark.parametrize("allowed_ids", [set(), {2}, {1, 2, 3}])
+def test_merge_descendants(region_meta, allowed_ids):
+    tree = region_meta.freeze()
+    for id_ in range(6):
+        expected = descendants(id_, allowed_ids, region_meta)
+        assert descendants(id_, allowed_ids, tree) == expected
+    assert descendants(1, allowed_ids, tree) == {4, 5, 3} | allowed_ids - {1}
+
+
+def test_ancestors_at_level(region_meta):
+    tree = region_meta.freeze()
+    ids = np.array([0, 1, 2, 3, 4, 5, 99])
+    np.testing.assert_array_equal(
+        tree.ancestors_at_level(ids, 1), [0, 1, 1, 1, 1, 1, 99]
+    )
+    np.testing.assert_array_equal(
+        tree.ancestors_at_level(ids, 2), [0, 1, 2, 3, 2, 2, 99]
+    )
+    np.testing.assert_array_equal(tree.ancestors_at_level(ids, 3), ids)
+
+
+def test_nearest_ancestors(region_meta):
+    tree = region_meta.freeze()
+    ids = np.array([[0, 1, 2], [3, 4, 5]])
+    np.testing.assert_array_equal(
+        tree.nearest_ancestors(ids, {2, 3}), [[0, 0, 2], [3, 2, 2]]
+    )
+    np.testing.assert_array_equal(
+        tree.nearest_ancestors(ids, [1, 5, 99], fill_value=-1), [[-1, 1, 1], [1, 1, 5]]
+    )
+    assert tree.nearest_ancestors(99, [1]) == 0
+
+
+@pytest.mark.parametrize(
+    "pattern",
+    ["root", "background", "child", "Child 1", "Grand", r"[c|C]hild", r"\w \d$", "x"],
+)
+def test_regions_like(region_meta, pattern):
+    tree = region_meta.freeze()
+    expected = {id_ for id_ in range(6) if region_meta.in_region_like(pattern, id_)}
+    mask = tree.name_mask(pattern)
+    assert set(tree.ids[mask].tolist()) == expected
+    assert tree.regions_like(pattern) == expected
+    # Memoized
+    assert tree.name_mask(pattern) is mask
+    assert tree.regions_like(pattern) is tree.regions_like(pattern)
+    with pytest.raises(ValueError):
+        mask[0] = True
+
+
+def test_lca(region_meta):
+    tree = region_meta.freeze()
+    ids = np.arange(6)
+    ids_1, ids_2 = np.meshgrid(ids, ids, indexing="ij")
+    lca = tree.lca(ids_1, ids_2)
+    distance = tree.tree_distance(ids_1, ids_2)
+    for id_1, id_2, lca_, distance_ in zip(
+        ids_1.ravel(), ids_2.ravel(), lca.ravel(), distance.ravel()
+    ):
+        ancestors_1 = tree.ancestors(id_1, include_background=True)
+        ancestors_2 = tree.ancestors(id_2, include_background=True)
+        common = [id_ for id_ in ancestors_1 if id_ in ancestors_2]
+        assert lca_ == common[0]
+        assert distance_ == ancestors_1.tolist().index(
+            lca_
+        ) + ancestors_2.tolist().index(lca_)
+    assert tree.lca(4, 5) == 2
+    assert tree.lca(4, 3) == 1
+    assert tree.tree_distance(4, 3) == 3
+    np.testing.assert_array_equal(tree.lca([4, 5], 5), [2, 5])
+
+
+def test_lca_deep_and_disconnected():
+    # A chain 1 - 2 - ... - 40 plus a second root 100 with child 101
+    ids = np.array([*range(1, 41), 100, 101])
+    parent = np.array([-1, *range(39), -1, 40])
+    tree = RegionTree(ids, parent, background_id=1)
+    assert tree.lca(40, 17) == 17
+    assert tree.lca(np.array([40, 30]), np.array([20, 35])).tolist() == [20, 30]
+    assert tree.tree_distance(40, 2) == 38
+    assert tree.lca(101, 5) == -1
+    assert tree.tree_distance(101, 5) == -1
+    assert tree.lca(101, 100) == 100